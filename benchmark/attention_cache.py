@@ -0,0 +1,69 @@
+"""
+Decode-time benchmark of the attention key projection cache (CPU)
+
+Speller.forward projects the listener feature with Attention.psi once per utterance and reuses it on every
+decoder step. This script compares it against recomputing the projection on every step (the previous behaviour).
+
+Usage: python3 benchmark/attention_cache.py [config ...] [--batch_size 8] [--n_iter 3]
+"""
+import os
+import sys
+import time
+import argparse
+import yaml
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from model.las_model import Speller
+from util.functions import create_onehot_variable
+
+
+def greedy_decode(speller, listener_feature, cache_keys):
+    # Greedy decoding over max_label_len steps, same as Speller.forward with decode_mode 1
+    batch_size = listener_feature.size(0)
+    output_word = create_onehot_variable(torch.zeros(batch_size, 1), speller.label_dim)
+    rnn_input = torch.cat([output_word, listener_feature[:, 0:1, :]], dim=-1)
+    comp_listener_feature = speller.attention.preprocess_listener_feature(listener_feature) if cache_keys else None
+    hidden_state = None
+    for _ in range(speller.max_label_len):
+        raw_pred, hidden_state, context, _ = speller.forward_step(rnn_input, hidden_state, listener_feature,
+                                                                  comp_listener_feature)
+        output_word = speller.index_to_onehot(raw_pred.argmax(dim=-1), raw_pred)
+        rnn_input = torch.cat([output_word.unsqueeze(1), context.unsqueeze(1)], dim=-1)
+
+
+def benchmark(conf, batch_size, timestep, n_iter):
+    model_parameter = dict(conf['model_parameter'], use_gpu=False)
+    speller = Speller(**model_parameter).eval()
+    listener_timestep = timestep // 2**model_parameter['listener_layer']
+    listener_feature = torch.randn(batch_size, listener_timestep, 2*model_parameter['listener_hidden_dim'])
+
+    elapsed = {}
+    with torch.no_grad():
+        for cache_keys in [False, True]:
+            greedy_decode(speller, listener_feature, cache_keys)  # warm up
+            begin = time.time()
+            for _ in range(n_iter):
+                greedy_decode(speller, listener_feature, cache_keys)
+            elapsed[cache_keys] = (time.time() - begin) / n_iter
+    return listener_timestep, model_parameter['max_label_len'], elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decode-time benchmark of the attention key projection cache.')
+    parser.add_argument('config_path', type=str, nargs='*',
+                        default=['config/las_timit_config.yaml', 'config/libri/las_libri_config.yaml'])
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--timestep', type=int, default=None,
+                        help='Input frames per utterance (default: max_timestep in config, or 1600)')
+    parser.add_argument('--n_iter', type=int, default=3)
+    paras = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    for config_path in paras.config_path:
+        conf = yaml.safe_load(open(config_path, 'r'))
+        timestep = paras.timestep or conf['model_parameter'].get('max_timestep', 1600)
+        listener_timestep, max_label_len, elapsed = benchmark(conf, paras.batch_size, timestep, paras.n_iter)
+        print('{}: batch {}, T {}, {} steps | per-step keys {:.3f}s, cached keys {:.3f}s, speedup {:.2f}x'
+              .format(config_path, paras.batch_size, listener_timestep, max_label_len,
+                      elapsed[False], elapsed[True], elapsed[False] / elapsed[True]))
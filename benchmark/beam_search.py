@@ -0,0 +1,80 @@
+"""
+Speller.beam_search against greedy decoding (CPU)
+
+Random spellers (with an <eos> bias drawn per trial, so that hypotheses end at various steps) decode random listener
+features. Checks that a beam of 1 gives the labels of greedy decoding (decode_mode 1) truncated at <eos>, for
+length_penalty 0 and 1, then times beam sizes.
+
+Usage: python3 benchmark/beam_search.py [config] [--trials 20] [--batch_size 16] [--beam_sizes 1 2 5 10]
+"""
+import os
+import sys
+import time
+import argparse
+import yaml
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from model.las_model import Speller
+
+
+def greedy_labels(speller, listener_feature):
+    # Labels of Speller.forward without ground truth (decode_mode 1), each cut after its first <eos>
+    # Decoding stops early (forward_early_stop) and drops finished sequences from the decoder batch as beam_search drops
+    # done utterances, so that both decode every step with the same batch (results of the LSTM step depend on it)
+    raw_pred_seq, _ = speller(listener_feature, ground_truth=None)
+    return [cut_at_eos(label) for label in torch.stack(raw_pred_seq, dim=1).argmax(dim=-1).tolist()]
+
+
+def cut_at_eos(label):
+    return label[:label.index(1)+1] if 1 in label else label
+
+
+def random_speller(model_parameter, eos_bias):
+    speller = Speller(**dict(model_parameter, decode_mode=1, early_stop=True)).eval()
+    with torch.no_grad():
+        for param in speller.parameters():
+            param.mul_(4)
+        speller.character_distribution.bias[1] += eos_bias
+    return speller
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Speller.beam_search against greedy decoding.')
+    parser.add_argument('config_path', type=str, nargs='?', default='config/las_timit_config.yaml')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--timestep', type=int, default=40, help='Listener frames per utterance')
+    parser.add_argument('--beam_sizes', type=int, nargs='+', default=[1, 2, 5, 10])
+    paras = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    conf = yaml.safe_load(open(paras.config_path, 'r'))
+    model_parameter = dict(conf['model_parameter'], use_gpu=False)
+    feature_dim = 2*model_parameter['listener_hidden_dim']
+
+    for trial in range(paras.trials):
+        torch.manual_seed(trial)
+        speller = random_speller(model_parameter, eos_bias=float(torch.empty(1).uniform_(0, 8)))
+        listener_feature = torch.randn(paras.batch_size, paras.timestep, feature_dim)
+        greedy = greedy_labels(speller, listener_feature)
+        for length_penalty in [0.0, 1.0]:
+            best_label, _ = speller.beam_search(listener_feature, 1, length_penalty=length_penalty)
+            beam = [cut_at_eos(label) for label in best_label[:, 0, :].tolist()]
+            assert beam == greedy, 'beam 1 differs from greedy (trial {}, length_penalty {})'.format(
+                trial, length_penalty)
+    print('{} trials of {} utterances: beam 1 matches greedy decoding'.format(paras.trials, paras.batch_size))
+
+    print('{} cpus, {} torch threads, torch {}, batch of {} utterances, {} listener frames, max_label_len {}'.format(
+        os.cpu_count(), torch.get_num_threads(), torch.__version__, paras.batch_size, paras.timestep,
+        model_parameter['max_label_len']))
+    torch.manual_seed(0)
+    speller = random_speller(model_parameter, eos_bias=1.0)
+    listener_feature = torch.randn(paras.batch_size, paras.timestep, feature_dim)
+    for beam_size in paras.beam_sizes:
+        speller.beam_search(listener_feature, beam_size)
+        begin = time.time()
+        best_label, _ = speller.beam_search(listener_feature, beam_size)
+        elapsed = time.time() - begin
+        print('  beam {:3d}: {:8.1f} utterances/s, {:.1f} labels on average'.format(
+            beam_size, paras.batch_size / elapsed, (best_label[:, 0, :] > 0).sum(dim=1).float().mean()))
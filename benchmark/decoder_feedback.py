@@ -0,0 +1,61 @@
+"""
+Microbenchmark of the Speller feedback path (next-step one-hot input for decode_mode 1 and 2)
+
+Compares the former per-sample Python loop against Speller.index_to_onehot (a single scatter) for argmax and
+categorical sampling over batch sizes 4 to 256.
+
+Usage: python3 benchmark/decoder_feedback.py [--output_class_dim 63] [--n_iter 200] [--device cpu]
+"""
+import os
+import sys
+import time
+import argparse
+import torch
+from torch.distributions.categorical import Categorical
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from model.las_model import Speller
+
+
+def loop_feedback(raw_pred, sample):
+    index = Categorical(logits=raw_pred).sample() if sample else raw_pred.argmax(dim=1)
+    output_word = torch.zeros_like(raw_pred)
+    for idx, i in enumerate(index):
+        output_word[idx, int(i)] = 1
+    return output_word.unsqueeze(1)
+
+
+def scatter_feedback(raw_pred, sample):
+    index = Categorical(logits=raw_pred).sample() if sample else raw_pred.argmax(dim=-1)
+    return Speller.index_to_onehot(index, raw_pred).unsqueeze(1)
+
+
+def timeit(feedback, raw_pred, sample, n_iter):
+    feedback(raw_pred, sample)
+    if raw_pred.is_cuda:
+        torch.cuda.synchronize()
+    begin = time.time()
+    for _ in range(n_iter):
+        feedback(raw_pred, sample)
+    if raw_pred.is_cuda:
+        torch.cuda.synchronize()
+    return (time.time() - begin) / n_iter * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmark of the Speller feedback path.')
+    parser.add_argument('--output_class_dim', type=int, default=63)
+    parser.add_argument('--n_iter', type=int, default=200)
+    parser.add_argument('--device', type=str, default='cpu')
+    paras = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    print('{:>6} {:>8} {:>12} {:>12} {:>8}'.format('batch', 'mode', 'loop (us)', 'scatter (us)', 'speedup'))
+    for batch_size in [4, 8, 16, 32, 64, 128, 256]:
+        raw_pred = torch.log_softmax(torch.randn(batch_size, paras.output_class_dim, device=paras.device), dim=-1)
+        for sample in [False, True]:
+            assert torch.equal(loop_feedback(raw_pred, False), scatter_feedback(raw_pred, False))
+            loop_us = timeit(loop_feedback, raw_pred, sample, paras.n_iter)
+            scatter_us = timeit(scatter_feedback, raw_pred, sample, paras.n_iter)
+            print('{:>6} {:>8} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(batch_size, 'sample' if sample else 'argmax',
+                                                                    loop_us, scatter_us, loop_us / scatter_us))
@@ -0,0 +1,93 @@
+"""
+Edit distance kernels of util/edit_distance.py on TIMIT-like phone sequences
+
+Batches of reference sequences of reduced phones (--min_len to --max_len symbols) are paired with hypotheses holding
+--error_rate substitutions, insertions and deletions. Compares per pair the pure Python DP (edit_distance) and
+editdistance.eval, and per batch the row-wise NumPy DP (dp_distance_table) and the bit-parallel kernel (distances
+and full tables), after checking that they agree on every distance and on the operation counts of the alignments.
+
+Usage: python3 benchmark/edit_distance.py [--batch_sizes 32 256 2048] [--max_len 64] [--error_rate 0.25]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import editdistance as ed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from util.edit_distance import edit_distance, dp_distance_table, batch_alignment, bit_parallel_distance, \
+    bit_parallel_table, reduce_index
+
+
+def make_batch(rng, batch_size, min_len, max_len, error_rate):
+    # Hypothesis (seq1, at most max_len symbols) and reference (seq2) batches padded with -1
+    hyps, refs = [], []
+    for _ in range(batch_size):
+        ref = rng.choice(reduce_index, rng.randint(min_len, max_len + 1)).tolist()
+        hyp = []
+        for phn in ref:
+            edit = rng.rand()
+            if edit < error_rate / 3:
+                hyp.append(int(rng.choice(reduce_index)))
+            elif edit < error_rate * 2 / 3:
+                hyp.extend([phn, int(rng.choice(reduce_index))])
+            elif edit >= error_rate:
+                hyp.append(phn)
+        hyps.append(hyp[:max_len])
+        refs.append(ref)
+    return pad(hyps), pad(refs)
+
+
+def pad(seqs):
+    lengths = np.array([len(seq) for seq in seqs])
+    padded = np.full((len(seqs), max(lengths.max(), 1)), -1)
+    for k, seq in enumerate(seqs):
+        padded[k, :len(seq)] = seq
+    return padded, lengths
+
+
+def op_counts(ops):
+    return np.stack([(ops == op).sum(axis=1) for op in range(4)], axis=1)
+
+
+def timing(function, repeat):
+    function()
+    begin = time.time()
+    for _ in range(repeat):
+        function()
+    return (time.time() - begin) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Edit distance kernels on phone sequences.')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 256, 2048])
+    parser.add_argument('--min_len', type=int, default=10)
+    parser.add_argument('--max_len', type=int, default=64)
+    parser.add_argument('--error_rate', type=float, default=0.25)
+    parser.add_argument('--repeat', type=int, default=20)
+    paras = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    for batch_size in paras.batch_sizes:
+        (seq1, len1), (seq2, len2) = make_batch(rng, batch_size, paras.min_len, paras.max_len, paras.error_rate)
+        pairs = [(s1[:l1], s2[:l2]) for s1, l1, s2, l2 in zip(seq1.tolist(), len1, seq2.tolist(), len2)]
+
+        reference = np.array([ed.eval(s1, s2) for s1, s2 in pairs])
+        assert (np.array([edit_distance(s1, s2) for s1, s2 in pairs]) == reference).all()
+        assert (bit_parallel_distance(seq1, len1, seq2, len2) == reference).all()
+        table = dp_distance_table(seq1, len1, seq2, len2)
+        counts = op_counts(batch_alignment(seq1, len1, seq2, len2, table)[0])
+        bit_counts = op_counts(batch_alignment(seq1, len1, seq2, len2, bit_parallel_table(seq1, len1, seq2, len2))[0])
+        assert (counts == bit_counts).all() and (counts[:, 1:].sum(axis=1) == reference).all()
+
+        repeat = max(1, paras.repeat * 32 // batch_size)
+        results = [('python DP, per pair', timing(lambda: [edit_distance(s1, s2) for s1, s2 in pairs], 1)),
+                   ('editdistance.eval, per pair', timing(lambda: [ed.eval(s1, s2) for s1, s2 in pairs], repeat)),
+                   ('bit-parallel distances', timing(lambda: bit_parallel_distance(seq1, len1, seq2, len2), repeat)),
+                   ('row-wise DP tables', timing(lambda: dp_distance_table(seq1, len1, seq2, len2), repeat)),
+                   ('bit-parallel tables', timing(lambda: bit_parallel_table(seq1, len1, seq2, len2), repeat))]
+        print('batch of {} pairs, {:.1f} / {:.1f} symbols on average, distances and operation counts agree'.format(
+            batch_size, len1.mean(), len2.mean()))
+        for name, seconds in results:
+            print('  {:30s} {:9.3f} ms / batch {:9.0f} pairs/s'.format(name, seconds * 1000, batch_size / seconds))
@@ -0,0 +1,85 @@
+"""
+Benchmark of the spectral front-end (util/frontend.py) against the librosa / python_speech_features calls it replaces
+
+  log mel : librosa.power_to_db(librosa.feature.melspectrogram(..., center=False)) vs frontend.log_mel_spectrogram
+  logfbank: python_speech_features.logfbank vs frontend.logfbank (LibriSpeech fbank, skipped if the package is missing)
+
+Utterances are read from the TIMIT training list when --timit_path is given (run from util/timit, like the
+preprocess scripts), otherwise --n_utt synthetic utterances of TIMIT length (~3 s) are used.
+
+Usage: python3 benchmark/frontend.py [--timit_path <TIMIT folder>] [--n_utt 200] [--n_mels 40]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import librosa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from util.frontend import log_mel_spectrogram, logfbank
+
+
+def load_utterances(timit_path, n_utt):
+    if timit_path is None:
+        rng = np.random.RandomState(0)
+        return [(rng.randn(rng.randint(16000, 80000)) * 3000).astype(np.int16) for _ in range(n_utt)]
+    import pandas as pd
+    csv = pd.read_csv("timit_dataset_list/TRAIN_list.csv")
+    wav_fnames = [os.path.join(timit_path, fname + '.WAV') for fname in csv.values[:n_utt, 0]]
+    return [np.fromfile(wav_fname, dtype=np.int16)[512:] for wav_fname in wav_fnames]
+
+
+def librosa_log_mel(sample, n_mels):
+    return librosa.power_to_db(librosa.feature.melspectrogram(y=sample, sr=16000, n_fft=400, hop_length=160,
+                                                              n_mels=n_mels, center=False))
+
+
+def frontend_log_mel(sample, n_mels):
+    return log_mel_spectrogram(sample, sr=16000, n_fft=400, hop_length=160, n_mels=n_mels)
+
+
+def timeit(extract, samples, n_mels):
+    extract(samples[0], n_mels)
+    begin = time.time()
+    for sample in samples:
+        extract(sample, n_mels)
+    return time.time() - begin
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the spectral front-end.')
+    parser.add_argument('--timit_path', type=str, default=None)
+    parser.add_argument('--n_utt', type=int, default=200)
+    parser.add_argument('--n_mels', type=int, default=40)
+    paras = parser.parse_args()
+
+    utterances = load_utterances(paras.timit_path, paras.n_utt)
+    samples = [utterance / 32767.5 for utterance in utterances]
+    print('{} utterances, {:.1f} s of audio'.format(len(samples), sum(len(s) for s in samples) / 16000))
+
+    max_diff = max(np.max(np.abs(librosa_log_mel(s, paras.n_mels) - frontend_log_mel(s, paras.n_mels)))
+                   for s in samples[:20])
+    reference = timeit(librosa_log_mel, samples, paras.n_mels)
+    fused = timeit(frontend_log_mel, samples, paras.n_mels)
+    print('{:>10} {:>12} {:>12} {:>8} {:>10}'.format('feature', 'before (s)', 'after (s)', 'speedup', 'max diff'))
+    print('{:>10} {:>12.3f} {:>12.3f} {:>7.1f}x {:>10.1e}'.format('log mel', reference, fused, reference / fused,
+                                                                  max_diff))
+
+    try:
+        import python_speech_features
+    except ImportError:
+        print('python_speech_features not installed, logfbank skipped')
+    else:
+        def psf_logfbank(sample, nfilt):
+            return python_speech_features.logfbank(sample, 16000, winlen=0.025, nfilt=nfilt)
+
+        def frontend_logfbank(sample, nfilt):
+            return logfbank(sample, 16000, winlen=0.025, nfilt=nfilt)
+
+        max_diff = max(np.max(np.abs(psf_logfbank(u, paras.n_mels) - frontend_logfbank(u, paras.n_mels)))
+                       for u in utterances[:20])
+        reference = timeit(psf_logfbank, utterances, paras.n_mels)
+        fused = timeit(frontend_logfbank, utterances, paras.n_mels)
+        print('{:>10} {:>12.3f} {:>12.3f} {:>7.1f}x {:>10.1e}'.format('logfbank', reference, fused,
+                                                                      reference / fused, max_diff))
@@ -0,0 +1,83 @@
+"""
+Throughput of the LibriSpeech training loader (util/librispeech_dataset.py)
+
+Compares the former per-batch pandas lookups (data_table.loc + label split + np.load in the main process) with the
+index based loader reading features in DataLoader worker processes. Without --data_path a synthetic corpus of
+--n_utt fbank-40 utterances (5 to 16 s) is written to a temporary directory.
+
+Usage: python3 benchmark/librispeech_loader.py [--data_path <LibriSpeech>/train.csv] [--n_batch 500]
+                                               [--batch_size 32] [--num_workers 4]
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from util.librispeech_dataset import create_dataloader, ZeroPadding, LabelEncode
+
+
+def make_corpus(root, n_utt):
+    rng = np.random.RandomState(0)
+    lengths = np.sort(rng.randint(500, 1600, n_utt))[::-1]
+    with open(os.path.join(root, 'train.csv'), 'w') as f:
+        f.write('idx,input,label\n')
+        for i, length in enumerate(lengths):
+            path = os.path.join(root, '{}.fb40.npy'.format(i))
+            np.save(path, rng.randn(length, 40))
+            label = ''.join(' ' + str(c) for c in rng.randint(2, 30, length // 8))
+            f.write('{},{},{}\n'.format(i, path, label))
+    return os.path.join(root, 'train.csv')
+
+
+def legacy_batches(data_path, batch_size, n_batch):
+    data_table = pd.read_csv(data_path, index_col=0)
+    for index in np.random.randint(0, len(data_table), n_batch):
+        index = min(index, len(data_table) - batch_size)
+        X, Y = [], []
+        for i in range(batch_size):
+            X.append(np.load(data_table.loc[index + i]['input']))
+            Y.append([int(v) for v in data_table.loc[index + i]['label'].split(' ')[1:]])
+        yield ZeroPadding(X, len(X[0])), LabelEncode(Y, max(len(y) for y in Y) + 1)
+
+
+def loader_batches(data_path, batch_size, n_batch, num_workers):
+    loader = create_dataloader(data_path, 300, batch_size, True, True, 2, training=True, num_workers=num_workers)
+    for i, batch in enumerate(loader):
+        if i == n_batch:
+            break
+        yield batch
+
+
+def throughput(batches, batch_size):
+    begin = None
+    n_utt = 0
+    for i, _ in enumerate(batches):
+        # The first batch pays for worker start-up and index loading
+        if begin is None:
+            begin = time.time()
+            continue
+        n_utt += batch_size
+    return n_utt / (time.time() - begin)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the LibriSpeech training loader.')
+    parser.add_argument('--data_path', type=str, default=None)
+    parser.add_argument('--n_utt', type=int, default=2000)
+    parser.add_argument('--n_batch', type=int, default=500)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    paras = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        data_path = paras.data_path or make_corpus(root, paras.n_utt)
+        legacy = throughput(legacy_batches(data_path, paras.batch_size, paras.n_batch // 10), paras.batch_size)
+        print('pandas lookups       : {:8.0f} utt/s'.format(legacy))
+        for num_workers in sorted({0, paras.num_workers}):
+            loader = throughput(loader_batches(data_path, paras.batch_size, paras.n_batch, num_workers),
+                                paras.batch_size)
+            print('index, {} workers    : {:8.0f} utt/s'.format(num_workers, loader))
@@ -0,0 +1,74 @@
+"""
+Scaling of the process-parallel permutation feature importance (util/pfi.py) with the number of workers (CPU)
+
+A random LAS model scores --n_features x --n_repeats cells on a random TIMIT-like test set with 1, 2, 4, ... worker
+processes (up to --max_jobs, default cpu_count), after checking that every run gives the same result as n_jobs 1.
+The speedup is only meaningful up to the number of physical cores.
+
+Usage: python3 benchmark/pfi.py [config] [--n_utterances 96] [--n_features 8] [--n_repeats 2] [--max_jobs 8]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import yaml
+import numpy as np
+import torch
+
+# Workers are forked, the OpenMP thread pool must not be started before (see util/pfi.py)
+torch.set_num_threads(1)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from model.las_model import LAS, Listener, Speller
+from util.pfi import PermutationImportance, run_pfi
+
+
+def random_test_set(rng, n_utterances, max_timestep, feature_dim):
+    X = [rng.randn(rng.randint(max_timestep // 4, max_timestep), feature_dim).astype(np.float32)
+         for _ in range(n_utterances)]
+    Y = [np.repeat(rng.randint(0, 61, rng.randint(5, 30)), 3).astype(np.int32) for _ in range(n_utterances)]
+    return X, Y
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scaling of the process-parallel PFI with the number of workers.')
+    parser.add_argument('config_path', type=str, nargs='?', default='config/las_timit_config.yaml')
+    parser.add_argument('--n_utterances', type=int, default=96)
+    parser.add_argument('--n_features', type=int, default=8)
+    parser.add_argument('--n_repeats', type=int, default=2)
+    parser.add_argument('--max_timestep', type=int, default=320, help='Longest utterance in frames')
+    parser.add_argument('--max_jobs', type=int, default=os.cpu_count())
+    paras = parser.parse_args()
+
+    conf = yaml.safe_load(open(paras.config_path, 'r'))
+    conf['model_parameter'].update(use_gpu=False, max_timestep=paras.max_timestep, beam_size=1)
+    torch.manual_seed(0)
+    model = LAS(Listener(**conf['model_parameter']), Speller(**conf['model_parameter'])).eval()
+    with torch.no_grad():
+        # Sharper predictions than at initialization, so that permutations change the error rate
+        for param in model.parameters():
+            param.mul_(4)
+    X, Y = random_test_set(np.random.RandomState(0), paras.n_utterances, paras.max_timestep,
+                           conf['model_parameter']['input_feature_dim'])
+    engine = PermutationImportance(model, X, Y, conf, seed=1)
+
+    n_cells = 1 + paras.n_features * paras.n_repeats
+    print('{} cells of {} utterances, {} cpus'.format(n_cells, paras.n_utterances, os.cpu_count()))
+    result_dir = tempfile.mkdtemp()
+    n_jobs, reference, serial = 1, None, None
+    try:
+        while n_jobs <= max(paras.max_jobs, 1):
+            pkl_path = os.path.join(result_dir, 'pfi_{}.pkl'.format(n_jobs))
+            begin = time.time()
+            result = run_pfi(engine, range(paras.n_features), paras.n_repeats, pkl_path, n_jobs=n_jobs)
+            elapsed = time.time() - begin
+            reference = reference or result
+            serial = serial or elapsed
+            assert result == reference, 'n_jobs {} differs from n_jobs 1'.format(n_jobs)
+            print('  n_jobs {:3d}: {:7.2f} s {:6.2f} cells/s, speedup {:.2f}x'.format(
+                n_jobs, elapsed, n_cells / elapsed, serial / elapsed))
+            n_jobs *= 2
+    finally:
+        shutil.rmtree(result_dir)
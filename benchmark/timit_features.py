@@ -0,0 +1,156 @@
+"""
+Specs of util/timit/timit_features.yaml against the preprocessing scripts they replace (CPU)
+
+The scripts (util/timit/timit_preprocess_*.py and util/timit/old/) were removed once every one of them had a spec, run
+this from a checkout that still has them:
+
+    git worktree add /tmp/timit_scripts a0c3e67
+    python3 benchmark/timit_features.py /tmp/timit_scripts
+
+A synthetic corpus (random WAV / PHN files, 32 and 8 band spike files) is written in a temporary directory. For every
+script named in the yaml comments, its create_* function and create_feature of the spec compute the features of each
+utterance, which must agree to float32 precision. Then every spec is run through run_pipeline in a single pass and the
+stores are loaded back.
+
+Usage: python3 benchmark/timit_features.py <tree with the scripts> [--n_utt 6]
+"""
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import functools
+import yaml
+import numpy as np
+import librosa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util', 'timit'))
+import timit_pipeline
+from util.feature_store import load_feature_store
+
+spec_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util', 'timit', 'timit_features.yaml')
+phones = ['h#', 'sh', 'iy', 'hv', 'ae', 'dcl', 'd', 'pau']
+
+
+def positional_y(f):
+    # librosa >= 0.10 takes the signal as keyword only, the scripts pass it positionally
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if args:
+            kwargs['y'], args = args[0], args[1:]
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def script_specs(spec_path):
+    # script (relative to util/timit) -> store name, from the comment of each spec
+    mapping, name = {}, None
+    for line in open(spec_path):
+        match = re.match(r'^(\w+):', line)
+        name = match.group(1) if match else name
+        for script in re.findall(r'((?:old/)?timit_preprocess\w*\.py)', line):
+            mapping[script] = name
+    return mapping
+
+
+def write_corpus(root, filter_path, n_utt, rng):
+    # <root>/TIMIT, TIMIT_spikegram (32 bands), TIMIT_spikegram_8band, and <root>/work/cwd/timit_dataset_list (the
+    # scripts read the lists from timit_dataset_list/ and the gammatone filter from ../timit_dataset_list/)
+    work = os.path.join(root, 'work', 'cwd')
+    for list_dir in [os.path.join(work, 'timit_dataset_list'), os.path.join(root, 'work', 'timit_dataset_list')]:
+        os.makedirs(list_dir)
+        shutil.copy(filter_path, list_dir)
+    fnames = ['TRAIN/DR1/F{}/SX{}'.format(i, i) for i in range(n_utt)]
+    for split, list_name in enumerate(['TRAIN_list.csv', 'TEST_developmentset_list.csv', 'TEST_coreset_list.csv']):
+        np.savetxt(os.path.join(work, 'timit_dataset_list', list_name), fnames[split::3], fmt='%s')
+
+    spike_frame = timit_pipeline.spike_frame
+    for fname in fnames:
+        n_sample = rng.randint(16000, 56000)
+        wav_fname = os.path.join(root, 'TIMIT', fname + '.WAV')
+        os.makedirs(os.path.dirname(wav_fname))
+        np.concatenate([np.zeros(256, np.int16), (rng.randn(n_sample) * 2000).astype(np.int16)]).tofile(wav_fname)
+        bounds = [0] + sorted(rng.choice(np.arange(100, n_sample - 100), len(phones) - 1, replace=False)) + [n_sample]
+        phn = ''.join('{} {} {}\n'.format(bounds[i], bounds[i + 1], phone) for i, phone in enumerate(phones))
+        n_data = n_sample // spike_frame + 1
+        for corpus, n_band in [('TIMIT', 0), ('TIMIT_spikegram', 32), ('TIMIT_spikegram_8band', 8)]:
+            base = os.path.join(root, corpus, fname)
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            with open(base + '.PHN', 'w') as f:
+                f.write(phn)
+            if n_band:
+                num = rng.randint(500, 1500, n_data).astype(np.int32)
+                x = np.stack([rng.randint(0, n_band, num.sum()), rng.randn(num.sum()) * 0.1,
+                              rng.randint(0, spike_frame, num.sum()), rng.rand(num.sum())], axis=1)
+                x.tofile(base + '_spike.raw')
+                num.tofile(base + '_num.raw')
+    return work, fnames
+
+
+def script_create(script_path, in_dir):
+    # create_* function of a script, its module level code runs up to the preprocessing of the splits
+    source = open(script_path).read()
+    source = source[:source.index('##### PREPROCESSING')]
+    namespace = {'__name__': 'reference', '__file__': script_path}
+    argv, sys.argv = sys.argv, [script_path, in_dir, 'unused']
+    try:
+        exec(compile(source, script_path, 'exec'), namespace)
+    finally:
+        sys.argv = argv
+    return next(v for k, v in namespace.items() if k.startswith('create_') and callable(v))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Specs of timit_features.yaml against the preprocessing scripts.')
+    parser.add_argument('script_tree', type=str, help='Repository checkout with util/timit/timit_preprocess_*.py')
+    parser.add_argument('--n_utt', type=int, default=6)
+    paras = parser.parse_args()
+
+    for module, name in [(librosa.feature, 'melspectrogram'), (librosa.feature, 'mfcc'), (librosa, 'stft')]:
+        setattr(module, name, positional_y(getattr(module, name)))
+    librosa.core.stft = librosa.stft
+
+    script_dir = os.path.abspath(os.path.join(paras.script_tree, 'util', 'timit'))
+    specs = yaml.safe_load(open(spec_path, 'r'))
+    mapping = script_specs(spec_path)
+    scripts = sorted(os.path.join('old', f) for f in os.listdir(os.path.join(script_dir, 'old')) if f.endswith('.py'))
+    scripts += sorted(f for f in os.listdir(script_dir) if f.startswith('timit_preprocess_') and f.endswith('.py'))
+    assert not [s for s in scripts if s not in mapping], 'scripts without spec'
+    assert not [n for n in specs if n not in mapping.values()], 'specs without script'
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        work, fnames = write_corpus(root, os.path.join(script_dir, 'timit_dataset_list', 'Gammatone_Filter_Order4.raw'),
+                                    paras.n_utt, np.random.RandomState(0))
+        os.chdir(work)
+        worst = 0.0
+        for script in scripts:
+            name = mapping[script]
+            # Spikegram-only scripts take the spikegram directory as argument
+            spikegram_only = 'get_data(filename[:-4])' in open(os.path.join(script_dir, script)).read()
+            in_dir = os.path.join(root, 'TIMIT_spikegram' if spikegram_only else 'TIMIT')
+            create = script_create(os.path.join(script_dir, script), in_dir)
+            for fname in fnames:
+                reference, _ = create(os.path.join(in_dir, fname + '.WAV'))
+                feature = timit_pipeline.create_feature(
+                    timit_pipeline.Utterance(os.path.join(root, 'TIMIT', fname + '.WAV')), specs[name])
+                assert reference.shape == feature.shape, '{} {}: {} != {}'.format(
+                    script, name, reference.shape, feature.shape)
+                assert np.allclose(reference.astype(np.float32), feature.astype(np.float32), rtol=1e-5, atol=1e-4), \
+                    '{} differs from {}'.format(name, script)
+                worst = max(worst, np.max(np.abs(reference - feature)) / max(1.0, np.max(np.abs(reference))))
+            print('  {:50s} {:32s} {:4d} features'.format(script, name, feature.shape[1]))
+        print('{} scripts match their spec, largest relative difference {:.1e}'.format(len(scripts), worst))
+
+        timit_pipeline.run_pipeline(os.path.join(root, 'TIMIT'), specs, n_jobs=1)
+        for name in specs:
+            data = load_feature_store(os.path.join(root, 'TIMIT', name))
+            for X, Y in zip(data[0::2], data[1::2]):
+                assert all(x.shape[0] == len(y) for x, y in zip(X, Y)), 'frame / label mismatch in ' + name
+        print('{} specs computed in a single pass'.format(len(specs)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
@@ -18,15 +18,22 @@ class LAS(nn.Module):
         self.listener = listener
         self.speller = speller
 
-    def forward(self, batch_data, batch_label, tf_rate, ground_truth):
-        listner_feature = self.listener(batch_data)
-        raw_pred_seq, _ = self.speller(listner_feature, ground_truth=ground_truth, teacher_force_rate=tf_rate)
+    # batch_length holds the number of real (unpadded) frames of each utterance, None treats every frame as real
+    def forward(self, batch_data, batch_label, tf_rate, ground_truth, batch_length=None):
+        listner_feature, listner_length = self.listener(batch_data, batch_length)
+        raw_pred_seq, _ = self.speller(listner_feature, ground_truth=ground_truth, teacher_force_rate=tf_rate,
+                                       listener_length=listner_length)
         return raw_pred_seq
 
+    def beam_search(self, batch_data, beam_size, n_best=1, length_penalty=1.0, batch_length=None):
+        listner_feature, listner_length = self.listener(batch_data, batch_length)
+        return self.speller.beam_search(listner_feature, beam_size, n_best=n_best, length_penalty=length_penalty,
+                                        listener_length=listner_length)
+
 
 # BLSTM layer for pBLSTM
 # Step 1. Reduce time resolution to half
-# Step 2. Run through BLSTM
+# Step 2. Run through BLSTM (packed by input_len if given, so padded frames are skipped)
 # Note the input should have timestep%2 == 0
 class pBLSTMLayer(nn.Module):
     def __init__(self, input_feature_dim, hidden_dim, rnn_unit='LSTM', dropout_rate=0.0):
@@ -37,7 +44,14 @@ class pBLSTMLayer(nn.Module):
         self.BLSTM = self.rnn_unit(input_feature_dim*2, hidden_dim, 1, bidirectional=True,
                                    dropout=dropout_rate, batch_first=True)
     
-    def forward(self, input_x):
+    # Number of output frames for input_len input frames (a frame pair with one real frame is kept)
+    @staticmethod
+    def reduce_length(input_len):
+        if input_len is None:
+            return None
+        return (input_len + 1) // 2
+
+    def forward(self, input_x, input_len=None):
         self.BLSTM.flatten_parameters()
         batch_size = input_x.size(0)
         timestep = input_x.size(1)
@@ -45,11 +59,19 @@ class pBLSTMLayer(nn.Module):
         # Reduce time resolution
         input_x = input_x.contiguous().view(batch_size, int(timestep/2), feature_dim*2)
         # Bidirectional RNN
-        output, hidden = self.BLSTM(input_x)
+        if input_len is None:
+            output, hidden = self.BLSTM(input_x)
+        else:
+            packed_x = nn.utils.rnn.pack_padded_sequence(input_x, self.reduce_length(input_len).cpu(),
+                                                         batch_first=True, enforce_sorted=False)
+            output, hidden = self.BLSTM(packed_x)
+            output, _ = nn.utils.rnn.pad_packed_sequence(output, batch_first=True, total_length=int(timestep/2))
         return output, hidden
 
 # Listener is a pBLSTM stacking 3 layers to reduce time resolution 8 times
-# Input shape should be [# of sample, timestep, features]
+# Input shape should be [# of sample, timestep, features], input_len (LongTensor [# of sample]) the unpadded timesteps
+# Output: listener feature [# of sample, timestep / 2**listener_layer, 2*listener_hidden_dim] and its lengths
+#         (None if input_len is None)
 class Listener(nn.Module):
     def __init__(self, input_feature_dim, listener_hidden_dim, listener_layer, rnn_unit, use_gpu, dropout_rate=0.0, **kwargs):
         super(Listener, self).__init__()
@@ -66,23 +88,32 @@ class Listener(nn.Module):
         if self.use_gpu:
             self = self.cuda()
 
-    def forward(self, input_x):
-        output, _ = self.pLSTM_layer0(input_x)
+    def forward(self, input_x, input_len=None):
+        if input_len is not None:
+            # Drop the padding shared by the whole batch, keeping timestep a multiple of 2**listener_layer
+            time_scale = 2**self.listener_layer
+            timestep = int(np.ceil(int(input_len.max()) / time_scale)) * time_scale
+            input_x = input_x[:, :timestep]
+
+        output, _ = self.pLSTM_layer0(input_x, input_len)
+        output_len = pBLSTMLayer.reduce_length(input_len)
         for i in range(1, self.listener_layer):
-            output, _ = getattr(self, 'pLSTM_layer'+str(i))(output)
-        
-        return output
+            output, _ = getattr(self, 'pLSTM_layer'+str(i))(output, output_len)
+            output_len = pBLSTMLayer.reduce_length(output_len)
+
+        return output, output_len
 
 
 # Speller specified in the paper
 class Speller(nn.Module):
     def __init__(self, output_class_dim,  speller_hidden_dim, rnn_unit, speller_rnn_layer, use_gpu, max_label_len,
                  use_mlp_in_attention, mlp_dim_in_attention, mlp_activate_in_attention, listener_hidden_dim,
-                 multi_head, decode_mode, **kwargs):
+                 multi_head, decode_mode, early_stop=True, **kwargs):
         super(Speller, self).__init__()
         self.rnn_unit = getattr(nn, rnn_unit.upper())
         self.max_label_len = max_label_len
         self.decode_mode = decode_mode
+        self.early_stop = early_stop
         self.use_gpu = use_gpu
         self.float_type = torch.torch.cuda.FloatTensor if use_gpu else torch.FloatTensor
         self.label_dim = output_class_dim
@@ -96,15 +127,47 @@ class Speller(nn.Module):
             self = self.cuda()
 
     # Stepwise operation of each sequence
-    def forward_step(self, input_word, last_hidden_state, listener_feature):
+    # comp_listener_feature is the attention key projection of listener_feature, it stays the same for every step
+    # of an utterance so Speller.forward computes it once (see Attention.preprocess_listener_feature)
+    # listener_mask ([batch size, T], False on padding) keeps attention away from padded listener frames
+    def forward_step(self, input_word, last_hidden_state, listener_feature, comp_listener_feature=None,
+                     listener_mask=None):
         rnn_output, hidden_state = self.rnn_layer(input_word, last_hidden_state)
-        attention_score, context = self.attention(rnn_output, listener_feature)
+        attention_score, context = self.attention(rnn_output, listener_feature, comp_listener_feature, listener_mask)
         concat_feature = torch.cat([rnn_output.squeeze(dim=1), context], dim=-1)
         raw_pred = self.softmax(self.character_distribution(concat_feature))
 
         return raw_pred, hidden_state, context, attention_score
 
-    def forward(self, listener_feature, ground_truth=None, teacher_force_rate=0.9):
+    # One-hot input word for the next step from predicted indices [batch size], scattered on the device of raw_pred
+    # Output: [batch size, output_class_dim] with the same dtype as raw_pred
+    @staticmethod
+    def index_to_onehot(index, raw_pred):
+        return torch.zeros_like(raw_pred).scatter_(-1, index.unsqueeze(-1), 1.0)
+
+    # Next step's input word without teacher forcing, and the label predicted by each sequence
+    def feedback(self, raw_pred):
+        # Case 0. raw output as input
+        if self.decode_mode == 0:
+            return raw_pred.unsqueeze(1), raw_pred.argmax(dim=-1)
+        # Case 1. Pick character with max probability
+        elif self.decode_mode == 1:
+            word = raw_pred.argmax(dim=-1)
+        # Case 2. Sample categorical label from raw prediction (log probability)
+        else:
+            word = Categorical(logits=raw_pred).sample()
+        return self.index_to_onehot(word, raw_pred).unsqueeze(1), word
+
+    # Attention mask [batch size, T] from listener lengths, True on real frames (None if every frame is real)
+    @staticmethod
+    def get_listener_mask(listener_feature, listener_length):
+        if listener_length is None:
+            return None
+        timestep = torch.arange(listener_feature.size(1), device=listener_feature.device)
+        return timestep.unsqueeze(0) < listener_length.to(listener_feature.device).unsqueeze(1)
+
+    # ground_truth is the label index LongTensor [batch size, label length] used for teacher forcing
+    def forward(self, listener_feature, ground_truth=None, teacher_force_rate=0.9, listener_length=None):
         self.rnn_layer.flatten_parameters()
         if ground_truth is None:
             teacher_force_rate = 0
@@ -117,6 +180,12 @@ class Speller(nn.Module):
             output_word = output_word.cuda()
         rnn_input = torch.cat([output_word, listener_feature[:, 0:1, :]], dim=-1)
 
+        comp_listener_feature = self.attention.preprocess_listener_feature(listener_feature)
+        listener_mask = self.get_listener_mask(listener_feature, listener_length)
+
+        if ground_truth is None and self.early_stop:
+            return self.forward_early_stop(rnn_input, listener_feature, comp_listener_feature, listener_mask)
+
         hidden_state = None
         raw_pred_seq = []
         output_seq = []
@@ -128,40 +197,190 @@ class Speller(nn.Module):
             max_step = ground_truth.size()[1]
 
         for step in range(max_step):
-            raw_pred, hidden_state, context, attention_score = self.forward_step(rnn_input, hidden_state, listener_feature)
+            raw_pred, hidden_state, context, attention_score = self.forward_step(rnn_input, hidden_state, listener_feature,
+                                                                                 comp_listener_feature, listener_mask)
             raw_pred_seq.append(raw_pred)
             attention_record.append(attention_score)
             # Teacher force - use ground truth as next step's input
             if teacher_force:
-                output_word = ground_truth[:, step:step+1, :].type(self.float_type)
+                output_word = self.index_to_onehot(ground_truth[:, step], raw_pred).unsqueeze(1)
             else:
-                # Case 0. raw output as input
-                if self.decode_mode == 0:
-                    output_word = raw_pred.unsqueeze(1)
-                # Case 1. Pick character with max probability
-                elif self.decode_mode == 1:
-                    output_word = torch.zeros_like(raw_pred)
-                    for idx, i in enumerate(raw_pred.argmax(dim=1)):
-                        output_word[idx, int(i)] = 1
-                    output_word = output_word.unsqueeze(1)             
-                # Case 2. Sample categorical label from raw prediction
+                output_word, _ = self.feedback(raw_pred)
+
+            rnn_input = torch.cat([output_word, context.unsqueeze(1)], dim=-1)
+
+        return raw_pred_seq, attention_record
+
+    # Inference without teacher forcing that stops once every sequence has emitted <eos> (index 1)
+    # Finished sequences are compacted out of the decoder batch, the prediction they ended with is repeated in
+    # raw_pred_seq (and their attention score is zero) so every step keeps shape [batch size, output_class_dim].
+    # raw_pred_seq may be shorter than max_label_len, see util.functions.stack_raw_pred_seq
+    def forward_early_stop(self, rnn_input, listener_feature, comp_listener_feature, listener_mask=None):
+        eos = 1
+        batch_size = listener_feature.size(0)
+        active = torch.arange(batch_size, device=listener_feature.device)
+
+        hidden_state = None
+        raw_pred_seq = []
+        attention_record = []
+
+        for step in range(self.max_label_len):
+            raw_pred, hidden_state, context, attention_score = self.forward_step(rnn_input, hidden_state, listener_feature,
+                                                                                 comp_listener_feature, listener_mask)
+            output_word, word = self.feedback(raw_pred)
+
+            # Scatter the active rows back into full batch outputs
+            if len(active) < batch_size:
+                raw_pred = raw_pred_seq[-1].index_copy(0, active, raw_pred)
+                attention_score = [score.new_zeros(batch_size, score.size(1)).index_copy(0, active, score)
+                                   for score in attention_score]
+            raw_pred_seq.append(raw_pred)
+            attention_record.append(attention_score)
+
+            running = word != eos
+            if not bool(running.all()):
+                if not bool(running.any()):
+                    break
+                # Compact finished sequences out of the batch
+                keep = running.nonzero().squeeze(1)
+                active = active.index_select(0, keep)
+                listener_feature = listener_feature.index_select(0, keep)
+                comp_listener_feature = comp_listener_feature.index_select(0, keep)
+                if listener_mask is not None:
+                    listener_mask = listener_mask.index_select(0, keep)
+                if isinstance(hidden_state, tuple):
+                    hidden_state = tuple(h.index_select(1, keep) for h in hidden_state)
                 else:
-                    sampled_word = Categorical(raw_pred).sample()
-                    output_word = torch.zeros_like(raw_pred)
-                    for idx, i in enumerate(sampled_word):
-                        output_word[idx, int(i)] = 1
-                    output_word = output_word.unsqueeze(1)
-                
+                    hidden_state = hidden_state.index_select(1, keep)
+                context = context.index_select(0, keep)
+                output_word = output_word.index_select(0, keep)
+
             rnn_input = torch.cat([output_word, context.unsqueeze(1)], dim=-1)
 
         return raw_pred_seq, attention_record
 
+    # Batched beam search, all (utterance x beam size) hypotheses are decoded as one flat batch
+    # Among the beam_size best candidates of a step, those emitting <eos> (index 1) leave the beam and enter the n-best
+    # list with length normalized score log P(y|x) / len(y)**length_penalty, the live beam is refilled with the best
+    # candidates that did not end. An utterance is done once beam_size hypotheses ended, or once no live hypothesis
+    # can beat the n-best list whatever its final length (log P only decreases, so its score is bounded by the
+    # largest normalizer reachable), unfinished hypotheses at max_label_len compete for the n-best list as they are.
+    # Done utterances are compacted out of the decoder batch (as in forward_early_stop), their n-best lists are final.
+    # With beam_size 1 this is greedy decoding (decode_mode 1) truncated at <eos>
+    # Input : listener_feature [batch size, T, listener feature dimension]
+    # Output: n-best label sequences [batch size, n_best, max_label_len] (ending with <eos>, padded with 0)
+    #         n-best scores          [batch size, n_best] (sorted, best first)
+    def beam_search(self, listener_feature, beam_size, n_best=1, length_penalty=1.0, listener_length=None):
+        self.rnn_layer.flatten_parameters()
+        eos = 1
+        batch_size = listener_feature.size(0)
+        n_best = min(n_best, beam_size)
+        max_step = self.max_label_len
+        neg_inf = -float('inf')
+        device = listener_feature.device
+
+        comp_listener_feature = self.attention.preprocess_listener_feature(listener_feature)
+        listener_mask = self.get_listener_mask(listener_feature, listener_length)
+        listener_feature = listener_feature.repeat_interleave(beam_size, dim=0)
+        comp_listener_feature = comp_listener_feature.repeat_interleave(beam_size, dim=0)
+        if listener_mask is not None:
+            listener_mask = listener_mask.repeat_interleave(beam_size, dim=0)
+
+        # n-best lists of every utterance, filled in as utterances are done
+        result_score = listener_feature.new_full((batch_size, n_best), neg_inf)
+        result_label = torch.zeros(batch_size, n_best, max_step, dtype=torch.long, device=device)
+
+        # State of the utterances still decoded (active), row a of the flat batch holds beam a % beam_size of
+        # utterance active[a // beam_size]
+        active = torch.arange(batch_size, device=device)
+        beam_slot = torch.arange(beam_size, device=device)
+        # Candidates ending with <eos> are ranked after all others when refilling the beam
+        cand_rank = torch.arange(2*beam_size, device=device).unsqueeze(0)
+        n_ended = torch.zeros(batch_size, dtype=torch.long, device=device)
+        # Only the first beam is alive at the first step, the others would duplicate it
+        beam_score = listener_feature.new_full((batch_size, beam_size), neg_inf)
+        beam_score[:, 0] = 0
+        beam_label = torch.zeros(batch_size, beam_size, max_step, dtype=torch.long, device=device)
+        best_score = result_score.clone()
+        best_label = result_label.clone()
+
+        output_word = listener_feature.new_zeros(batch_size*beam_size, 1, self.label_dim)
+        output_word[:, :, 0] = 1  # <sos>
+        rnn_input = torch.cat([output_word, listener_feature[:, 0:1, :]], dim=-1)
+        hidden_state = None
+
+        for step in range(max_step):
+            raw_pred, hidden_state, context, _ = self.forward_step(rnn_input, hidden_state, listener_feature,
+                                                                   comp_listener_feature, listener_mask)
+            n_active = len(active)
+            length_norm = float(step+1) ** length_penalty
+
+            # 2*beam_size candidates always leave beam_size that did not end, since each beam ends at most once
+            cand_score = (beam_score.unsqueeze(2) + raw_pred.view(n_active, beam_size, -1)).view(n_active, -1)
+            cand_score, cand_idx = cand_score.topk(2*beam_size, dim=1)
+            cand_beam = cand_idx // self.label_dim
+            cand_word = cand_idx % self.label_dim
+            cand_label = beam_label.gather(1, cand_beam.unsqueeze(2).expand(-1, -1, max_step))
+            cand_label[:, :, step] = cand_word
+            cand_end = cand_word == eos
+            if step == max_step-1:
+                cand_end = torch.ones_like(cand_end)
+
+            # Merge the ended candidates within the beam_size best into the n-best list
+            final = cand_end & (cand_rank < beam_size) & (cand_score > neg_inf)
+            n_ended += final.sum(dim=1)
+            end_score = torch.where(final, cand_score/length_norm, torch.full_like(cand_score, neg_inf))
+            best_score, best_idx = torch.cat([best_score, end_score], dim=1).topk(n_best, dim=1)
+            best_label = torch.cat([best_label, cand_label], dim=1).gather(1, best_idx.unsqueeze(2).expand(-1, -1, max_step))
+            if step == max_step-1:
+                result_score[active], result_label[active] = best_score, best_label
+                break
+
+            # Refill the beam with the best candidates that did not end
+            keep = torch.where(cand_end, cand_rank + 2*beam_size, cand_rank).argsort(dim=1)[:, :beam_size]
+            beam_score = cand_score.gather(1, keep)
+            beam_label = cand_label.gather(1, keep.unsqueeze(2).expand(-1, -1, max_step))
+            beam_word = cand_word.gather(1, keep)
+            # Flat row each new hypothesis comes from
+            origin = (active.new_tensor(range(n_active)).unsqueeze(1)*beam_size + cand_beam.gather(1, keep))
+
+            bound_norm = max(length_norm, float(max_step) ** length_penalty)
+            done = (n_ended >= beam_size) | (beam_score.max(dim=1)[0]/bound_norm <= best_score[:, -1])
+            n_done = int(done.sum())
+            if n_done > 0:
+                # Store the final n-best lists of done utterances and drop them from the decoder batch
+                result_score[active[done]], result_label[active[done]] = best_score[done], best_label[done]
+                if n_done == n_active:
+                    break
+                running = (~done).nonzero().squeeze(1)
+                active, n_ended = active[running], n_ended[running]
+                beam_score, beam_label, beam_word = beam_score[running], beam_label[running], beam_word[running]
+                best_score, best_label, origin = best_score[running], best_label[running], origin[running]
+                rows = (running.unsqueeze(1)*beam_size + beam_slot).view(-1)
+                listener_feature = listener_feature.index_select(0, rows)
+                comp_listener_feature = comp_listener_feature.index_select(0, rows)
+                if listener_mask is not None:
+                    listener_mask = listener_mask.index_select(0, rows)
+
+            # Reorder decoder states to follow their hypotheses
+            origin = origin.view(-1)
+            if isinstance(hidden_state, tuple):
+                hidden_state = tuple(h.index_select(1, origin) for h in hidden_state)
+            else:
+                hidden_state = hidden_state.index_select(1, origin)
+            context = context.index_select(0, origin)
+            output_word = self.index_to_onehot(beam_word.view(-1), raw_pred.new_empty(origin.size(0), self.label_dim))
+            rnn_input = torch.cat([output_word.unsqueeze(1), context.unsqueeze(1)], dim=-1)
+
+        return result_label, result_score
+
 
 # Attention mechanism
 # Currently only 'dot' is implemented
 # please refer to http://www.aclweb.org/anthology/D15-1166 section 3.1 for more details about Attention implementation
 # Input : Decoder state                      with shape [batch size, 1, decoder hidden dimension]
 #         Compressed feature from Listner    with shape [batch size, T, listener feature dimension]
+#         Mask of real (unpadded) timesteps  with shape [batch size, T] (optional)
 # Output: Attention score                    with shape [batch size, T (attention score of each time step)]
 #         Context vector                     with shape [batch size,  listener feature dimension]
 #         (i.e. weighted (by attention score) sum of all timesteps T's feature)
@@ -184,28 +403,44 @@ class Attention(nn.Module):
             else:
                 self.activate = None
 
-    def forward(self, decoder_state, listener_feature):
+    # Key projection psi(h) of the listener feature, independent of the decoder state
+    # Output: [batch size, T, preprocess_mlp_dim] (or listener_feature itself without mlp preprocessing)
+    def preprocess_listener_feature(self, listener_feature):
+        if not self.mlp_preprocess_input:
+            return listener_feature
+        comp_listener_feature = time_distributed(self.psi, listener_feature)
+        if self.activate:
+            comp_listener_feature = self.activate(comp_listener_feature)
+        return comp_listener_feature
+
+    # Padded timesteps get -inf energy so that no attention score is assigned to them
+    def mask_energy(self, energy, listener_mask):
+        if listener_mask is None:
+            return energy
+        return energy.masked_fill(~listener_mask, -float('inf'))
+
+    def forward(self, decoder_state, listener_feature, comp_listener_feature=None, listener_mask=None):
+        if comp_listener_feature is None:
+            comp_listener_feature = self.preprocess_listener_feature(listener_feature)
+
         if self.mlp_preprocess_input:
             if self.activate:
                 comp_decoder_state = self.activate(self.phi(decoder_state))
-                comp_listener_feature = self.activate(time_distributed(self.psi, listener_feature))
             else:
                 comp_decoder_state = self.phi(decoder_state)
-                comp_listener_feature = time_distributed(self.psi, listener_feature)
         else:
             comp_decoder_state = decoder_state
-            comp_listener_feature = listener_feature
 
         if self.mode == 'dot':
             if self.multi_head == 1:
                 energy = torch.bmm(comp_decoder_state, comp_listener_feature.transpose(1, 2)).squeeze(dim=1)
-                attention_score = [self.softmax(energy)]
-                context = torch.sum(listener_feature*attention_score[0].unsqueeze(2).repeat(1, 1, listener_feature.size(2)), dim=1)
+                attention_score = [self.softmax(self.mask_energy(energy, listener_mask))]
+                context = torch.bmm(attention_score[0].unsqueeze(1), listener_feature).squeeze(dim=1)
             else:
-                attention_score = [self.softmax(torch.bmm(att_query, comp_listener_feature.transpose(1, 2)).squeeze(dim=1))\
+                attention_score = [self.softmax(self.mask_energy(torch.bmm(att_query, comp_listener_feature.transpose(1, 2))
+                                                                 .squeeze(dim=1), listener_mask))\
                                    for att_query in torch.split(comp_decoder_state, self.preprocess_mlp_dim, dim=-1)]
-                projected_src = [torch.sum(listener_feature*att_s.unsqueeze(2).repeat(1, 1, listener_feature.size(2)), dim=1)\
-                                 for att_s in attention_score]
+                projected_src = [torch.bmm(att_s.unsqueeze(1), listener_feature).squeeze(dim=1) for att_s in attention_score]
                 context = self.dim_reduce(torch.cat(projected_src, dim=-1))
         else:
             # TODO: other attention implementations
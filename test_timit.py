@@ -1,18 +1,29 @@
 import yaml
 from util.timit_dataset import load_dataset, create_dataloader
+from util import librispeech_dataset, kspon_dataset
 from model.las_model import LAS, Listener, Speller
 from util.functions import test
+from util.pfi import PermutationImportance, run_pfi
 import torch
 from tensorboardX import SummaryWriter
 import argparse
 from logger import *
-import numpy as np
-import pickle
 
 # Load config file for experiment
 parser = argparse.ArgumentParser(description='Training script for LAS on TIMIT .')
 parser.add_argument('config_path', metavar='config_path', type=str, help='Path to config file for training.')
+parser.add_argument('--pfi_path', type=str, default=None,
+                    help='Run permutation feature importance and save it to this pickle (e.g. pfi_mel40_mfcc16_5.pkl)')
+parser.add_argument('--n_repeats', type=int, default=5, help='Permutations of every feature (Default : 5)')
+parser.add_argument('--n_features', type=int, default=None,
+                    help='Features (columns) to permute (Default : input_feature_dim // 3)')
+parser.add_argument('--stack', type=int, default=8, help='Permutations evaluated per forward pass (Default : 8)')
+parser.add_argument('--n_jobs', type=int, default=1,
+                    help='Worker processes evaluating permutations, CPU only (Default : 1)')
 paras = parser.parse_args()
+# PFI workers are forked, the parent must not start the OpenMP thread pool of torch before (see util/pfi.py)
+if paras.pfi_path is not None and paras.n_jobs > 1:
+    torch.set_num_threads(1)
 config_path = paras.config_path
 conf = yaml.load(open(config_path, 'r'))
 device = 'cuda'
@@ -43,50 +54,40 @@ model = LAS(listener, speller)
 # model = nn.DataParallel(model)
 model.to(device)
 
-model_path = "{}{}.pt".format(conf['meta_variable']['checkpoint_dir'], "las_timit_mel56")
+# Corpus of the experiment (meta_variable.corpus) : timit (default), libri or kspon
+corpus = conf['meta_variable'].get('corpus', 'timit')
+if corpus != 'timit' and paras.pfi_path is not None:
+    raise ValueError('Permutation feature importance is only implemented for TIMIT')
+
+model_name = "las_timit_mel56" if corpus == 'timit' else conf['meta_variable']['experiment_name']
+model_path = "{}{}.pt".format(conf['meta_variable']['checkpoint_dir'], model_name)
 # save checkpoint with the best ler
 global_step = 0
 
-n_repeats = 5
-
 model.load_state_dict(torch.load(model_path))
 model.eval()
 
 
-def shuffle_feature(x, idx):
-    x_all = np.concatenate(x, axis=0)
-    x_all[:, idx] = np.random.permutation(x_all[:, idx])
-    # x_all[:, idx*2] = np.random.permutation(x_all[:, idx*2])
-    # x_all[:, idx*3] = np.random.permutation(x_all[:, idx*3])
-    x_result, start, end = [], 0, 0
-    for x_tmp in x:
-        end = end+x_tmp.shape[0]
-        x_result.append(x_all[start:end, :])
-        start = end
-    return x_result
-
+if corpus != 'timit':
+    # Test split of the feature store written by librispeech_preprocess.py / kspon_preprocess.py
+    corpus_dataset = {'libri': librispeech_dataset, 'kspon': kspon_dataset}[corpus]
+    test_set = corpus_dataset.create_dataloader(**conf['model_parameter'], **conf['training_parameter'],
+                                                data_path=conf['meta_variable']['data_path'], split='test',
+                                                shuffle=False)
+    test(test_set, model, conf, global_step, log_writer, logger, -1, data=corpus)
+    exit()
 
 # Load preprocessed TIMIT Dataset ( using testing set directly here, replace them with validation set your self)
 # X : Padding to shape [num of sample, max_timestep, feature_dim]
-# Y : Squeeze repeated label and apply one-hot encoding (preserve 0 for <sos> and 1 for <eos>)
+# Y : Squeeze repeated label into zero padded label index (preserve 0 for <sos> and 1 for <eos>)
 _, _, _, _, X_test, y_test = load_dataset(**conf['meta_variable'])
 test_set = create_dataloader(X_test, y_test, **conf['model_parameter'], **conf['training_parameter'], shuffle=False)
 max_cer, _ = test(test_set, model, conf, global_step, log_writer, logger, -1, mode='phonetic')
 
-exit()
-
-result = [[max_cer]]
-for feature in range(conf['model_parameter']['input_feature_dim']//3):
-    now_pi = []
-    for i in range(n_repeats):
-        X_test_shuffled = shuffle_feature(X_test, feature)
-
-        test_set = create_dataloader(X_test_shuffled, y_test, **conf['model_parameter'], **conf['training_parameter'], shuffle=False)
-        now_cer = test(test_set, model, conf, global_step, log_writer, logger, feature)
-        now_pi.append(now_cer)
-    result.append(now_pi)
-
-logger.info("\n".join(map(str, result)))
-
-with open('pfi_mel40_mfcc16_5.pkl', 'wb') as f:
-    pickle.dump(result, f)
+if paras.pfi_path is not None:
+    # Resumes from the cells already in <pfi_path without .pkl>.cells.csv
+    n_features = paras.n_features or conf['model_parameter']['input_feature_dim']//3
+    engine = PermutationImportance(model, X_test, y_test, conf, stack=paras.stack,
+                                   seed=conf['training_parameter']['seed'])
+    result = run_pfi(engine, range(n_features), paras.n_repeats, paras.pfi_path, logger, paras.n_jobs)
+    logger.info("\n".join(map(str, result)))
@@ -1,5 +1,6 @@
 import yaml
 from util.timit_dataset import load_dataset, create_dataloader
+from util import librispeech_dataset, kspon_dataset
 from model.las_model import LAS, Listener, Speller
 from util.functions import train, evaluate, test
 import torch
@@ -31,13 +32,31 @@ valid_step = conf['training_parameter']['valid_step']
 tf_rate_upperbound = conf['training_parameter']['tf_rate_upperbound']
 tf_rate_lowerbound = conf['training_parameter']['tf_rate_lowerbound']
 
-# Load preprocessed TIMIT Dataset ( using testing set directly here, replace them with validation set your self)
-# X : Padding to shape [num of sample, max_timestep, feature_dim]
-# Y : Squeeze repeated label and apply one-hot encoding (preserve 0 for <sos> and 1 for <eos>)
-X_train, y_train, X_valid, y_valid, X_test, y_test = load_dataset(**conf['meta_variable'])
-train_set = create_dataloader(X_train, y_train, **conf['model_parameter'], **conf['training_parameter'], shuffle=True)
-valid_set = create_dataloader(X_valid, y_valid, **conf['model_parameter'], **conf['training_parameter'], shuffle=False)
-test_set = create_dataloader(X_test, y_test, **conf['model_parameter'], **conf['training_parameter'], shuffle=False)
+# Corpus of the experiment (meta_variable.corpus) : timit (default), libri or kspon
+corpus = conf['meta_variable'].get('corpus', 'timit')
+batch_size = conf['training_parameter']['batch_size']
+
+if corpus == 'timit':
+    # Load preprocessed TIMIT Dataset ( using testing set directly here, replace them with validation set your self)
+    # X : Padding to shape [num of sample, max_timestep, feature_dim]
+    # Y : Squeeze repeated label into zero padded label index (preserve 0 for <sos> and 1 for <eos>)
+    X_train, y_train, X_valid, y_valid, X_test, y_test = load_dataset(**conf['meta_variable'])
+    train_set = create_dataloader(X_train, y_train, **conf['model_parameter'], **conf['training_parameter'],
+                                  shuffle=True)
+    valid_set = create_dataloader(X_valid, y_valid, **conf['model_parameter'], **conf['training_parameter'],
+                                  shuffle=False)
+    test_set = create_dataloader(X_test, y_test, **conf['model_parameter'], **conf['training_parameter'],
+                                 shuffle=False)
+    steps_per_epoch = len(X_train) // batch_size
+else:
+    # Feature store written by librispeech_preprocess.py / kspon_preprocess.py, read split by split
+    corpus_dataset = {'libri': librispeech_dataset, 'kspon': kspon_dataset}[corpus]
+    loader_parameter = dict(conf['model_parameter'], **conf['training_parameter'],
+                            data_path=conf['meta_variable']['data_path'], logger=logger)
+    train_set = corpus_dataset.create_dataloader(**loader_parameter, split='train', shuffle=True, training=True)
+    valid_set = corpus_dataset.create_dataloader(**loader_parameter, split='valid', shuffle=False)
+    test_set = corpus_dataset.create_dataloader(**loader_parameter, split='test', shuffle=False)
+    steps_per_epoch = len(train_set)
 
 # Construct LAS Model or load pretrained LAS model
 log_writer = SummaryWriter(conf['meta_variable']['training_log_dir']+conf['meta_variable']['experiment_name'])
@@ -60,7 +79,7 @@ model_path = "{}{}.pt".format(conf['meta_variable']['checkpoint_dir'], conf['met
 # save checkpoint with the best ler
 best_cer = 1.0
 global_step = 0
-total_steps = total_epochs * len(X_train) // conf['training_parameter']['batch_size']
+total_steps = total_epochs * steps_per_epoch
 
 train_begin = time.time()
 
@@ -73,8 +92,9 @@ for epoch in range(total_epochs):
 
     # test_cer = test(test_set, model, conf, global_step, log_writer, logger, epoch, mode='phonetic')
 
-    global_step = train(train_set, model, optimizer, tf_rate, conf, global_step, log_writer)
-    now_cer = evaluate(valid_set, model, conf, global_step, log_writer, epoch_begin, train_begin, logger, epoch)
+    global_step = train(train_set, model, optimizer, tf_rate, conf, global_step, log_writer, data=corpus)
+    now_cer = evaluate(valid_set, model, conf, global_step, log_writer, epoch_begin, train_begin, logger, epoch,
+                       data=corpus)
 
     # Checkpoint
     if best_cer >= now_cer:
@@ -86,4 +106,4 @@ for epoch in range(total_epochs):
 model.load_state_dict(torch.load(model_path))
 model.eval()
 
-test_cer = test(test_set, model, conf, global_step, log_writer, logger, best_epoch)
+test_cer = test(test_set, model, conf, global_step, log_writer, logger, best_epoch, data=corpus)
@@ -0,0 +1,101 @@
+import numpy as np
+from torch.utils.data.sampler import Sampler
+
+
+# Batch sampler grouping utterances of similar length
+# Each epoch, (shuffled) indices are split into pools of bucket_size batches, every pool is sorted by length and cut
+# into batches, then the order of batches is shuffled. Batches hold batch_size utterances, or as many utterances as
+# fit in max_frames padded frames (batch size x padded length of the longest utterance) if max_frames is set
+# Without shuffle, batches are cut from the whole set sorted by length and yielded in order
+# drop_last drops the batches of less than batch_size utterances, it is rejected with max_frames since batch sizes
+# then vary by design
+#
+# Utterances whose label (+ <eos>) is longer than max_label_len are left out when label_lengths is given
+# With a seed, the plan of epoch e only depends on (seed, e), so a resumed run (set_epoch) replays the same batches,
+# otherwise the global numpy random state is used. stats holds the plan of the epoch being yielded (batches,
+# utterances left out, padding efficiency), it is also logged with logger.info at the start of every epoch if given
+class BucketBatchSampler(Sampler):
+    def __init__(self, lengths, batch_size, shuffle, max_frames=None, pad_multiple=1, bucket_size=100,
+                 label_lengths=None, max_label_len=None, seed=None, logger=None, drop_last=False):
+        if drop_last and max_frames is not None:
+            raise ValueError('drop_last is not supported with max_frames')
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.max_frames = max_frames
+        self.pad_multiple = pad_multiple
+        self.bucket_size = bucket_size
+        self.seed = seed
+        self.logger = logger
+        self.stats = None
+        self.drop_last = drop_last
+        self.indices = np.arange(len(self.lengths))
+        if label_lengths is not None and max_label_len is not None:
+            self.indices = self.indices[np.asarray(label_lengths) + 1 <= max_label_len]
+        self.epoch = 0
+        self.batches = self.make_batches()
+
+    def random_state(self):
+        return np.random if self.seed is None else np.random.RandomState([self.seed, self.epoch])
+
+    def make_batches(self):
+        rng = self.random_state()
+        if self.shuffle:
+            indices = self.indices[rng.permutation(len(self.indices))]
+            pool_size = self.batch_size*self.bucket_size
+        else:
+            indices = self.indices
+            pool_size = max(1, len(indices))
+        batches = []
+        for left in range(0, len(indices), pool_size):
+            pool = indices[left:left+pool_size]
+            pool = pool[np.argsort(-self.lengths[pool], kind='stable')]
+            batches.extend(self.split_pool(pool))
+        if self.shuffle:
+            batches = [batches[idx] for idx in rng.permutation(len(batches))]
+        return batches
+
+    def split_pool(self, pool):
+        # pool is sorted by descending length, so the first utterance of a batch sets its padded length
+        if self.max_frames is None:
+            end = len(pool) - len(pool) % self.batch_size if self.drop_last else len(pool)
+            return [pool[left:left+self.batch_size] for left in range(0, end, self.batch_size)]
+        pad_len = np.ceil(self.lengths[pool]/self.pad_multiple)*self.pad_multiple
+        batches, left = [], 0
+        while left < len(pool):
+            n = max(1, int(self.max_frames // pad_len[left]))
+            batches.append(pool[left:left+n])
+            left += n
+        return batches
+
+    def set_epoch(self, epoch):
+        # Plan the batches of epoch (0-based) as the next ones to be yielded
+        self.epoch = epoch
+        self.batches = self.make_batches()
+
+    def padding_efficiency(self):
+        # Fraction of the padded frames of the planned batches holding real frames
+        frames = sum(int(self.lengths[batch].sum()) for batch in self.batches)
+        padded = sum(len(batch)*int(np.ceil(self.lengths[batch].max()/self.pad_multiple)*self.pad_multiple)
+                     for batch in self.batches)
+        return frames/max(padded, 1)
+
+    def __iter__(self):
+        # Reshuffle every epoch (the number of batches may change with max_frames)
+        if self.batches is None:
+            self.batches = self.make_batches()
+        self.stats = {'epoch': self.epoch, 'batches': len(self.batches), 'utterances': len(self.indices),
+                      'left_out': len(self.lengths)-len(self.indices), 'padding_efficiency': self.padding_efficiency()}
+        if self.logger is not None:
+            self.logger.info('Epoch {epoch} : {batches} batches of {utterances} utterances ({left_out} left out), '
+                             'padding efficiency {padding_efficiency:.2%}'.format(**self.stats))
+        batches = self.batches
+        self.epoch += 1
+        self.batches = None if self.shuffle else batches
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.batches is None:
+            self.batches = self.make_batches()
+        return len(self.batches)
@@ -1,12 +1,18 @@
 import editdistance as ed
 import operator
-import copy
+import numpy as np
 
 INSERT = 'insert'
 DELETE = 'delete'
 EQUAL = 'equal'
 REPLACE = 'replace'
 
+# Operation codes of the traces returned by batch_alignment, -1 pads the end of a trace
+OP_EQUAL = 0
+OP_REPLACE = 1
+OP_INSERT = 2
+OP_DELETE = 3
+
 phonemes = ["b", "bcl", "d", "dcl", "g", "gcl", "p", "pcl", "t", "tcl",
                 "k", "kcl", "dx", "q", "jh", "ch", "s", "sh", "z", "zh",
                 "f", "th", "v", "dh", "m", "n", "ng", "em", "en", "eng",
@@ -36,6 +42,31 @@ reduce_phonemes.remove('q')
 reduce_phonemes2index = {ch: phonemes2index[ch] for ch in reduce_phonemes}
 index2reduce_phonemes = {phonemes2index[ch]: ch for ch in reduce_phonemes}
 
+# Lookup table over label indices (0 <sos>, 1 <eos>, 2 ~ 62 phones) for batched evaluation
+# reduce_table[idx] is the index of the reduced (39 phones) phone of idx, -1 for q which is discarded
+reduce_table = np.arange(len(phonemes) + 2)
+for ch in phonemes:
+    reduce_table[phonemes2index[ch]] = -1 if ch == 'q' else phonemes2index[phoneme_reduce_mapping[ch]]
+
+# The 39 reduced phones in index order, reduce_position[idx] is the position of the reduced phone idx in reduce_index
+# (the axes of a confusion matrix), -1 for other indices
+reduce_index = np.array(sorted(index2reduce_phonemes))
+reduce_position = np.full(len(phonemes) + 2, -1)
+reduce_position[reduce_index] = np.arange(len(reduce_index))
+
+# Broad phonetic classes of the reduced phones, broad_class_table[idx] is the class of the reduced phone idx
+broad_classes = ['Stops', 'Affricate', 'Fricative', 'Glides', 'Nasals', 'Vowels', 'Others']
+reduce_idx2broad_class_idx = {2: 0, 4: 0, 6: 0, 8: 0, 10: 0, 12: 0, 14: 0,  # Stops      b, d, g, p, t, k, dx, q
+                              16: 1, 17: 1,  # Affricate  jh, ch
+                              18: 2, 19: 2, 20: 2, 22: 2, 23: 2, 24: 2, 25: 2,  # Fricative  s, sh, z, zh, f, th, v, dh
+                              33: 3, 34: 3, 35: 3, 36: 3, 37: 3,  # Glides     l, r, w, y, hh, hv, el
+                              26: 4, 27: 4, 28: 4,  # Nasals     m, n, ng, em, en, eng, nx
+                              40: 5, 41: 5, 42: 5, 43: 5, 44: 5, 45: 5, 46: 5, 47: 5, 48: 5, 50: 5, 51: 5, 52: 5, 53: 5, 55: 5,  # Vowels     iy, ih, eh, ey, ae, aa, aw, ay, ah, ao, oy, ow, uh, uw, ux, er, ax, ix, axr, ax-h
+                              62: 6}  # Others     pau, epi, h#
+broad_class_table = np.full(len(phonemes) + 2, -1)
+for idx, broad_class in reduce_idx2broad_class_idx.items():
+    broad_class_table[idx] = broad_class
+
 
 def lowest_cost_action(ic, dc, sc, cost):
     """Given the following values, choose the action (insertion, deletion,
@@ -71,11 +102,11 @@ def edit_distance(seq1, seq2, action_function=lowest_cost_action, test=operator.
     n = len(seq2)
     # Special, easy cases:
     if seq1 == seq2:
-        return 0, n
+        return 0
     if m == 0:
-        return n, 0
+        return n
     if n == 0:
-        return m, 0
+        return m
     v0 = [0] * (n + 1)     # The two 'error' columns
     v1 = [0] * (n + 1)
     for i in range(1, n + 1):
@@ -105,74 +136,192 @@ def edit_distance(seq1, seq2, action_function=lowest_cost_action, test=operator.
     return v1[n]
 
 
-def edit_distance_by_phoneme(seq1, seq2, action_function=lowest_cost_action, test=operator.eq):
-    """Computes the edit distance between the two given sequences.
-    This uses the relatively fast method that only constructs
-    two columns of the 2d array for edits.  This function actually uses four columns
-    because we track the number of matches too.
+def edit_distance_by_phoneme(seq1, seq2):
+    """Computes the edit distance between the two given sequences of reduced phones and the errors of every
+    broad phonetic class, from a single alignment (see batch_alignment). A replaced or inserted phone of seq2 counts
+    for its class, as does a deleted phone of seq1.
     """
-    def get_class(idx):
-        reduce_idx2broad_class_idx = {2: 0, 4: 0, 6: 0, 8: 0, 10: 0, 12: 0, 14: 0,  # Stops      b, d, g, p, t, k, dx, q
-                                      16: 1, 17: 1,  # Affricate  jh, ch
-                                      18: 2, 19: 2, 20: 2, 22: 2, 23: 2, 24: 2, 25: 2,  # Fricative  s, sh, z, zh, f, th, v, dh
-                                      33: 3, 34: 3, 35: 3, 36: 3, 37: 3,  # Glides     l, r, w, y, hh, hv, el
-                                      26: 4, 27: 4, 28: 4,  # Nasals     m, n, ng, em, en, eng, nx
-                                      40: 5, 41: 5, 42: 5, 43: 5, 44: 5, 45: 5, 46: 5, 47: 5, 48: 5, 50: 5, 51: 5, 52: 5, 53: 5, 55: 5,  # Vowels     iy, ih, eh, ey, ae, aa, aw, ay, ah, ao, oy, ow, uh, uw, ux, er, ax, ix, axr, ax-h
-                                      62: 6}  # Others     pau, epi, h#
-        return reduce_idx2broad_class_idx[idx]
+    ops, tok1, tok2 = batch_alignment(np.array([seq1], dtype=np.int64).reshape(1, -1), np.array([len(seq1)]),
+                                      np.array([seq2], dtype=np.int64).reshape(1, -1), np.array([len(seq2)]))
+    error = (ops == OP_REPLACE) | (ops == OP_INSERT) | (ops == OP_DELETE)
+    errors = broad_class_table[np.where(ops == OP_DELETE, tok1, tok2)[error]]
+    return int(error.sum()), np.bincount(errors, minlength=len(broad_classes))
 
-    m = len(seq1)
-    n = len(seq2)
-    # Special, easy cases:
-    if seq1 == seq2:
-        return 0, n
-    if m == 0:
-        return n, 0
-    if n == 0:
-        return m, 0
-    v0 = [0] * (n + 1)     # The two 'error' columns
-    v1 = [0] * (n + 1)
-    p0 = [[0]*7 for _ in range(n+1)]
-    p1 = [[0]*7 for _ in range(n+1)]
 
-    for i in range(1, n + 1):
-        v0[i] = i
-        p0[i][get_class(seq2[i - 1])] = i
+def batch_edit_distance(seq1, len1, seq2, len2):
+    """Levenshtein distances between the rows of the padded integer arrays seq1 [batch, m] and seq2 [batch, n]
+    (numpy arrays or CPU tensors), the tokens past len1 / len2 are ignored. Returns an int64 array [batch]
+    Large batches of short seq1 go to the bit-parallel kernel, other rows are handed to the C implementation of
+    editdistance, which beats any vectorized DP over small batches (one NumPy call per column or row)
+    """
+    if len(len1) >= bit_parallel_distance_batch and int(max(len1)) <= bit_parallel_max_len:
+        return bit_parallel_distance(np.asarray(seq1), np.asarray(len1), np.asarray(seq2), np.asarray(len2))
+    return np.array([ed.eval(s1[:l1], s2[:l2]) for s1, l1, s2, l2 in
+                     zip(seq1.tolist(), len1.tolist(), seq2.tolist(), len2.tolist())], dtype=np.int64)
+
+
+def batch_distance_table(seq1, len1, seq2, len2):
+    """DP tables D [m + 1, n + 1, batch] of the padded integer arrays seq1 [batch, m] and seq2 [batch, n], D[i, j, k]
+    is the edit distance between seq1[k, :i] and seq2[k, :j] (for i <= len1[k], j <= len2[k]). Large batches of short
+    seq1 are rebuilt from the bit-parallel kernel, others computed by dp_distance_table
+    """
+    len1 = np.asarray(len1, dtype=np.int64)
+    if len(len1) >= bit_parallel_table_batch and int(len1.max()) <= bit_parallel_max_len:
+        return bit_parallel_table(seq1, len1, seq2, len2)
+    return dp_distance_table(seq1, len1, seq2, len2)
+
 
+def dp_distance_table(seq1, len1, seq2, len2):
+    """DP tables of batch_distance_table, row i is computed for the whole batch at once, the chain of insertions along
+    the row is resolved with a cumulative minimum :
+    D[i, j] = j + min_{l <= j} (C[l] - l) where C[l] is the cost of reaching (i, l) by a deletion or a substitution
+    """
+    m = int(np.max(len1, initial=0))
+    n = seq2.shape[1]
+    mismatch = np.asarray(seq1)[:, :m].T[:, None, :] != np.asarray(seq2).T[None, :, :]
+    offset = np.arange(n + 1)[:, None]
+    table = np.empty((m + 1, n + 1, len(len1)), dtype=np.int32)
+    table[0] = offset
     for i in range(1, m + 1):
-        v1[0] = i
-        p1[0][get_class(seq1[i - 1])] = i
-        for j in range(1, n + 1):
-            phonetic_class = get_class(seq2[j - 1])
+        row = table[i]
+        row[0] = i
+        np.minimum(table[i-1, 1:] + 1, table[i-1, :-1] + mismatch[i-1], out=row[1:])
+        row -= offset
+        np.minimum.accumulate(row, axis=0, out=row)
+        row += offset
+    return table
 
-            cost = 0 if test(seq1[i - 1], seq2[j - 1]) else 1
-            # The costs
-            ins_cost = v1[j - 1] + 1
-            del_cost = v0[j] + 1
-            sub_cost = v0[j - 1] + cost
 
-            action = action_function(ins_cost, del_cost, sub_cost, cost)
+# Bit-parallel edit distance (Myers 1999, in the formulation of Hyyro 2001) for seq1 of at most 64 symbols
+# Column j of the DP table is held by two uint64 words per sequence, bit i - 1 of Pv / Mv is set when
+# D[i, j] - D[i - 1, j] is +1 / -1, so that D[i, j] = j + popcount(Pv & low_i) - popcount(Mv & low_i) with low_i the i
+# lowest bits. Every word operation is a NumPy call over the whole batch
+bit_parallel_max_len = 64
+# Smallest batches for which the bit-parallel kernel beats editdistance.eval per pair / the row-wise DP tables (on
+# TIMIT-like sequences, see benchmark/edit_distance.py)
+bit_parallel_distance_batch = 512
+bit_parallel_table_batch = 128
 
-            if action in [EQUAL, REPLACE]:
-                v1[j] = sub_cost
-                for k in range(7):
-                    if k == phonetic_class:
-                        p1[j][k] = p0[j - 1][k] + cost
-                    else:
-                        p1[j][k] = p0[j - 1][k]
-            elif action == INSERT:
-                v1[j] = ins_cost
-                p1[j][phonetic_class] = ins_cost
-            elif action == DELETE:
-                v1[j] = del_cost
-                p1[j][phonetic_class] = del_cost
-            else:
-                raise Exception('Invalid dynamic programming option returned!')
-                # Copy the columns over
+byte_popcount = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
 
-        v0 = copy.deepcopy(v1)
-        p0 = copy.deepcopy(p1)
-    return v1[n]
+
+def popcount(words):
+    # Number of set bits of every uint64 word (np.bitwise_count from NumPy 2.0)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return byte_popcount[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def low_bits(count):
+    # uint64 masks of the count (0 ~ 64) lowest bits
+    count = np.asarray(count, dtype=np.uint64)
+    return np.where(count >= 64, ~np.uint64(0), (np.uint64(1) << np.minimum(count, 63)) - np.uint64(1))
+
+
+def bit_parallel_columns(seq1, len1, seq2, len2):
+    """Vertical delta words (Pv, Mv) [n + 1, batch] of every column of the DP tables of the padded label arrays
+    seq1 [batch, m] and seq2 [batch, n] (tokens >= -1, seq1 of at most 64 symbols up to len1). Bits past len1 and
+    columns past len2 are meaningless, they never carry into the lower bits
+    """
+    seq1, seq2 = np.asarray(seq1), np.asarray(seq2)
+    len1 = np.asarray(len1, dtype=np.int64)
+    batch_size, n = seq2.shape
+    m = int(len1.max()) if batch_size else 0
+    if m > bit_parallel_max_len:
+        raise ValueError('Bit-parallel edit distance takes sequences of at most {} symbols, got {}'.format(
+            bit_parallel_max_len, m))
+    rows = np.arange(batch_size)
+    # peq[k, v + 1] holds the bits i where seq1[k, i] is v
+    peq = np.zeros((batch_size, max(int(seq1[:, :m].max(initial=-1)), int(seq2.max(initial=-1))) + 2), dtype=np.uint64)
+    for i in range(m):
+        peq[rows, seq1[:, i] + 1] |= np.uint64(1) << np.uint64(i)
+    code2 = seq2.T + 1
+
+    one = np.uint64(1)
+    pv = np.full(batch_size, ~np.uint64(0))
+    mv = np.zeros(batch_size, dtype=np.uint64)
+    col_pv = np.empty((n + 1, batch_size), dtype=np.uint64)
+    col_mv = np.empty((n + 1, batch_size), dtype=np.uint64)
+    col_pv[0], col_mv[0] = pv, mv
+    for j in range(n):
+        eq = peq[rows, code2[j]]
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        # Horizontal deltas of the column, D[0, j] - D[0, j - 1] = +1 is shifted in
+        ph = ((mv | ~(xh | pv)) << one) | one
+        mh = (pv & xh) << one
+        pv = mh | ~(xv | ph)
+        mv = ph & xv
+        col_pv[j + 1], col_mv[j + 1] = pv, mv
+    return col_pv, col_mv
+
+
+def bit_parallel_distance(seq1, len1, seq2, len2):
+    """Levenshtein distances (int64 array [batch]) between the rows of the padded label arrays seq1 [batch, m] and
+    seq2 [batch, n] up to len1 / len2, with seq1 of at most 64 symbols
+    """
+    len1, len2 = np.asarray(len1, dtype=np.int64), np.asarray(len2, dtype=np.int64)
+    col_pv, col_mv = bit_parallel_columns(seq1, len1, seq2, len2)
+    rows = np.arange(len(len1))
+    low = low_bits(len1)
+    return len2 + popcount(col_pv[len2, rows] & low).astype(np.int64) - popcount(col_mv[len2, rows] & low)
+
+
+def bit_parallel_table(seq1, len1, seq2, len2):
+    """DP tables D [m + 1, n + 1, batch] (see batch_distance_table) rebuilt from the bit-parallel columns, with seq1 of
+    at most 64 symbols
+    """
+    col_pv, col_mv = bit_parallel_columns(seq1, len1, seq2, len2)
+    m = int(np.max(len1, initial=0))
+    table = np.empty((m + 1,) + col_pv.shape, dtype=np.int32)
+    table[0] = np.arange(col_pv.shape[0])[:, None]
+    for i in range(1, m + 1):
+        low = low_bits(i)
+        np.add(table[0], popcount(col_pv & low), out=table[i])
+        table[i] -= popcount(col_mv & low)
+    return table
+
+def batch_alignment(seq1, len1, seq2, len2, table=None):
+    """Alignment of every pair of rows of the padded integer arrays seq1 [batch, m] and seq2 [batch, n] (up to
+    len1 / len2), the operations turning seq1 into seq2 traced back from the end of the DP tables with the tie break of
+    lowest_cost_action (substitution or match first, then insertion, then deletion)
+    Output: (ops, tok1, tok2) arrays [batch, steps], the operation code of every step (from the end of the sequences)
+    and the token of seq1 / seq2 it consumes, -1 when it consumes none or past the end of a trace
+    """
+    seq1, seq2 = np.asarray(seq1), np.asarray(seq2)
+    len1, len2 = np.asarray(len1, dtype=np.int64), np.asarray(len2, dtype=np.int64)
+    if table is None:
+        table = batch_distance_table(seq1, len1, seq2, len2)
+    m, n, batch_size = table.shape[0] - 1, table.shape[1] - 1, table.shape[2]
+    # Cells are addressed in the flattened table. mismatch[i, j] is the cost of reaching (i, j) by the diagonal, a
+    # sentinel cost on row / column 0 rules out the diagonal moves leaving the table
+    mismatch = np.full(table.shape, 2 * (m + n + 1), dtype=np.int16)
+    mismatch[1:, 1:] = seq1[:, :m].T[:, None, :] != seq2.T[None, :, :]
+    table, mismatch = table.reshape(-1), mismatch.reshape(-1)
+    left, up = batch_size, (n + 1) * batch_size
+    cell = (len1 * (n + 1) + len2) * batch_size + np.arange(batch_size)
+    trace_ops, trace_cells = [], []
+    while cell.max() >= batch_size:
+        cost = table[cell]
+        cell_mismatch = mismatch[cell]
+        # Row 0 holds the sentinel, the diagonal neighbour of a cell of row 0 may wrap around
+        diagonal = table.take(cell - up - left, mode='wrap') + cell_mismatch == cost
+        insert = ~diagonal & (cell % up >= left) & (table[cell - left] + 1 == cost)
+        trace_ops.append(np.where(diagonal, cell_mismatch, np.where(insert, OP_INSERT, OP_DELETE)))
+        trace_cells.append(cell)
+        cell = cell - np.where(diagonal, up + left, np.where(insert, left, up)) * (cell >= batch_size)
+
+    # Steps taken from cell (0, 0), where no move applies, are the padding of finished traces
+    trace_cells = np.array(trace_cells, dtype=np.int64).reshape(-1, batch_size).T // batch_size
+    ops = np.where(trace_cells > 0, np.array(trace_ops, dtype=np.int8).reshape(-1, batch_size).T, -1).astype(np.int8)
+    # Token consumed at every step, the padding column makes seq[:, i - 1] -1 for i = 0
+    batch = np.arange(batch_size)[:, None]
+    seq1 = np.concatenate([np.full((batch_size, 1), -1), seq1[:, :m]], axis=1)
+    seq2 = np.concatenate([np.full((batch_size, 1), -1), seq2], axis=1)
+    diagonal = (ops == OP_EQUAL) | (ops == OP_REPLACE)
+    tok1 = np.where(diagonal | (ops == OP_DELETE), seq1[batch, trace_cells // (n + 1)], -1)
+    tok2 = np.where(diagonal | (ops == OP_INSERT), seq2[batch, trace_cells % (n + 1)], -1)
+    return ops, tok1, tok2
 
 
 if __name__ == '__main__':
@@ -180,4 +329,5 @@ if __name__ == '__main__':
     true = [2, 17, 4, 18]
     print(ed.eval(pred, true)/len(true))
     print(edit_distance(pred, true)/len(true))
-    print(edit_distance_by_phoneme(pred, true)/len(true))
+    distance, class_errors = edit_distance_by_phoneme(pred, true)
+    print(distance/len(true), dict(zip(broad_classes, class_errors)))
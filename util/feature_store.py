@@ -0,0 +1,269 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from tqdm import tqdm
+
+# Feature store : a directory of memory-mapped splits replacing the monolithic preprocessing pickle
+#
+#   <split>.<shard>.npy          float32 features of every utterance in the shard, concatenated along time
+#                                with shape [total frames, feature dim]
+#   <split>.<shard>.index.npz    lengths (frames per utterance), label_lengths, labels (int32, concatenated), keys
+#   <split>.index.npz            merged index of the split (see merge_shards)
+#   norm.npz                     mean / std of the training features (optional, see write_norm_param)
+#
+# Splits are opened with np.load(mmap_mode='r') so loading is zero-copy, utterances are views into the page cache
+# which concurrent experiments on the same host share. Preprocessing writes one shard per split, corpora too large
+# to hold in memory are written shard by shard (write_shard) and merged at the end (merge_shards).
+# Features are stored unnormalized when norm.npz is present, splits normalize utterances as they are read.
+
+# Split names of every store (TIMIT, LibriSpeech and KsponSpeech preprocessing)
+SPLITS = ['train', 'valid', 'test']
+NORM_FILE = 'norm.npz'
+
+
+def shard_path(store_dir, split, shard):
+    return os.path.join(store_dir, '{}.{:05d}'.format(split, shard))
+
+
+def write_shard(store_dir, split, shard, X, Y, keys=None):
+    # X : list of np array with shape (timestep, feature), Y : list of label sequence (np array or list of int)
+    os.makedirs(store_dir, exist_ok=True)
+    path = shard_path(store_dir, split, shard)
+    lengths = np.array([len(x) for x in X], dtype=np.int64)
+    label_lengths = np.array([len(y) for y in Y], dtype=np.int64)
+    feature_dim = X[0].shape[-1] if len(X) > 0 else 0
+
+    # Write through a memmap of the final size instead of concatenating X in memory
+    features = np.lib.format.open_memmap(path + '.npy.tmp', mode='w+', dtype=np.float32,
+                                         shape=(int(lengths.sum()), feature_dim))
+    offset = 0
+    for x in X:
+        features[offset:offset+len(x)] = x
+        offset += len(x)
+    features.flush()
+    del features
+
+    labels = np.concatenate([np.asarray(y, dtype=np.int32) for y in Y]) if len(Y) > 0 else np.zeros(0, np.int32)
+    keys = np.array(keys if keys is not None else [], dtype=str)
+    with open(path + '.index.npz.tmp', 'wb') as f:
+        np.savez(f, lengths=lengths, label_lengths=label_lengths, labels=labels, keys=keys)
+    # Rename last so that an interrupted writer never leaves a shard that looks complete
+    os.replace(path + '.npy.tmp', path + '.npy')
+    os.replace(path + '.index.npz.tmp', path + '.index.npz')
+
+
+def list_shards(store_dir, split):
+    paths = glob.glob(os.path.join(store_dir, '{}.[0-9]*.index.npz'.format(split)))
+    return sorted(int(os.path.basename(p).split('.')[1]) for p in paths)
+
+
+def remove_split(store_dir, split):
+    # Remove the shards and index of a split before it is rewritten
+    for path in glob.glob(os.path.join(store_dir, '{}.*'.format(split))):
+        os.remove(path)
+
+
+def merge_shards(store_dir, split):
+    # Merged index: shard id and frame offset of each utterance in its shard, lengths, label offsets (N+1) and labels
+    shard_ids, offsets, lengths, label_lengths, labels, keys = [], [], [], [], [], []
+    for shard in list_shards(store_dir, split):
+        with np.load(shard_path(store_dir, split, shard) + '.index.npz') as index:
+            shard_lengths = index['lengths']
+            label_lengths.append(index['label_lengths'])
+            labels.append(index['labels'])
+            keys.append(index['keys'])
+        shard_ids.append(np.full(len(shard_lengths), shard, dtype=np.int32))
+        offsets.append(np.cumsum(shard_lengths) - shard_lengths)
+        lengths.append(shard_lengths)
+
+    assert len(lengths) > 0, 'No shard of split {} in {}'.format(split, store_dir)
+    label_lengths = np.concatenate(label_lengths)
+    with open(os.path.join(store_dir, split + '.index.npz'), 'wb') as f:
+        np.savez(f, shard=np.concatenate(shard_ids), offset=np.concatenate(offsets), length=np.concatenate(lengths),
+                 label_offset=np.append(0, np.cumsum(label_lengths)), labels=np.concatenate(labels),
+                 keys=np.concatenate(keys))
+
+
+##### PARALLEL EXTRACTION #####
+# A split is cut into shards of shard_size utterances, every shard is extracted and written by one worker process
+# Utterances are (key, source, label), extract(source) returns (float32 feature with shape (timestep, feature),
+# seconds of audio) and must be picklable (module level function or functools.partial of one)
+# An existing shard holding the same keys is reused unless restart is set, so an interrupted run resumes where it
+# stopped, the RunningStats of reused shards are read back from disk
+
+def shard_keys(path):
+    with np.load(path + '.index.npz') as index:
+        return index['keys']
+
+
+def extract_shard(task):
+    # Returns (utterances, seconds of audio, RunningStats of the features, whether the shard was computed)
+    from util.features import RunningStats
+    store_dir, split, shard, utterances, extract, restart = task
+    path = shard_path(store_dir, split, shard)
+    stats = RunningStats()
+    if not restart and os.path.isfile(path + '.index.npz') and os.path.isfile(path + '.npy') and \
+            np.array_equal(shard_keys(path), [key for key, _, _ in utterances]):
+        features = np.load(path + '.npy', mmap_mode='r')
+        for start in range(0, features.shape[0], 100000):
+            stats.update(features[start:start+100000])
+        return len(utterances), 0.0, stats, False
+
+    X, Y, keys = [], [], []
+    duration = 0.0
+    for key, source, label in utterances:
+        feature, seconds = extract(source)
+        stats.update(feature)
+        X.append(feature)
+        Y.append(label)
+        keys.append(key)
+        duration += seconds
+    write_shard(store_dir, split, shard, X, Y, keys)
+    return len(utterances), duration, stats, True
+
+
+def extract_split(pool, store_dir, split, utterances, extract, shard_size, restart=False):
+    # Extract, write and merge a whole split with a multiprocessing pool, returns the RunningStats of its features
+    from util.features import RunningStats
+    print('Processing', split, '({} utterances)'.format(len(utterances)), flush=True)
+    if restart:
+        remove_split(store_dir, split)
+    tasks = [(store_dir, split, shard, utterances[left:left+shard_size], extract, restart)
+             for shard, left in enumerate(range(0, len(utterances), shard_size))]
+    # Shards left over by a previous run with more shards would be merged into the split, an interrupted run may have
+    # left only part of their files
+    for shard in list_shards(store_dir, split):
+        if shard >= len(tasks):
+            for postfix in ['.npy', '.index.npz']:
+                if os.path.exists(shard_path(store_dir, split, shard) + postfix):
+                    os.remove(shard_path(store_dir, split, shard) + postfix)
+
+    stats = RunningStats()
+    n_utt, duration, n_resumed = 0, 0.0, 0
+    begin = time.time()
+    for shard_utt, shard_duration, shard_stats, computed in tqdm(pool.imap(extract_shard, tasks), total=len(tasks)):
+        stats.merge(shard_stats)
+        if computed:
+            n_utt += shard_utt
+            duration += shard_duration
+        else:
+            n_resumed += 1
+    elapsed = max(time.time() - begin, 1e-9)
+    merge_shards(store_dir, split)
+
+    if n_resumed > 0:
+        print('Resumed', n_resumed, 'shards already on disk')
+    print('{} utterances ({:.2f} hours of audio) in {:.1f} s : {:.1f} utt/s, {:.0f}x real time'.format(
+          n_utt, duration / 3600, elapsed, n_utt / elapsed, duration / elapsed), flush=True)
+    return stats
+
+
+def write_split(store_dir, split, X, Y, keys=None):
+    write_shard(store_dir, split, 0, X, Y, keys)
+    merge_shards(store_dir, split)
+
+
+def write_norm_param(store_dir, stats):
+    # stats : util.features.RunningStats of the training features
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, NORM_FILE)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, mean=stats.mean, std=stats.std, count=stats.count)
+    os.replace(path + '.tmp', path)
+
+
+def load_norm_param(store_dir):
+    # Returns (mean, std), or None if the features of the store are already normalized
+    path = os.path.join(store_dir, NORM_FILE)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as norm_param:
+        return norm_param['mean'], norm_param['std']
+
+
+# Read-only list-like view of a split, indexing returns np array views of the memory-mapped shards
+# (normalized float32 copies if the store has normalization parameters and normalize is set)
+class FeatureSplit(object):
+    def __init__(self, store_dir, split, mmap_mode='r', normalize=True):
+        with np.load(os.path.join(store_dir, split + '.index.npz')) as index:
+            self.shard = index['shard']
+            self.offset = index['offset']
+            self.lengths = index['length']
+            self.label_offset = index['label_offset']
+            self.labels = index['labels']
+            self.keys = index['keys']
+        self.features = {shard: np.load(shard_path(store_dir, split, shard) + '.npy', mmap_mode=mmap_mode)
+                         for shard in np.unique(self.shard)}
+        self.norm_param = load_norm_param(store_dir) if normalize else None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        offset = self.offset[index]
+        x = self.features[self.shard[index]][offset:offset+self.lengths[index]]
+        if self.norm_param is not None:
+            mean, std = self.norm_param
+            x = ((x - mean) / std).astype(np.float32)
+        return x
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def get_label(self, index):
+        return self.labels[self.label_offset[index]:self.label_offset[index+1]]
+
+    def get_labels(self):
+        return LabelSplit(self)
+
+
+# List-like view of the labels of a FeatureSplit
+class LabelSplit(object):
+    def __init__(self, feature_split):
+        self.feature_split = feature_split
+
+    def __len__(self):
+        return len(self.feature_split)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.feature_split.get_label(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def is_feature_store(data_path):
+    return os.path.isdir(data_path) and os.path.isfile(os.path.join(data_path, SPLITS[0] + '.index.npz'))
+
+
+def load_feature_store(store_dir, splits=SPLITS):
+    # Returns [X_split0, y_split0, X_split1, y_split1, ...] with the same layout as the preprocessing pickle
+    data = []
+    for split in splits:
+        feature_split = FeatureSplit(store_dir, split)
+        data.extend([feature_split, feature_split.get_labels()])
+    return data
+
+
+def pickle_to_feature_store(pkl_path, store_dir):
+    # Convert a preprocessing pickle [X_train, y_train, X_valid, y_valid, X_test, y_test] into a feature store
+    from six.moves import cPickle
+    with open(pkl_path, 'rb') as cPickle_file:
+        data = cPickle.load(cPickle_file)
+    for i, split in enumerate(SPLITS):
+        write_split(store_dir, split, data[2*i], data[2*i+1])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python3 feature_store.py <preprocessed pickle> <feature store directory>')
+        sys.exit(1)
+    pickle_to_feature_store(sys.argv[1], sys.argv[2])
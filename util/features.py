@@ -0,0 +1,128 @@
+import numpy as np
+
+
+# Delta (regression) coefficients over time of a feature matrix x with shape (feature, timestep)
+# d[:, t] = sum_n n * (x[:, t+n] - x[:, t-n]) / (2 * sum_n n^2), n = 1..N, with edge padding at both ends
+# Computed with one shifted difference of the whole matrix per n (same summation order as the frame-wise formula,
+# so results are numerically identical to it)
+def get_delta(x, N):
+    pad_x = np.pad(x, ((0, 0), (N, N)), 'edge')
+    return shifted_delta(pad_x, N)
+
+
+# Batched get_delta for a list of feature matrices with shape (feature, timestep_i)
+# Utterances are edge padded individually and concatenated along time, so a single pass covers the whole batch
+def get_delta_batch(X, N):
+    pad_x = np.concatenate([np.pad(x, ((0, 0), (N, N)), 'edge') for x in X], axis=1)
+    delta = shifted_delta(pad_x, N)
+    offsets = np.cumsum([0] + [np.shape(x)[1] + 2*N for x in X])
+    return [delta[:, offset:offset+np.shape(x)[1]] for offset, x in zip(offsets, X)]
+
+
+# Delta of every column of an already padded matrix, column t is the delta of pad_x[:, t+N]
+# Accumulated in place in the same order as n * (x[t+n] - x[t-n]) summed over n, then divided by 2 * sum_n n^2
+def shifted_delta(pad_x, N):
+    length = np.shape(pad_x)[1] - 2*N
+    tmp1 = np.subtract(pad_x[:, N+1:N+1+length], pad_x[:, N-1:N-1+length])
+    tmp2 = 2
+    diff = np.empty_like(tmp1)
+    for n in range(2, N + 1):
+        np.subtract(pad_x[:, N+n:N+n+length], pad_x[:, N-n:N-n+length], out=diff)
+        diff *= n
+        tmp1 += diff
+        tmp2 += 2 * n * n
+    if tmp1.dtype != np.float64:
+        return np.divide(tmp1, tmp2).astype(np.float64)
+    tmp1 /= tmp2
+    return tmp1
+
+
+# librosa.power_to_db applied independently to every row of S (one call per frame), so the top_db floor is taken
+# from the maximum of each row instead of the whole matrix
+def power_to_db_frames(S, ref=1.0, amin=1e-10, top_db=80.0):
+    log_spec = 10.0 * np.log10(np.maximum(amin, S))
+    log_spec -= 10.0 * np.log10(np.maximum(amin, np.abs(ref)))
+    if top_db is not None:
+        log_spec = np.maximum(log_spec, log_spec.max(axis=-1, keepdims=True) - top_db)
+    return log_spec
+
+
+# Sums of x over the windows [start, start+width) along the last axis
+# Differences of a cumulative sum, so every window costs O(1) whatever its width
+def window_sum(x, start, width):
+    acc = np.zeros(np.shape(x)[:-1] + (np.shape(x)[-1] + 1,))
+    np.cumsum(x, axis=-1, out=acc[..., 1:])
+    return acc[..., start + width] - acc[..., start]
+
+
+# Frame-level features of a spikegram y with shape (n_band, samples), frames of `frame` samples every hop_length
+#   spectral : power_to_db of the band energies of each frame, then summed over groups of n_band//n_band_sum bands
+#              (n_band_sum = n_band keeps every band, 0 disables the spectral part)
+#   temporal : power_to_db of the energy (all bands) of n_time equal sub-windows of each frame
+#              (0 disables the temporal part)
+# Return : np array with shape (n_band_sum + n_time, num_of_frame)
+def spikegram_feature(y, frame, hop_length, n_band_sum=8, n_time=8):
+    feature = []
+    if n_band_sum:
+        feature.append(pool_bands(spikegram_spectral(y, frame, hop_length), n_band_sum))
+    if n_time:
+        feature.append(spikegram_temporal(y, frame, hop_length, n_time))
+    return np.concatenate(feature, axis=0)
+
+
+def frame_start(n_sample, frame, hop_length):
+    num_of_frame = int((n_sample - frame) / hop_length + 1)
+    return np.arange(num_of_frame) * hop_length
+
+
+# power_to_db of the band energies of every frame, shape (n_band, num_of_frame)
+def spikegram_spectral(y, frame, hop_length):
+    start = frame_start(np.shape(y)[1], frame, hop_length)
+    return power_to_db_frames(window_sum(y, start, frame).T + 1).T
+
+
+# power_to_db of the energy of n_time sub-windows of every frame, shape (n_time, num_of_frame)
+def spikegram_temporal(y, frame, hop_length, n_time):
+    start = frame_start(np.shape(y)[1], frame, hop_length)
+    width = frame // n_time
+    sub_start = (start[:, None] + np.arange(n_time) * width).reshape(-1)
+    temporal = window_sum(np.sum(y, axis=0), sub_start, width).reshape((-1, n_time))
+    return power_to_db_frames(temporal + 1).T
+
+
+# Sum groups of n_band//n_band_sum adjacent bands of a (n_band, frame) feature
+def pool_bands(x, n_band_sum):
+    n_band = np.shape(x)[0]
+    return np.sum(x.reshape((n_band_sum, n_band // n_band_sum, -1)), axis=1)
+
+
+# Streaming per-dimension mean / standard deviation of feature frames (Welford's update, Chan et al.'s merge)
+# update folds a whole (timestep, feature) matrix in one vectorized step, partial statistics of workers, shards or
+# splits are combined with merge. The result equals np.mean / np.std of all frames concatenated, without holding them
+class RunningStats(object):
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        batch = RunningStats()
+        batch.count = x.shape[0]
+        batch.mean = np.mean(x, axis=0)
+        batch.m2 = np.sum(np.square(x - batch.mean), axis=0)
+        return self.merge(batch)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + np.square(delta) * (self.count * other.count / count)
+        self.count = count
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
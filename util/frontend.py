@@ -0,0 +1,155 @@
+import math
+import functools
+import numpy as np
+import librosa
+from util.features import power_to_db_frames
+
+# Batched spectral front-end
+# Analysis windows and mel filterbanks are built once per parameter set (librosa and python_speech_features rebuild
+# them on every call), spectrogram -> mel -> dB runs as one numpy pipeline on all frames of an utterance
+
+
+@functools.lru_cache(maxsize=None)
+def get_window(n_fft, window='hann'):
+    # Periodic window, as used by librosa.stft
+    fft_window = librosa.filters.get_window(window, n_fft, fftbins=True)
+    fft_window.setflags(write=False)
+    return fft_window
+
+
+@functools.lru_cache(maxsize=None)
+def mel_filterbank(sr, n_fft, n_mels, fmin=0.0, fmax=None):
+    # librosa.filters.mel, shape (n_mels, 1 + n_fft//2)
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmin=fmin, fmax=fmax)
+    mel_basis.setflags(write=False)
+    return mel_basis
+
+
+def frame_signal(y, frame, hop_length, num_of_frame=None):
+    # Zero-copy view of the frames of y with shape (num_of_frame, frame), frames are not padded (center=False)
+    frames = np.lib.stride_tricks.sliding_window_view(y, frame)[::hop_length]
+    return frames if num_of_frame is None else frames[:num_of_frame]
+
+
+class LogMel(object):
+    """Fused power spectrogram -> mel -> dB, same values as
+    librosa.power_to_db(librosa.feature.melspectrogram(y, sr, n_fft, hop_length, n_mels, center=False))
+    The windowed frames and the spectrogram are written into buffers kept between calls (grown when needed),
+    so a long run over a corpus does not allocate them for every utterance (one instance per process or thread)"""
+    def __init__(self, sr=16000, n_fft=400, hop_length=160, n_mels=40, fmin=0.0, fmax=None, top_db=80.0):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.n_mels = n_mels
+        self.fmin = fmin
+        self.fmax = fmax
+        self.top_db = top_db
+        self.frame_buffer = np.zeros((0, n_fft))
+        self.spectrogram_buffer = np.zeros((0, 1 + n_fft // 2))
+
+    def buffers(self, num_of_frame):
+        if self.frame_buffer.shape[0] < num_of_frame:
+            self.frame_buffer = np.zeros((2 * num_of_frame, self.n_fft))
+            self.spectrogram_buffer = np.zeros((2 * num_of_frame, 1 + self.n_fft // 2))
+        return self.frame_buffer[:num_of_frame], self.spectrogram_buffer[:num_of_frame]
+
+    def power_spectrogram(self, y):
+        # |STFT|^2 with shape (num_of_frame, 1 + n_fft//2), valid until the next call
+        frames = frame_signal(y, self.n_fft, self.hop_length)
+        windowed, spectrogram = self.buffers(frames.shape[0])
+        np.multiply(frames, get_window(self.n_fft), out=windowed)
+        np.abs(np.fft.rfft(windowed, axis=-1), out=spectrogram)
+        spectrogram **= 2.0
+        return spectrogram
+
+    def mel(self, spectrogram):
+        # Mel spectrogram with shape (n_mels, num_of_frame)
+        return np.matmul(mel_filterbank(self.sr, self.n_fft, self.n_mels, self.fmin, self.fmax), spectrogram.T)
+
+    def power_to_db(self, mel):
+        # librosa.power_to_db (ref=1.0, amin=1e-10) in place, top_db over the whole utterance
+        np.maximum(mel, 1e-10, out=mel)
+        np.log10(mel, out=mel)
+        mel *= 10.0
+        if self.top_db is not None:
+            np.maximum(mel, mel.max() - self.top_db, out=mel)
+        return mel
+
+    def __call__(self, y):
+        return self.power_to_db(self.mel(self.power_spectrogram(y)))
+
+
+def log_mel_spectrogram(y, sr=16000, n_fft=400, hop_length=160, n_mels=40, fmin=0.0, fmax=None, top_db=80.0):
+    return get_log_mel(sr, n_fft, hop_length, n_mels, fmin, fmax, top_db)(y)
+
+
+@functools.lru_cache(maxsize=None)
+def get_log_mel(sr, n_fft, hop_length, n_mels, fmin=0.0, fmax=None, top_db=80.0):
+    return LogMel(sr, n_fft, hop_length, n_mels, fmin, fmax, top_db)
+
+
+# log mel spectrogram of the sub-frames of every frame, computed for all frames at once
+# Frame i covers sample[i*hop_length : i*hop_length+frame] and is cut into non-overlapping sub-frames of n_sub_fft
+# samples, each one analysed like librosa.feature.melspectrogram(frame, n_fft=n_sub_fft, hop_length=n_sub_fft,
+# n_mels=n_mels, center=False) followed by librosa.power_to_db on the (n_mels, n_sub) matrix of the frame
+# Return : np array with shape (num_of_frame, n_mels, n_sub)
+def sub_frame_mel(sample, num_of_frame, sr=16000, frame=400, hop_length=160, n_sub_fft=50, n_mels=8):
+    n_sub = (frame - n_sub_fft) // n_sub_fft + 1
+    frames = frame_signal(sample, frame, hop_length, num_of_frame)
+    frames = frames[:, :n_sub*n_sub_fft].reshape(num_of_frame, n_sub, n_sub_fft)
+
+    spectrogram = np.abs(np.fft.rfft(get_window(n_sub_fft) * frames, axis=-1)) ** 2.0
+    mel = np.matmul(mel_filterbank(sr, n_sub_fft, n_mels), spectrogram.transpose(0, 2, 1))
+    return power_to_db_frames(mel.reshape(num_of_frame, -1)).reshape(num_of_frame, n_mels, n_sub)
+
+
+##### python_speech_features compatible log filterbank #####
+
+def hz2mel(hz):
+    return 2595 * np.log10(1+hz/700.)
+
+
+def mel2hz(mel):
+    return 700*(10**(mel/2595.0)-1)
+
+
+@functools.lru_cache(maxsize=None)
+def psf_filterbank(nfilt=26, nfft=512, samplerate=16000, lowfreq=0, highfreq=None):
+    # python_speech_features.get_filterbanks, shape (nfilt, nfft//2 + 1)
+    highfreq = highfreq or samplerate/2
+    assert highfreq <= samplerate/2, "highfreq is greater than samplerate/2"
+    melpoints = np.linspace(hz2mel(lowfreq), hz2mel(highfreq), nfilt+2)
+    bin = np.floor((nfft+1)*mel2hz(melpoints)/samplerate)
+
+    fbank = np.zeros([nfilt, nfft//2+1])
+    for j in range(0, nfilt):
+        for i in range(int(bin[j]), int(bin[j+1])):
+            fbank[j, i] = (i - bin[j]) / (bin[j+1]-bin[j])
+        for i in range(int(bin[j+1]), int(bin[j+2])):
+            fbank[j, i] = (bin[j+2]-i) / (bin[j+2]-bin[j+1])
+    fbank.setflags(write=False)
+    return fbank
+
+
+def logfbank(signal, samplerate=16000, winlen=0.025, winstep=0.01, nfilt=26, nfft=512, lowfreq=0, highfreq=None,
+             preemph=0.97):
+    """Same output as python_speech_features.logfbank (rectangular window), shape (num_of_frame, nfilt)"""
+    signal = np.append(signal[0], signal[1:] - preemph * signal[:-1])
+    frame_len = int(round_half_up(winlen*samplerate))
+    frame_step = int(round_half_up(winstep*samplerate))
+    if len(signal) <= frame_len:
+        num_of_frame = 1
+    else:
+        num_of_frame = 1 + int(math.ceil((1.0*len(signal) - frame_len)/frame_step))
+    padlen = int((num_of_frame-1)*frame_step + frame_len)
+    signal = np.concatenate((signal, np.zeros((padlen - len(signal),))))
+
+    frames = frame_signal(signal, frame_len, frame_step)
+    pspec = 1.0/nfft * np.square(np.absolute(np.fft.rfft(frames, nfft)))
+    feat = np.dot(pspec, psf_filterbank(nfilt, nfft, samplerate, lowfreq, highfreq).T)
+    feat = np.where(feat == 0, np.finfo(float).eps, feat)
+    return np.log(feat)
+
+
+def round_half_up(number):
+    return int(math.floor(number + 0.5))
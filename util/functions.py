@@ -2,8 +2,9 @@ import torch
 import torch.nn as nn
 from torch.autograd import Variable  
 import numpy as np
-import editdistance as ed
 import time
+from util.edit_distance import index2phonemes, reduce_table, reduce_index, reduce_position, broad_classes, \
+    broad_class_table, batch_edit_distance, batch_alignment, OP_EQUAL, OP_REPLACE, OP_INSERT, OP_DELETE
 
 
 def create_onehot_variable(input_x, encoding_dim=63):
@@ -39,92 +40,96 @@ def time_distributed(input_module, input_x):
     return output_x.view(batch_size, time_steps, -1)
 
 
-def letter_error_rate(pred_y, true_y, data):
-    # letter_error_rate function
-    # Merge the repeated prediction and calculate edit distance of prediction and ground truth
-    ed_accumalate = []
-    for p, t in zip(pred_y, true_y):
-        compressed_t = [w for w in t if (w != 1 and w != 0)]
-        
-        compressed_p = []
-        for p_w in p:
-            if p_w == 0:
-                continue
-            if p_w == 1:
-                break
-            compressed_p.append(p_w)
-        if data == 'timit':
-            compressed_t = collapse_phn(compressed_t)
-            compressed_p = collapse_phn(compressed_p)
-        ed_accumalate.append(ed.eval(compressed_p, compressed_t)/len(compressed_t))
-    return ed_accumalate
-
-
-def letter_error_rate_by_phonetic_class(pred_y, true_y, data):
-    def get_class(idx):
-        reduce_idx2broad_class_idx = {2: 0, 4: 0, 6: 0, 8: 0, 10: 0, 12: 0, 14: 0,  # Stops      b, d, g, p, t, k, dx, q
-                                      16: 1, 17: 1,  # Affricate  jh, ch
-                                      18: 2, 19: 2, 20: 2, 22: 2, 23: 2, 24: 2, 25: 2,  # Fricative  s, sh, z, zh, f, th, v, dh
-                                      33: 3, 34: 3, 35: 3, 36: 3, 37: 3,  # Glides     l, r, w, y, hh, hv, el
-                                      26: 4, 27: 4, 28: 4,  # Nasals     m, n, ng, em, en, eng, nx
-                                      40: 5, 41: 5, 42: 5, 43: 5, 44: 5, 45: 5, 46: 5, 47: 5, 48: 5, 50: 5, 51: 5, 52: 5, 53: 5, 55: 5,  # Vowels     iy, ih, eh, ey, ae, aa, aw, ay, ah, ao, oy, ow, uh, uw, ux, er, ax, ix, axr, ax-h
-                                      62: 6}  # Others     pau, epi, h#
-        return reduce_idx2broad_class_idx[idx]
+def stack_raw_pred_seq(raw_pred_seq, max_label_len):
+    # Stack the step-wise Speller output into shape [batch size, max_label_len, output class dim]
+    # Decoding stopped early (Speller.forward_early_stop) returns fewer steps, the last step then holds the <eos>
+    # prediction of every sequence and is repeated up to max_label_len
+    pred_y = torch.stack(raw_pred_seq, dim=1)[:, :max_label_len, :]
+    if pred_y.size(1) < max_label_len:
+        pred_y = torch.cat([pred_y, pred_y[:, -1:, :].expand(-1, max_label_len-pred_y.size(1), -1)], dim=1)
+    return pred_y.contiguous()
+
+
+def compress_label(y, data, stop_at_eos):
+    # Left-pack the tokens of a padded label batch y [batch size, timestep] (numpy array or tensor on any device)
+    # <sos> / padding (0) is dropped, a prediction stops at its first <eos> (1) while <eos> is dropped from a ground
+    # truth, TIMIT phones are collapsed into 39 phones with q discarded (lookup in reduce_table)
+    # Output: (tokens, lengths), a LongTensor [batch size, timestep] padded with -1 and the number of tokens per row
+    y = torch.as_tensor(y).long()
+    keep = y > 1
+    if stop_at_eos:
+        keep &= torch.cumsum(y == 1, dim=1) == 0
+    if data == 'timit':
+        y = torch.as_tensor(reduce_table, device=y.device)[y]
+        keep &= y >= 0
+    order = torch.argsort((~keep).to(torch.uint8), dim=1, stable=True)
+    return torch.where(keep, y, -1).gather(1, order), keep.sum(dim=1)
+
 
+def letter_error_rate(pred_y, true_y, data):
     # letter_error_rate function
     # Merge the repeated prediction and calculate edit distance of prediction and ground truth
-    ed_accumalate, ed_accumalate_by_class = [], []
-    for p, t in zip(pred_y, true_y):
-        compressed_t = [w for w in t if (w != 1 and w != 0)]
-
-        compressed_p = []
-        for p_w in p:
-            if p_w == 0:
-                continue
-            if p_w == 1:
-                break
-            compressed_p.append(p_w)
-        if data == 'timit':
-            compressed_t = collapse_phn(compressed_t)
-            compressed_p = collapse_phn(compressed_p)
-
-        ed_accumalate.append(ed.eval(compressed_p, compressed_t) / len(compressed_t))
-
-        compressed_t_by_class = [[] for _ in range(7)]
-        compressed_p_by_class = [[] for _ in range(7)]
-
-        for ta in compressed_t:
-            compressed_t_by_class[get_class(ta)].append(ta)
-        for pr in compressed_p:
-            compressed_p_by_class[get_class(pr)].append(pr)
-
-        by_class = []
-        for ct, cp in zip(compressed_t_by_class, compressed_p_by_class):
-            if not ct:
-                by_class.append(0)
-            else:
-                by_class.append(ed.eval(cp, ct) / len(ct))
-        ed_accumalate_by_class.append(by_class)
-    return ed_accumalate, ed_accumalate_by_class
+    # pred_y / true_y are label index batches [batch size, timestep], compressed at once on the device holding them,
+    # only the compressed tokens are copied to the host. Output: numpy array of the error rate of every sequence
+    pred, pred_len = compress_label(pred_y, data, stop_at_eos=True)
+    true, true_len = compress_label(true_y, data, stop_at_eos=False)
+    true_len = true_len.cpu().numpy()
+    return batch_edit_distance(pred.cpu(), pred_len.cpu(), true.cpu(), true_len) / true_len
+
+
+def letter_error_rate_by_phonetic_class(pred_y, true_y, data, confusion=None):
+    # letter_error_rate function with the errors attributed to the broad phonetic classes (TIMIT)
+    # Every prediction is aligned once with its ground truth (batch_alignment), a replaced or missed phone of the ground
+    # truth counts as an error of its class, an inserted phone of the prediction as an error of its own class
+    # Output: (error rate of every sequence, error rate of every class [batch size, 7], 0 for a class missing from the
+    #         ground truth), the [39, 39] confusion matrix (ground truth x prediction) of the aligned phones is
+    #         accumulated into confusion if given
+    pred, pred_len = compress_label(pred_y, data, stop_at_eos=True)
+    true, true_len = compress_label(true_y, data, stop_at_eos=False)
+    true, true_len = true.cpu().numpy(), true_len.cpu().numpy()
+    ops, tok_pred, tok_true = batch_alignment(pred.cpu().numpy(), pred_len.cpu().numpy(), true, true_len)
+
+    # Errors and ground truth phones are counted per (sequence, class) with a single bincount
+    n_class = len(broad_classes)
+    rows = np.arange(len(true))[:, None] * n_class
+    error = (ops == OP_REPLACE) | (ops == OP_INSERT) | (ops == OP_DELETE)
+    error_class = broad_class_table[np.where(ops == OP_DELETE, tok_pred, tok_true)]
+    class_errors = np.bincount((rows + error_class)[error], minlength=rows.size * n_class).reshape(-1, n_class)
+    valid = np.arange(true.shape[1]) < true_len[:, None]
+    class_count = np.bincount((rows + broad_class_table[true])[valid], minlength=rows.size * n_class)
+    class_count = class_count.reshape(-1, n_class)
+    ed_accumalate_by_class = np.divide(class_errors, class_count, out=np.zeros(class_errors.shape),
+                                       where=class_count > 0)
+
+    if confusion is not None:
+        aligned = (ops == OP_EQUAL) | (ops == OP_REPLACE)
+        n_phn = len(reduce_index)
+        confusion += np.bincount(reduce_position[tok_true[aligned]] * n_phn + reduce_position[tok_pred[aligned]],
+                                 minlength=n_phn * n_phn).reshape(n_phn, n_phn)
+    return error.sum(axis=1) / true_len, ed_accumalate_by_class
 
 
 def label_smoothing_loss(pred_y, true_y, label_smoothing=0.1):
     # Self defined loss for label smoothing
-    # pred_y is log-scaled and true_y is one-hot format padded with all zero vector
-    assert pred_y.size() == true_y.size()
-    seq_len = torch.sum(torch.sum(true_y, dim=-1), dim=-1, keepdim=True)
-    
-    # calculate smoothen label, last term ensures padding vector remains all zero
-    class_dim = true_y.size()[-1]
-    smooth_y = ((1.0-label_smoothing)*true_y+(label_smoothing/class_dim))*torch.sum(true_y, dim=-1, keepdim=True)
+    # pred_y is log-scaled with shape [batch size, timestep, class dim]
+    # true_y is label index with shape [batch size, timestep], padded with 0
+    # The smoothen label (1-ls)*onehot + ls/class_dim is never materialized, its inner product with pred_y is
+    # (1-ls)*pred_y[true_y] + ls/class_dim*sum(pred_y)
+    assert pred_y.size()[:2] == true_y.size()
+    true_mask = (true_y != 0).type_as(pred_y)
+    seq_len = torch.sum(true_mask, dim=-1, keepdim=True)
 
-    loss = - torch.mean(torch.sum((torch.sum(smooth_y * pred_y, dim=-1)/seq_len), dim=-1))
+    # calculate smoothen label, masking ensures padding remains all zero
+    class_dim = pred_y.size()[-1]
+    smooth_pred = (1.0-label_smoothing)*pred_y.gather(-1, true_y.unsqueeze(-1)).squeeze(-1) \
+        + (label_smoothing/class_dim)*torch.sum(pred_y, dim=-1)
+
+    loss = - torch.mean(torch.sum((smooth_pred * true_mask / seq_len), dim=-1))
 
     return loss
 
 
 def train(train_set, model, optimizer, tf_rate, conf, global_step, log_writer, data='timit'):
-    bucketing = conf['model_parameter']['bucketing']
     use_gpu = conf['model_parameter']['use_gpu']
     label_smoothing = conf['model_parameter']['label_smoothing']
 
@@ -133,10 +138,12 @@ def train(train_set, model, optimizer, tf_rate, conf, global_step, log_writer, d
     model.train()
 
     # Training
-    for batch_index, (batch_data, batch_label) in enumerate(train_set):
-        if bucketing:
+    for batch_index, (batch_data, batch_label, batch_length) in enumerate(train_set):
+        # Pre-batched buckets (LibriSpeech) are loaded with batch_size 1, drop the extra leading dim
+        if batch_data.dim() == 4:
             batch_data = batch_data.squeeze(dim=0)
-            batch_label = batch_data.squeeze(dim=0)
+            batch_label = batch_label.squeeze(dim=0)
+            batch_length = batch_length.squeeze(dim=0)
         max_label_len = min([batch_label.size()[1], conf['model_parameter']['max_label_len']])
 
         batch_data = Variable(batch_data).type(torch.FloatTensor)
@@ -146,33 +153,28 @@ def train(train_set, model, optimizer, tf_rate, conf, global_step, log_writer, d
             batch_data = batch_data.cuda()
             batch_label = batch_label.cuda()
             criterion = criterion.cuda()
+        # Labels are stored as compact (int16) index, widen on the device
+        batch_label = batch_label.long()
 
         optimizer.zero_grad()
 
-        raw_pred_seq = model(batch_data, batch_label, tf_rate, batch_label)
+        raw_pred_seq = model(batch_data, batch_label, tf_rate, batch_label, batch_length)
 
-        pred_y = (torch.cat([torch.unsqueeze(each_y, 1) for each_y in raw_pred_seq], 1)[:, :max_label_len, :])\
-            .contiguous()
+        pred_y = stack_raw_pred_seq(raw_pred_seq, max_label_len)
 
         if label_smoothing == 0.0:
             pred_y = pred_y.permute(0, 2, 1)  # pred_y.contiguous().view(-1,output_class_dim)
-            true_y = torch.max(batch_label, dim=2)[1][:, :max_label_len].contiguous()  # .view(-1)
+            true_y = batch_label[:, :max_label_len].contiguous()  # .view(-1)
 
             loss = criterion(pred_y, true_y)
-            # variable -> numpy before sending into LER calculator
-            batch_ler = letter_error_rate(torch.max(pred_y.permute(0, 2, 1), dim=2)[1].cpu().numpy(),
-                                          # .reshape(current_batch_size,max_label_len),
-                                          true_y.cpu().data.numpy(),
-                                          data)  # .reshape(current_batch_size,max_label_len), data)
+            pred_y = pred_y.permute(0, 2, 1)
 
         else:
-            true_y = batch_label[:, :max_label_len, :].contiguous()
-            true_y = true_y.type(torch.cuda.FloatTensor) if use_gpu else true_y.type(torch.FloatTensor)
+            true_y = batch_label[:, :max_label_len].contiguous()
             loss = label_smoothing_loss(pred_y, true_y, label_smoothing=label_smoothing)
-            batch_ler = letter_error_rate(torch.max(pred_y, dim=2)[1].cpu().numpy(),
-                                          # .reshape(current_batch_size,max_label_len),
-                                          torch.max(true_y, dim=2)[1].cpu().data.numpy(),
-                                          data)  # .reshape(current_batch_size,max_label_len), data)
+
+        # LER of every batch, label collapse on the device and batched edit distance (see letter_error_rate)
+        batch_ler = letter_error_rate(torch.max(pred_y.detach(), dim=2)[1], true_y, data)
 
         loss.backward()
         optimizer.step()
@@ -190,7 +192,6 @@ def train(train_set, model, optimizer, tf_rate, conf, global_step, log_writer, d
 
 def evaluate(evaluate_set, model, conf, global_step, log_writer, epoch_begin, train_begin,
              logger, epoch, data='timit'):
-    bucketing = conf['model_parameter']['bucketing']
     use_gpu = conf['model_parameter']['use_gpu']
 
     model.eval()
@@ -200,10 +201,12 @@ def evaluate(evaluate_set, model, conf, global_step, log_writer, epoch_begin, tr
     eval_ler = []
 
     with torch.no_grad():
-        for _, (batch_data, batch_label) in enumerate(evaluate_set):
-            if bucketing:
+        for _, (batch_data, batch_label, batch_length) in enumerate(evaluate_set):
+            # Pre-batched buckets (LibriSpeech) are loaded with batch_size 1, drop the extra leading dim
+            if batch_data.dim() == 4:
                 batch_data = batch_data.squeeze(dim=0)
-                batch_label = batch_data.squeeze(dim=0)
+                batch_label = batch_label.squeeze(dim=0)
+                batch_length = batch_length.squeeze(dim=0)
             max_label_len = min([batch_label.size()[1], conf['model_parameter']['max_label_len']])
 
             batch_data = Variable(batch_data).type(torch.FloatTensor)
@@ -213,21 +216,17 @@ def evaluate(evaluate_set, model, conf, global_step, log_writer, epoch_begin, tr
                 batch_data = batch_data.cuda()
                 batch_label = batch_label.cuda()
                 criterion = criterion.cuda()
+            batch_label = batch_label.long()
 
-            raw_pred_seq = model(batch_data, batch_label, 0, None)
+            raw_pred_seq = model(batch_data, batch_label, 0, None, batch_length)
 
-            pred_y = (torch.cat([torch.unsqueeze(each_y, 1) for each_y in raw_pred_seq], 1)[:, :max_label_len, :])\
-                .contiguous()
+            pred_y = stack_raw_pred_seq(raw_pred_seq, max_label_len)
 
             pred_y = pred_y.permute(0, 2, 1)  # pred_y.contiguous().view(-1,output_class_dim)
-            true_y = torch.max(batch_label, dim=2)[1][:, :max_label_len].contiguous()  # .view(-1)
+            true_y = batch_label[:, :max_label_len].contiguous()  # .view(-1)
 
             loss = criterion(pred_y, true_y)
-            # variable -> numpy before sending into LER calculator
-            batch_ler = letter_error_rate(torch.max(pred_y.permute(0, 2, 1), dim=2)[1].cpu().numpy(),
-                                          # .reshape(current_batch_size,max_label_len),
-                                          true_y.cpu().data.numpy(),
-                                          data)  # .reshape(current_batch_size,max_label_len), data)
+            batch_ler = letter_error_rate(torch.max(pred_y, dim=1)[1], true_y, data)
 
             batch_loss = loss.cpu().data.numpy()
 
@@ -243,14 +242,19 @@ def evaluate(evaluate_set, model, conf, global_step, log_writer, epoch_begin, tr
     train_elapsed = (current - train_begin) / 3600.0
 
     logger.info("epoch: {}, global step: {:6d}, loss: {:.4f}, cer: {:.4f}, elapsed: {:.2f}m {:.2f}h"
-                .format(epoch, global_step, float(now_loss), float(now_cer), epoch_elapsed, train_elapsed))
+                .format(epoch, global_step, float(now_loss[0]), float(now_cer), epoch_elapsed, train_elapsed))
 
     return now_cer
 
 
-def test(evaluate_set, model, conf, global_step, log_writer, logger, epoch, data='timit', mode='normal'):
-    bucketing = conf['model_parameter']['bucketing']
+def test(evaluate_set, model, conf, global_step, log_writer, logger, epoch, data='timit', mode='normal', beam_size=None,
+         confusion=None):
+    # beam_size > 1 decodes with LAS.beam_search (best hypothesis), otherwise with Speller.forward (decode_mode)
+    # Loss is only available without beam search
+    # In phonetic mode, the phone confusion matrix of the whole set is accumulated into confusion [39, 39] if given
     use_gpu = conf['model_parameter']['use_gpu']
+    if beam_size is None:
+        beam_size = conf['model_parameter'].get('beam_size', 1)
 
     model.eval()
 
@@ -260,10 +264,12 @@ def test(evaluate_set, model, conf, global_step, log_writer, logger, epoch, data
     eval_cers = []
 
     with torch.no_grad():
-        for _, (batch_data, batch_label) in enumerate(evaluate_set):
-            if bucketing:
+        for _, (batch_data, batch_label, batch_length) in enumerate(evaluate_set):
+            # Pre-batched buckets (LibriSpeech) are loaded with batch_size 1, drop the extra leading dim
+            if batch_data.dim() == 4:
                 batch_data = batch_data.squeeze(dim=0)
-                batch_label = batch_data.squeeze(dim=0)
+                batch_label = batch_label.squeeze(dim=0)
+                batch_length = batch_length.squeeze(dim=0)
             max_label_len = min([batch_label.size()[1], conf['model_parameter']['max_label_len']])
 
             batch_data = Variable(batch_data).type(torch.FloatTensor)
@@ -273,36 +279,36 @@ def test(evaluate_set, model, conf, global_step, log_writer, logger, epoch, data
                 batch_data = batch_data.cuda()
                 batch_label = batch_label.cuda()
                 criterion = criterion.cuda()
+            batch_label = batch_label.long()
 
-            raw_pred_seq = model(batch_data, batch_label, 0, None)
+            true_y = batch_label[:, :max_label_len].contiguous()  # .view(-1)
 
-            pred_y = (torch.cat([torch.unsqueeze(each_y, 1) for each_y in raw_pred_seq], 1)[:, :max_label_len, :])\
-                .contiguous()
+            if beam_size > 1:
+                best_label, _ = model.beam_search(batch_data, beam_size, batch_length=batch_length)
+                pred_label = best_label[:, 0, :]
+            else:
+                raw_pred_seq = model(batch_data, batch_label, 0, None, batch_length)
 
-            pred_y = pred_y.permute(0, 2, 1)  # pred_y.contiguous().view(-1,output_class_dim)
-            true_y = torch.max(batch_label, dim=2)[1][:, :max_label_len].contiguous()  # .view(-1)
+                pred_y = stack_raw_pred_seq(raw_pred_seq, max_label_len)
 
-            loss = criterion(pred_y, true_y)
+                pred_y = pred_y.permute(0, 2, 1)  # pred_y.contiguous().view(-1,output_class_dim)
+
+                loss = criterion(pred_y, true_y)
+                eval_loss.append(loss.cpu().data.numpy())
+                pred_label = torch.max(pred_y.permute(0, 2, 1), dim=2)[1]
 
             if mode == 'normal':
-                # variable -> numpy before sending into LER calculator
-                batch_ler = letter_error_rate(torch.max(pred_y.permute(0, 2, 1), dim=2)[1].cpu().numpy(),
-                                              # .reshape(current_batch_size,max_label_len),
-                                              true_y.cpu().data.numpy(),
-                                              data)  # .reshape(current_batch_size,max_label_len), data)
+                batch_ler = letter_error_rate(pred_label, true_y, data)
             elif mode == 'phonetic':
-                batch_ler, batch_cers = letter_error_rate_by_phonetic_class(torch.max(pred_y.permute(0, 2, 1), dim=2)[1].cpu().numpy(),
-                                              # .reshape(current_batch_size,max_label_len),
-                                              true_y.cpu().data.numpy(),
-                                              data)  # .reshape(current_batch_size,max_label_len), data)
+                batch_ler, batch_cers = letter_error_rate_by_phonetic_class(pred_label, true_y, data, confusion)
                 eval_cers.extend(batch_cers)
-            batch_loss = loss.cpu().data.numpy()
 
-            eval_loss.append(batch_loss)
             eval_ler.extend(batch_ler)
 
-    now_loss, now_cer = np.array([sum(eval_loss) / len(eval_loss)]), np.mean(eval_ler)
-    log_writer.add_scalars('loss', {'test': now_loss}, global_step)
+    now_cer = np.mean(eval_ler)
+    if eval_loss:
+        now_loss = np.array([sum(eval_loss) / len(eval_loss)])
+        log_writer.add_scalars('loss', {'test': now_loss}, global_step)
     log_writer.add_scalars('cer', {'test': now_cer}, global_step)
 
     logger.info("test epoch: {}, cer: {:.6f}".format(epoch, float(now_cer)))
@@ -330,43 +336,12 @@ def log_parser(log_file_path):
 def collapse_phn(seq, return_phn = False, drop_q = True):
     # Collapse 61 phns to 39 phns
     # http://cdn.intechopen.com/pdfs/15948/InTech-Phoneme_recognition_on_the_timit_database.pdf
-    phonemes = ["b", "bcl", "d", "dcl", "g", "gcl", "p", "pcl", "t", "tcl",
-                "k", "kcl", "dx", "q", "jh", "ch", "s", "sh", "z", "zh",
-                "f", "th", "v", "dh", "m", "n", "ng", "em", "en", "eng",
-                "nx", "l", "r", "w", "y", "hh", "hv", "el", "iy", "ih",
-                "eh", "ey", "ae", "aa", "aw", "ay", "ah", "ao", "oy", "ow",
-                "uh", "uw", "ux", "er", "ax", "ix", "axr", "ax-h", "pau", "epi", "h#"]
-
-    phonemes2index = {k: (v+2) for v, k in enumerate(phonemes)}
-    index2phonemes = {(v+2): k for v, k in enumerate(phonemes)}
-
-    phoneme_reduce_mapping = {"b": "b", "bcl": "h#", "d": "d", "dcl": "h#", "g": "g",
-                               "gcl": "h#", "p": "p", "pcl": "h#", "t": "t", "tcl": "h#",
-                               "k": "k", "kcl": "h#", "dx": "dx", "q": "q", "jh": "jh",
-                               "ch": "ch", "s": "s", "sh": "sh", "z": "z", "zh": "sh",
-                               "f": "f", "th": "th", "v": "v", "dh": "dh", "m": "m",
-                               "n": "n", "ng": "ng", "em": "m", "en": "n", "eng": "ng",
-                               "nx": "n", "l": "l", "r": "r", "w": "w", "y": "y",
-                               "hh": "hh", "hv": "hh", "el": "l", "iy": "iy", "ih": "ih",
-                               "eh": "eh", "ey": "ey", "ae": "ae", "aa": "aa", "aw": "aw",
-                               "ay": "ay", "ah": "ah", "ao": "aa", "oy": "oy", "ow": "ow",
-                               "uh": "uh", "uw": "uw", "ux": "uw", "er": "er", "ax": "ah",
-                               "ix": "ih", "axr": "er", "ax-h": "ah", "pau": "h#", "epi": "h#",
-                               "h#": "h#"}
-
-    # inverse index into phn
-    seq = [index2phonemes[idx] for idx in seq]
-    # collapse phn
-    seq = [phoneme_reduce_mapping[phn] for phn in seq]
+    # The mapping is the reduce_table lookup of util/edit_distance.py, q is mapped to -1
+    seq = reduce_table[np.asarray(seq, dtype=np.int64)]
     # Discard phn q
     if drop_q:
-        seq = [phn for phn in seq if phn != "q"]
-    else:
-        seq = [phn if phn != "q" else ' ' for phn in seq]
+        seq = seq[seq >= 0]
     if return_phn:
-        return seq
-
-    # Transfer back into index sequence for Evaluation
-    seq = [phonemes2index[phn] for phn in seq]
+        return [index2phonemes[idx] if idx >= 0 else ' ' for idx in seq.tolist()]
 
-    return seq
+    return seq.tolist()
@@ -0,0 +1,63 @@
+import os
+import unicodedata
+import numpy as np
+from torch.utils.data import DataLoader
+from torch.utils.data.dataset import Dataset
+from util.feature_store import FeatureSplit
+from util.bucket_sampler import BucketBatchSampler
+from util.librispeech_dataset import LibrispeechCollate
+
+
+# Token vocabulary written by kspon_preprocess.py, token of index i is vocab[i]
+def load_vocab(store_dir):
+    with open(os.path.join(store_dir, 'idx2char.csv'), 'r', encoding='utf-8') as f:
+        next(f)
+        return [line.rstrip('\n').split(',', 1)[1] for line in f]
+
+
+# Text of a label index sequence, stops at <eos> and drops <sos>/padding
+# Jamo sequences are recomposed into Hangul syllables by NFC normalization
+def decode_label(label, vocab):
+    tokens = []
+    for idx in label:
+        if idx == 1:
+            break
+        if idx != 0:
+            tokens.append(vocab[idx])
+    return unicodedata.normalize('NFC', ''.join(tokens))
+
+
+# One utterance of a split of the KsponSpeech feature store per item, read (memory-mapped) when requested
+# Items are (float32 feature with shape (timestep, feature), label indices)
+class KsponDataset(Dataset):
+    def __init__(self, store_dir, split):
+        print('Loading KsponSpeech', split, 'from', store_dir, '...', flush=True)
+        self.features = FeatureSplit(store_dir, split)
+        self.lengths = self.features.lengths
+        self.label_lengths = np.diff(self.features.label_offset)
+
+    def __getitem__(self, index):
+        return np.asarray(self.features[index], dtype=np.float32), self.features.get_label(index)
+
+    def __len__(self):
+        return len(self.features)
+
+
+# Batches are grouped by length with BucketBatchSampler (batch_size utterances, or max_frames padded frames per
+# batch), training batches leave out labels longer than max_label_len and are replanned every epoch from seed
+# Features are read by num_workers processes, each keeping prefetch_factor batches ready
+# drop_last drops the batches of less than batch_size utterances (not supported with max_frames), logger receives
+# the padding efficiency of every epoch (see BucketBatchSampler.stats)
+def create_dataloader(data_path, max_label_len, batch_size, shuffle, listener_layer, split='train', training=False,
+                      num_workers=4, prefetch_factor=4, max_frames=None, seed=None, drop_last=False, logger=None,
+                      **kwargs):
+    dataset = KsponDataset(data_path, split)
+    time_scale = 2**listener_layer
+    batch_sampler = BucketBatchSampler(dataset.lengths, batch_size, shuffle, max_frames, time_scale,
+                                       label_lengths=dataset.label_lengths,
+                                       max_label_len=max_label_len if training else None,
+                                       seed=seed, logger=logger, drop_last=drop_last)
+    collate_fn = LibrispeechCollate(time_scale, max_label_len if training else None)
+    worker_args = {'prefetch_factor': prefetch_factor, 'persistent_workers': True} if num_workers > 0 else {}
+    return DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=collate_fn, num_workers=num_workers,
+                      **worker_args)
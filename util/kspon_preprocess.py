@@ -1,31 +1,177 @@
+# KsponSpeech preprocessing
+# Raw 16 kHz / 16 bit .pcm files are read through np.memmap and turned into fbank (or log mel) features by a pool of
+# worker processes, shard by shard, straight into a feature store (see util/feature_store.py), so memory stays flat
+# whatever the size of the corpus (~1000 hours) :
+#   <store_dir>/{train,valid,test}.*   features, token labels and utterance ids of every split (the merged index of
+#                                      a split holds the frame and label length of every utterance)
+#   <store_dir>/norm.npz               mean / std of the training features (--norm_x), applied at load time
+#   <store_dir>/idx2char.csv           token vocabulary (Hangul jamo or syllables)
+# Shards are written atomically, an interrupted run resumes from the shards already on disk
 import os
+import re
 import sys
 import random
-
-if len(sys.argv) != 3:
-    print('Usage:python3 preprocess.py <kspon directory> <output_file>')
+import argparse
+import functools
+import multiprocessing
+from collections import Counter
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from util.frontend import logfbank, log_mel_spectrogram
+from util.feature_store import extract_split, write_norm_param, NORM_FILE
 
 
 ##### SCRIPT META VARIABLES #####
 txt_file_postfix = '.txt'
 pcm_file_postfix = '.pcm'
+rate = 16000
+hop_length = 160
 
 ##### Validation split #####
-# default using 5% of data as validation
+# Recording directories are shuffled (with --seed) and split : 80% train + valid (10% of it as validation), 20% test
 test_split = 0.8
 val_split = 0.1
 
 data_type = 'float32'
 
-paths = sys.argv[1]
-directories = os.listdir(paths)
-random.shuffle(directories)
-dir_num = len(directories)
-train_num = int(dir_num * test_split)
-test_num = dir_num - train_num
-valid_num = int(train_num * val_split)
-train_num = train_num - valid_num
-train_source_path = directories[:train_num]
-valid_source_path = directories[train_num:train_num+valid_num]
-test_source_path = directories[train_num+valid_num:]
-pass
\ No newline at end of file
+
+##### TRANSCRIPT #####
+# KsponSpeech transcription conventions : (spelling)/(pronunciation) dual transcriptions, noise tags b/ l/ o/ n/ u/,
+# and the symbols + * / marking repetitions, unclear words and fillers
+
+def clean_transcript(text, transcript='phonetic'):
+    pick = 2 if transcript == 'phonetic' else 1
+    text = re.sub(r'\(([^)]*)\)/\(([^)]*)\)', lambda m: m.group(pick), text)
+    text = re.sub(r'(^|\s)[blonu]/', ' ', text)
+    text = re.sub(r'[+*/]', '', text)
+    return ' '.join(text.split())
+
+
+def read_transcript(txt_path):
+    # Transcripts are CP949 encoded in the original release, UTF-8 in some redistributions
+    with open(txt_path, 'rb') as f:
+        raw = f.read()
+    try:
+        return raw.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return raw.decode('cp949').strip()
+
+
+##### TOKENIZER #####
+# Hangul syllables are split into conjoining jamo (choseong, jungseong and optional jongseong), which recompose
+# with unicodedata.normalize('NFC', ...). Other characters (space, punctuation, digits, latin) are kept as tokens
+HANGUL_FIRST = 0xAC00
+JAMO_TABLE = {HANGUL_FIRST + code: chr(0x1100 + code // 588) + chr(0x1161 + (code % 588) // 28) +
+              (chr(0x11A7 + code % 28) if code % 28 else '') for code in range(11172)}
+
+
+def tokenize(text, unit='jamo'):
+    return list(text.translate(JAMO_TABLE)) if unit == 'jamo' else list(text)
+
+
+def build_vocab(token_lists):
+    # <sos> = 0, <eos> = 1, <unk> = 2 (tokens unseen in training), then training tokens by decreasing frequency
+    counts = Counter(token for tokens in token_lists for token in tokens)
+    return ['<sos>', '<eos>', '<unk>'] + sorted(counts, key=lambda token: (-counts[token], token))
+
+
+##### FEATURE #####
+
+def read_pcm(pcm_path):
+    return np.memmap(pcm_path, dtype='<i2', mode='r', shape=(os.path.getsize(pcm_path) // 2,))
+
+
+def pcm2feature(pcm_path, feature='fbank', n_filters=40, win_size=0.025):
+    """Features (float32) with shape (timestep, n_filters) and seconds of audio of one .pcm file
+    fbank : log mel filterbank of the LibriSpeech preprocessing, mel : log mel spectrogram of the TIMIT one"""
+    sig = read_pcm(pcm_path)
+    if feature == 'fbank':
+        feat = logfbank(sig, rate, winlen=win_size, nfilt=n_filters)
+    else:
+        feat = log_mel_spectrogram(sig / 32767.5, sr=rate, n_fft=int(win_size * rate), hop_length=hop_length,
+                                   n_mels=n_filters).T
+    return feat.astype(data_type), len(sig) / rate
+
+
+def list_utterances(directories, transcript, min_samples):
+    # (utterance id, pcm path, cleaned transcript) of every recording under directories, sorted by path
+    utterances = []
+    for directory in directories:
+        for dir_path, _, files in sorted(os.walk(directory)):
+            for file in sorted(files):
+                if not file.endswith(pcm_file_postfix):
+                    continue
+                pcm_path = os.path.join(dir_path, file)
+                txt_path = pcm_path[:-len(pcm_file_postfix)] + txt_file_postfix
+                if not os.path.isfile(txt_path) or os.path.getsize(pcm_path) // 2 < min_samples:
+                    continue
+                text = clean_transcript(read_transcript(txt_path), transcript)
+                if text:
+                    utterances.append((file[:-len(pcm_file_postfix)], pcm_path, text))
+    return utterances
+
+
+def recording_directories(paths):
+    # Leaf directories holding .pcm files (KsponSpeech_0x/KsponSpeech_xxxx)
+    return sorted(dir_path for dir_path, _, files in os.walk(paths)
+                  if any(file.endswith(pcm_file_postfix) for file in files))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='KsponSpeech preprocess.')
+    parser.add_argument('kspon_path', type=str, help='KsponSpeech directory')
+    parser.add_argument('store_dir', type=str, help='Feature store directory to write')
+    parser.add_argument('--feature', type=str, default='fbank', choices=['fbank', 'mel'])
+    parser.add_argument('--n_filters', type=int, default=40, help='Number of mel filters (Default : 40)')
+    parser.add_argument('--win_size', type=float, default=0.025, help='Window size in seconds (Default : 0.025)')
+    parser.add_argument('--unit', type=str, default='jamo', choices=['jamo', 'syllable'], help='Label unit')
+    parser.add_argument('--transcript', type=str, default='phonetic', choices=['phonetic', 'spelling'],
+                        help='Side of the (spelling)/(pronunciation) dual transcriptions to keep')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the directory split')
+    parser.add_argument('--n_jobs', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--shard_size', type=int, default=1000, help='Utterances per shard')
+    parser.add_argument('--norm_x', action='store_true', help='Save mean / std of the training features')
+    parser.add_argument('--restart', action='store_true', help='Recompute every shard instead of resuming')
+    paras = parser.parse_args()
+
+    directories = recording_directories(paras.kspon_path)
+    random.Random(paras.seed).shuffle(directories)
+    dir_num = len(directories)
+    train_num = int(dir_num * test_split)
+    valid_num = int(train_num * val_split)
+    train_num = train_num - valid_num
+    split_dirs = [('train', directories[:train_num]),
+                  ('valid', directories[train_num:train_num+valid_num]),
+                  ('test', directories[train_num+valid_num:])]
+
+    min_samples = int(paras.win_size * rate)
+    splits = []
+    for split, dirs in split_dirs:
+        utterances = list_utterances(dirs, paras.transcript, min_samples)
+        splits.append((split, [(key, pcm_path, tokenize(text, paras.unit)) for key, pcm_path, text in utterances]))
+        print('{} : {} directories, {} utterances'.format(split, len(dirs), len(utterances)), flush=True)
+
+    vocab = build_vocab(tokens for _, _, tokens in splits[0][1])
+    token_index = {token: idx for idx, token in enumerate(vocab)}
+    os.makedirs(paras.store_dir, exist_ok=True)
+    with open(os.path.join(paras.store_dir, 'idx2char.csv'), 'w', encoding='utf-8') as f:
+        f.write('idx,char\n')
+        for idx, token in enumerate(vocab):
+            f.write('{},{}\n'.format(idx, token))
+    print('Vocabulary : {} {} tokens (output_class_dim)'.format(len(vocab), paras.unit), flush=True)
+
+    extract = functools.partial(pcm2feature, feature=paras.feature, n_filters=paras.n_filters,
+                                win_size=paras.win_size)
+    with multiprocessing.Pool(paras.n_jobs) as pool:
+        for split, utterances in splits:
+            if len(utterances) == 0:
+                continue
+            utterances = [(key, pcm_path, [token_index.get(token, 2) for token in tokens])
+                          for key, pcm_path, tokens in utterances]
+            stats = extract_split(pool, paras.store_dir, split, utterances, extract, paras.shard_size, paras.restart)
+            # Normalization parameters of the training features, applied by KsponDataset at load time
+            if split == 'train':
+                if paras.norm_x:
+                    write_norm_param(paras.store_dir, stats)
+                elif os.path.isfile(os.path.join(paras.store_dir, NORM_FILE)):
+                    os.remove(os.path.join(paras.store_dir, NORM_FILE))
@@ -0,0 +1,5 @@
+if [ "$#" -ne 1 ]; then
+    echo "Usage : ./kspon_preprocess.sh <KsponSpeech folder>"
+fi
+
+python3 kspon_preprocess.py $1 $1/fbank40 --unit jamo --norm_x
@@ -1,27 +1,62 @@
 from six.moves import cPickle
+import os
 import numpy as np
+import torch
 from torch.utils.data import DataLoader
 from torch.utils.data.dataset import Dataset
 import pandas as pd
 from tqdm import tqdm
 from joblib import Parallel, delayed
+from util.feature_store import load_norm_param, FeatureSplit
+from util.bucket_sampler import BucketBatchSampler
 
 
-def get_data(data_table,i):
-    return np.load(data_table.loc[i]['input'])
+# Features are normalized when loaded if the preprocessing saved normalization parameters (--norm_x)
+# next to the dataset csv
+def get_data(data_table,i,norm_param=None):
+    x = np.load(data_table.loc[i]['input'])
+    if norm_param is not None:
+        x = (x-norm_param[0])/norm_param[1]
+    return x
 
 def load_dataset(data_path):
     data_table = pd.read_csv(data_path,index_col=0)
+    norm_param = load_norm_param(os.path.dirname(data_path))
     #for i in tqdm(range(len(data_table))):
     #    X.append(np.load(data_table.loc[i]['input']))
 
-    X = Parallel(n_jobs=-2,backend="threading")(delayed(get_data)(data_table,i) for i in tqdm(range(len(data_table))))
+    X = Parallel(n_jobs=-2,backend="threading")(delayed(get_data)(data_table,i,norm_param)
+                                                for i in tqdm(range(len(data_table))))
 
     Y = []
     for i in tqdm(range(len(data_table))):
         Y.append([int(v) for v in data_table.loc[i]['label'].split(' ')[1:]])
     return X,Y
 
+# Index of a dataset csv (idx,input,label), built once and cached next to it as <csv name>.index.npz
+#   paths        feature file of every utterance
+#   lengths      number of frames of every utterance (read from the .npy headers)
+#   labels       int32 label indices of all utterances, concatenated
+#   label_offset labels of utterance i are labels[label_offset[i]:label_offset[i+1]]
+def load_index(data_path):
+    index_path = os.path.splitext(data_path)[0]+'.index.npz'
+    if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(data_path):
+        with np.load(index_path) as index:
+            return {key:index[key] for key in index.files}
+
+    data_table = pd.read_csv(data_path,index_col=0)
+    paths = np.array(data_table['input'].tolist(),dtype=str)
+    # Label strings are ' i1 i2 ... in', one space per label
+    label_str = data_table['label'].fillna('').astype(str)
+    index = {'paths':paths,
+             'lengths':np.array([np.load(path,mmap_mode='r').shape[0] for path in tqdm(paths)],dtype=np.int64),
+             'labels':np.array(' '.join(label_str).split(),dtype=np.int32),
+             'label_offset':np.append(0,np.cumsum(label_str.str.count(' ').values))}
+    with open(index_path+'.tmp','wb') as f:
+        np.savez(f,**index)
+    os.replace(index_path+'.tmp',index_path)
+    return index
+
 # Input x: list of np array with shape (timestep,feature)
 # Return new_x : a np array of shape (len(x), padded_timestep, feature)
 def ZeroPadding(x,pad_len):
@@ -32,104 +67,115 @@ def ZeroPadding(x,pad_len):
     return new_x
 
 # A transfer function for LAS label
-# We need to collapse repeated label and make them onehot encoded
-# each sequence should end with an <eos> (index = 1)
-# Input y: list of np array with shape ()
-# Output tuple: (indices, values, shape)
-def OneHotEncode(Y,max_len,max_idx=30):
-    new_y = np.zeros((len(Y),max_len,max_idx))
+# Labels are truncated to max_len-1 and each sequence should end with an <eos> (index = 1)
+# Input y: list of label index sequences
+# Output : np array of label index with shape (len(Y), max_len), zero padded
+def LabelEncode(Y,max_len):
+    new_y = np.zeros((len(Y),max_len),dtype=np.int16)
     for idx,label_seq in enumerate(Y):
-        cnt = 0
-        for label in label_seq:
-            new_y[idx,cnt,label] = 1.0
-            cnt += 1
-            if cnt == max_len-1:
-                break
-        new_y[idx,cnt,1] = 1.0 # <eos>
+        cnt = min(len(label_seq),max_len-1)
+        new_y[idx,:cnt] = label_seq[:cnt]
+        new_y[idx,cnt] = 1 # <eos>
     return new_y
 
 
+# Whole dataset loaded and padded in memory (bucketing=False)
+# data_path is either the feature store written by librispeech_preprocess.py (split selects train/valid/test), or a
+# dataset csv of the former preprocessing
 class LibrispeechDataset(Dataset):
-    def __init__(self, data_path, batch_size, max_label_len,bucketing,listener_layer,drop_last=False,training=False):
+    def __init__(self, data_path, max_label_len, split='train'):
         print('Loading LibriSpeech data from',data_path,'...',flush=True)
+        print('***Warning*** Loading LibriSpeech without bucketing requires large RAM')
+        if os.path.isdir(data_path):
+            features = FeatureSplit(data_path,split)
+            X = [np.asarray(x,dtype=np.float32) for x in tqdm(features)]
+            Y = list(features.get_labels())
+        else:
+            X,Y = load_dataset(data_path)
+        max_timestep = max([len(x) for x in X])
+        self.X = ZeroPadding(X,max_timestep)
+        self.Y = LabelEncode(Y,max_label_len)
+        self.X_len = np.array([len(x) for x in X])
 
-        self.data_table = pd.read_csv(data_path,index_col=0)
-        self.bucketing = bucketing
-        self.drop_last = drop_last
-        self.batch_size = batch_size
-        self.training = training
-        self.max_label_len = max_label_len
-        self.time_scale = 2**listener_layer
+    # Items are (padded feature, label index, number of unpadded frames)
+    def __getitem__(self, index):
+        return self.X[index],self.Y[index],self.X_len[index]
 
-        
-        if not bucketing:
-            print('***Warning*** Loading LibriSpeech without bucketing requires large RAM')
-            X,Y = load_dataset(data_path)
-            max_timestep = max([len(x) for x in X])
-            self.X = ZeroPadding(X,max_timestep)
-            self.Y = OneHotEncode(Y,max_label_len)
+    def __len__(self):
+        return len(self.X)
+
+
+# One utterance per item, features are read from disk when the item is requested (by DataLoader workers)
+# data_path is either the feature store written by librispeech_preprocess.py (split selects train/valid/test), or a
+# dataset csv of the former preprocessing with one .npy per utterance
+# Items are (float32 feature with shape (timestep,feature), label indices)
+class LibrispeechUtteranceDataset(Dataset):
+    def __init__(self, data_path, split='train'):
+        print('Loading LibriSpeech index from',data_path,'...',flush=True)
+        if os.path.isdir(data_path):
+            self.features = FeatureSplit(data_path,split)
+            index = {'paths':None,'lengths':self.features.lengths,'labels':self.features.labels,
+                     'label_offset':self.features.label_offset}
         else:
-            #print('Bucketing data ...',flush=True)
-            if self.training:
-                pass
-            else:
-                X,Y = load_dataset(data_path)
-                bucket_x = []
-                bucket_y = []
-                for b in tqdm(range(int(np.ceil(len(X)/batch_size)))):
-                    left = b*batch_size
-                    if (b+1)*batch_size<len(X):
-                        right = (b+1)*batch_size
-                    else:
-                        if drop_last:
-                            break
-                        else:
-                            right = len(X)
-                    pad_len = len(X[left]) if (len(X[left]) % self.time_scale) == 0 else\
-                              len(X[left])+(self.time_scale-len(X[left])%self.time_scale)
-                    if training:
-                        onehot_len = min(max([len(y) for y in Y[left:right]])+1,max_label_len)
-                    else:
-                        onehot_len = max([len(y) for y in Y[left:right]])+1
-                    
-                    bucket_x.append(ZeroPadding(X[left:right], pad_len))
-                    bucket_y.append(OneHotEncode(Y[left:right], onehot_len))
-                    
-                self.X = bucket_x
-                self.Y = bucket_y
+            self.features = None
+            index = load_index(data_path)
+        self.paths = index['paths']
+        self.lengths = index['lengths']
+        self.labels = index['labels']
+        self.label_offset = index['label_offset']
+        self.norm_param = load_norm_param(os.path.dirname(data_path)) if self.features is None else None
 
     def __getitem__(self, index):
-        if not self.bucketing:
-            return self.X[index],self.Y[index]
+        if self.features is not None:
+            x = self.features[index]
         else:
-            if self.training:
-                index = min(index, len(self.data_table)-self.batch_size)
-                X = []
-                Y = []
-                for i in range(self.batch_size):
-                    X.append(get_data(self.data_table,index+i))
-                    Y.append([int(v) for v in self.data_table.loc[index+i]['label'].split(' ')[1:]])
-                pad_len = len(X[0]) if (len(X[0]) % self.time_scale) == 0 else len(X[0])+(self.time_scale-len(X[0])%self.time_scale)
-                if self.training:
-                    onehot_len = min(max([len(y) for y in Y])+1,self.max_label_len)
-                else:
-                    onehot_len = max([len(y) for y in Y])+1
-                return ZeroPadding(X, pad_len),OneHotEncode(Y, onehot_len)
-            else:
-                return self.X[index],self.Y[index]
-        
+            x = np.load(self.paths[index])
+        if self.norm_param is not None:
+            x = (x-self.norm_param[0])/self.norm_param[1]
+        return np.asarray(x,dtype=np.float32),self.labels[self.label_offset[index]:self.label_offset[index+1]]
+
     def __len__(self):
-        if self.training:
-            return len(self.data_table)
-        else:
-            return len(self.X)
+        return len(self.lengths)
+
+
+# Pads a batch of (feature, label) to its longest utterance rounded up to time_scale (2**listener_layer)
+# Returns (padded features, encoded labels, number of unpadded frames), label length is capped at max_label_len
+class LibrispeechCollate(object):
+    def __init__(self, time_scale, max_label_len=None):
+        self.time_scale = time_scale
+        self.max_label_len = max_label_len
+
+    def __call__(self, batch):
+        x_len = np.array([len(x) for x,_ in batch])
+        pad_len = int(np.ceil(x_len.max()/self.time_scale)*self.time_scale)
+        batch_x = np.zeros((len(batch),pad_len,batch[0][0].shape[-1]),dtype=np.float32)
+        for idx,(x,_) in enumerate(batch):
+            batch_x[idx,:len(x)] = x
+        label_len = max([len(y) for _,y in batch])+1
+        if self.max_label_len is not None:
+            label_len = min(label_len,self.max_label_len)
+        batch_y = LabelEncode([y for _,y in batch],label_len)
+        return torch.from_numpy(batch_x),torch.from_numpy(batch_y),torch.from_numpy(x_len)
 
 
+# With bucketing, utterances are grouped by length with BucketBatchSampler (batch_size utterances, or max_frames
+# padded frames per batch), training batches leave out labels longer than max_label_len and are replanned every
+# epoch from seed. Features are read by num_workers processes, each keeping prefetch_factor batches ready
+# drop_last drops the batches of less than batch_size utterances (not supported with max_frames), logger receives
+# the padding efficiency of every epoch (see BucketBatchSampler.stats)
 def create_dataloader(data_path, max_label_len, batch_size, shuffle, bucketing, listener_layer, drop_last=False, training=False,
-                    **kwargs):
+                    num_workers=4, prefetch_factor=4, max_frames=None, seed=None, split='train', logger=None, **kwargs):
     if not bucketing:
-        return DataLoader(LibrispeechDataset(data_path, batch_size,max_label_len,bucketing,listener_layer,training=training),
+        return DataLoader(LibrispeechDataset(data_path,max_label_len,split),
                           batch_size=batch_size,shuffle=shuffle,drop_last=drop_last)
     else:
-        return DataLoader(LibrispeechDataset(data_path, batch_size,max_label_len,bucketing,listener_layer,drop_last=drop_last,
-                          training=training), batch_size=1,shuffle=shuffle)
\ No newline at end of file
+        dataset = LibrispeechUtteranceDataset(data_path,split)
+        time_scale = 2**listener_layer
+        batch_sampler = BucketBatchSampler(dataset.lengths,batch_size,shuffle,max_frames,time_scale,
+                                           label_lengths=np.diff(dataset.label_offset),
+                                           max_label_len=max_label_len if training else None,
+                                           seed=seed,logger=logger,drop_last=drop_last)
+        collate_fn = LibrispeechCollate(time_scale,max_label_len if training else None)
+        worker_args = {'prefetch_factor':prefetch_factor,'persistent_workers':True} if num_workers > 0 else {}
+        return DataLoader(dataset,batch_sampler=batch_sampler,collate_fn=collate_fn,num_workers=num_workers,
+                          **worker_args)
@@ -1,13 +1,24 @@
-
-from pydub import AudioSegment
+# LibriSpeech preprocessing
+# Every .flac is decoded in memory (soundfile) and turned into log mel fbank features in a single pass, shards of
+# utterances are processed by a pool of worker processes which write them straight into a feature store
+# (see util/feature_store.py) :
+#   <store_dir>/{train,valid,test}.* fbank features, character labels and utterance ids of every split (--dev_sets
+#                                    are written as the valid split, see feature_store.SPLITS)
+#   <store_dir>/norm.npz             mean / std of the training features (--norm_x), applied at load time
+#   <root>/idx2chap.csv              character mapping
+# Shards are written atomically, so an interrupted run resumes from the shards already on disk (a shard is reused when
+# it holds the same utterances as the shard to compute)
 import os
-import numpy as np
-from tqdm import tqdm
-from joblib import Parallel, delayed
-import scipy.io.wavfile as wav
-from python_speech_features import logfbank
-
+import sys
+import functools
 import argparse
+import multiprocessing
+import numpy as np
+import soundfile as sf
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# python_speech_features.logfbank with the framing vectorized and the filterbank built once
+from util.frontend import logfbank
+from util.feature_store import extract_split, write_norm_param, NORM_FILE
 
 
 parser = argparse.ArgumentParser(description='Librispeech preprocess.')
@@ -32,251 +43,94 @@ parser.add_argument('--win_size', dest='win_size', action='store', default=0.025
                    help='window size during feature extraction (Default : 0.025 [25ms])')
 parser.add_argument('--norm_x', dest='norm_x', action='store', default=False ,
                    help='Normalize features s.t. mean = 0 std = 1')
+parser.add_argument('--store_dir', dest='store_dir', action='store', default=None ,
+                   help='Feature store directory (Default : <root>/fbank<n_filters>/)')
+parser.add_argument('--shard_size', dest='shard_size', action='store', default=500 ,
+                   help='Utterances per shard, the unit of work of a process and of resuming (Default : 500)')
+parser.add_argument('--restart', dest='restart', action='store_true',
+                   help='Recompute every shard instead of resuming')
 
 
-paras = parser.parse_args()
-
-root = paras.root
-train_path = paras.tr_sets
-dev_path = paras.dev_sets
-test_path = paras.tt_sets
-n_jobs = paras.n_jobs
-n_filters = paras.n_filters
-win_size = paras.win_size
-norm_x = paras.norm_x
-
-
-def traverse(root,path,search_fix='.flac',return_label=False):
-    f_list = []
-
+# Utterances of the given sets as (utterance id, flac path, transcript), in directory order
+def traverse(root,path):
+    utterances = []
     for p in path:
-        p = root + p
+        p = os.path.join(root,p)
         for sub_p in sorted(os.listdir(p)):
-            for sub2_p in sorted(os.listdir(p+sub_p+'/')):
-                if return_label:
-                    # Read trans txt
-                    with open(p+sub_p+'/'+sub2_p+'/'+sub_p+'-'+sub2_p+'.trans.txt','r') as txt_file:
-                        for line in txt_file:
-                            f_list.append(' '.join(line[:-1].split(' ')[1:]))
-                else:
-                    # Read acoustic feature
-                    for file in sorted(os.listdir(p+sub_p+'/'+sub2_p)):
-                        if search_fix in file:
-                            file_path = p+sub_p+'/'+sub2_p+'/'+file
-                            f_list.append(file_path)   
-    return f_list
-
-def flac2wav(f_path):
-    flac_audio = AudioSegment.from_file(f_path, "flac")
-    flac_audio.export(f_path[:-5]+'.wav', format="wav")
-
-def wav2logfbank(f_path):
-    (rate,sig) = wav.read(f_path)
-    fbank_feat = logfbank(sig,rate,winlen=win_size,nfilt=n_filters)
-    np.save(f_path[:-3]+'fb'+str(n_filters),fbank_feat)
-
-def norm(f_path,mean,std):
-    np.save(f_path,(np.load(f_path)-mean)/std)
-
-
-print('----------Processing Datasets----------')
-print('Training sets :',train_path)
-print('Validation sets :',dev_path)
-print('Testing sets :',test_path)
-
-
-
-# # flac2wav
-print('---------------------------------------')
-print('Processing flac2wav...',flush=True)
-
-print('Training',flush=True)
-tr_file_list = traverse(root,train_path)          
-results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(flac2wav)(i) for i in tqdm(tr_file_list))
-
-print('Validation',flush=True)
-dev_file_list = traverse(root,dev_path)   
-results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(flac2wav)(i) for i in tqdm(dev_file_list))
-
-print('Testing',flush=True)
-tt_file_list = traverse(root,test_path)   
-results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(flac2wav)(i) for i in tqdm(tt_file_list))
-                  
-
-
-# # wav 2 log-mel fbank
-print('---------------------------------------')
-print('Processing wav2logfbank...',flush=True)
-
-print('Training',flush=True)
-results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(wav2logfbank)(i[:-4]+'wav') for i in tqdm(tr_file_list))
-
-print('Validation',flush=True)
-results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(wav2logfbank)(i[:-4]+'wav') for i in tqdm(dev_file_list))
-
-print('Testing',flush=True)
-results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(wav2logfbank)(i[:-4]+'wav') for i in tqdm(tt_file_list))
-                    
-
-
-# # log-mel fbank 2 feature
-print('---------------------------------------') 
-print('Preparing Training Dataset...',flush=True)
-
-tr_file_list = traverse(root,train_path,search_fix='.fb'+str(n_filters))
-tr_text = traverse(root,train_path,return_label=True)
-
-X = []
-for f in tr_file_list:
-    X.append(np.load(f))
-
-# Normalize X
-if norm_x:
-    mean_x = np.mean(np.concatenate(X,axis=0),axis=0)
-    std_x = np.std(np.concatenate(X,axis=0),axis=0)
-
-    results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(norm)(i,mean_x,std_x) for i in tqdm(tr_file_list))
-
-
-# Sort data by signal length (long to short)
-audio_len = [len(x) for x in X]
-
-tr_file_list = [tr_file_list[idx] for idx in reversed(np.argsort(audio_len))]
-tr_text = [tr_text[idx] for idx in reversed(np.argsort(audio_len))]
-
-# Create char mapping
-char_map = {}
-char_map['<sos>'] = 0
-char_map['<eos>'] = 1
-char_idx = 2
-
-# map char to index
-for text in tr_text:
-    for char in text:
-        if char not in char_map:
-            char_map[char] = char_idx
-            char_idx +=1
-            
-# Reverse mapping
-rev_char_map = {v:k for k,v in char_map.items()}
-
-# Save mapping
-with open(root+'idx2chap.csv','w') as f:
-    f.write('idx,char\n')
-    for i in range(len(rev_char_map)):
-        f.write(str(i)+','+rev_char_map[i]+'\n')
-
-# text to index sequence
-tmp_list = []
-for text in tr_text:
-    tmp = []
-    for char in text:
-        tmp.append(char_map[char])
-    tmp_list.append(tmp)
-tr_text = tmp_list
-del tmp_list
-
-# write dataset
-file_name = 'train.csv'
-
-print('Writing dataset to '+root+file_name+'...',flush=True)
-
-with open(root+file_name,'w') as f:
-    f.write('idx,input,label\n')
-    for i in range(len(tr_file_list)):
-        f.write(str(i)+',')
-        f.write(tr_file_list[i]+',')
-        for char in tr_text[i]:
-            f.write(' '+str(char))
-        f.write('\n')
-
-print()
-print('Preparing Validation Dataset...',flush=True)
-
-dev_file_list = traverse(root,dev_path,search_fix='.fb'+str(n_filters))
-dev_text = traverse(root,dev_path,return_label=True)
-
-X = []
-for f in dev_file_list:
-    X.append(np.load(f))
-
-# Normalize X
-if norm_x:
-    results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(norm)(i,mean_x,std_x) for i in tqdm(dev_file_list))
-
-
-# Sort data by signal length (long to short)
-audio_len = [len(x) for x in X]
-
-dev_file_list = [dev_file_list[idx] for idx in reversed(np.argsort(audio_len))]
-dev_text = [dev_text[idx] for idx in reversed(np.argsort(audio_len))]
-
-# text to index sequence
-tmp_list = []
-for text in dev_text:
-    tmp = []
-    for char in text:
-        tmp.append(char_map[char])
-    tmp_list.append(tmp)
-dev_text = tmp_list
-del tmp_list
-
-# write dataset
-file_name = 'dev.csv'
-
-print('Writing dataset to '+root+file_name+'...',flush=True)
-
-with open(root+file_name,'w') as f:
-    f.write('idx,input,label\n')
-    for i in range(len(dev_file_list)):
-        f.write(str(i)+',')
-        f.write(dev_file_list[i]+',')
-        for char in dev_text[i]:
-            f.write(' '+str(char))
-        f.write('\n')
-
-print()
-print('Preparing Testing Dataset...',flush=True)
-
-test_file_list = traverse(root,test_path,search_fix='.fb'+str(n_filters))
-tt_text = traverse(root,test_path,return_label=True)
-
-X = []
-for f in test_file_list:
-    X.append(np.load(f))
-
-# Normalize X
-if norm_x:
-    results = Parallel(n_jobs=n_jobs,backend="threading")(delayed(norm)(i,mean_x,std_x) for i in tqdm(test_file_list))
-
-
-# Sort data by signal length (long to short)
-audio_len = [len(x) for x in X]
-
-test_file_list = [test_file_list[idx] for idx in reversed(np.argsort(audio_len))]
-tt_text = [tt_text[idx] for idx in reversed(np.argsort(audio_len))]
-
-# text to index sequence
-tmp_list = []
-for text in tt_text:
-    tmp = []
-    for char in text:
-        tmp.append(char_map[char])
-    tmp_list.append(tmp)
-tt_text = tmp_list
-del tmp_list
-
-# write dataset
-file_name = 'test.csv'
-
-print('Writing dataset to '+root+file_name+'...',flush=True)
-
-with open(root+file_name,'w') as f:
-    f.write('idx,input,label\n')
-    for i in range(len(test_file_list)):
-        f.write(str(i)+',')
-        f.write(test_file_list[i]+',')
-        for char in tt_text[i]:
-            f.write(' '+str(char))
-        f.write('\n')
-
+            for sub2_p in sorted(os.listdir(os.path.join(p,sub_p))):
+                chapter = os.path.join(p,sub_p,sub2_p)
+                with open(os.path.join(chapter,sub_p+'-'+sub2_p+'.trans.txt'),'r') as txt_file:
+                    for line in txt_file:
+                        utt_id,text = line.rstrip('\n').split(' ',1)
+                        utterances.append((utt_id,os.path.join(chapter,utt_id+'.flac'),text))
+    return utterances
+
+# Decode a flac file, returns (float32 fbank features, seconds of audio)
+def wav2logfbank(f_path,n_filters,win_size):
+    sig,rate = sf.read(f_path,dtype='int16')
+    return logfbank(sig,rate,winlen=win_size,nfilt=n_filters).astype(np.float32),len(sig)/rate
+
+
+if __name__ == '__main__':
+    paras = parser.parse_args()
+
+    root = paras.root
+    train_path = paras.tr_sets
+    dev_path = paras.dev_sets
+    test_path = paras.tt_sets
+    n_jobs = int(paras.n_jobs)
+    n_jobs = n_jobs if n_jobs > 0 else max(1,os.cpu_count()+1+n_jobs)
+    n_filters = int(paras.n_filters)
+    win_size = float(paras.win_size)
+    norm_x = paras.norm_x
+    shard_size = int(paras.shard_size)
+    store_dir = paras.store_dir or os.path.join(root,'fbank'+str(n_filters))
+
+    print('----------Processing Datasets----------')
+    print('Training sets :',train_path)
+    print('Validation sets :',dev_path)
+    print('Testing sets :',test_path)
+    print('Feature store :',store_dir)
+
+    splits = [('train',traverse(root,train_path)),('valid',traverse(root,dev_path)),('test',traverse(root,test_path))]
+
+    # Create char mapping
+    char_map = {}
+    char_map['<sos>'] = 0
+    char_map['<eos>'] = 1
+    char_idx = 2
+
+    # map char to index
+    for _,_,text in splits[0][1]:
+        for char in text:
+            if char not in char_map:
+                char_map[char] = char_idx
+                char_idx +=1
+
+    # Reverse mapping
+    rev_char_map = {v:k for k,v in char_map.items()}
+
+    # Save mapping
+    with open(os.path.join(root,'idx2chap.csv'),'w') as f:
+        f.write('idx,char\n')
+        for i in range(len(rev_char_map)):
+            f.write(str(i)+','+rev_char_map[i]+'\n')
+
+    # # flac 2 log-mel fbank, one shard per task
+    print('---------------------------------------')
+    print('Processing flac2logfbank with',n_jobs,'processes...',flush=True)
+    os.makedirs(store_dir,exist_ok=True)
+    with multiprocessing.Pool(n_jobs) as pool:
+        for split,utterances in splits:
+            if len(utterances) == 0:
+                continue
+            # text to index sequence
+            utterances = [(utt_id,f_path,[char_map[char] for char in text]) for utt_id,f_path,text in utterances]
+            extract = functools.partial(wav2logfbank,n_filters=n_filters,win_size=win_size)
+            stats = extract_split(pool,store_dir,split,utterances,extract,shard_size,paras.restart)
+            # Normalization parameters of the training features, applied by the dataset at load time
+            if split == 'train':
+                if norm_x:
+                    write_norm_param(store_dir,stats)
+                elif os.path.isfile(os.path.join(store_dir,NORM_FILE)):
+                    os.remove(os.path.join(store_dir,NORM_FILE))
@@ -0,0 +1,200 @@
+import os
+import pickle
+import multiprocessing
+import numpy as np
+import torch
+from util.timit_dataset import create_dataloader
+from util.functions import stack_raw_pred_seq, letter_error_rate
+
+# Permutation feature importance (PFI) of a trained LAS model on a test set
+# The score of a (feature, repeat) cell is the LER of the test set with the column feature permuted across every real
+# (unpadded) frame of the set, the cell (-1, 0) is the intact set. Every cell draws its own permutation from
+# RandomState([seed, feature, repeat]), so cells give the same result whatever the order (or process) they run in
+#
+# The test set is batched once, as create_dataloader(shuffle=False) does, and kept resident on the device. A permuted
+# batch is a copy of the resident one whose column is gathered from the frames of the set through the permutation,
+# the copies of stack cells are stacked into one batch evaluated by a single forward pass
+#
+# With n_jobs > 1 (CPU only), groups of cells are evaluated by a pool of forked worker processes : the model and the
+# resident test set are moved to shared memory before the fork, so workers read them without copying, and every worker
+# runs cpu_count // n_jobs torch threads so that the pool does not oversubscribe the cores
+# The OpenMP thread pool of torch does not survive a fork (workers may deadlock), so the parent process has to run
+# single threaded : call torch.set_num_threads(1) before its first torch operation (see test_timit.py --n_jobs)
+#
+# Finished cells are appended to a csv file (feature,repeat,cer) which a run resumes from, the legacy result pickle
+# [[cer of the intact set], [cer of every repeat of feature 0], [...], ...] is written once every cell is done
+
+BASELINE = (-1, 0)
+
+
+def cells_path(pkl_path):
+    return os.path.splitext(pkl_path)[0] + '.cells.csv'
+
+
+def read_cells(path):
+    # {(feature, repeat): cer} of the cells in the result file, a line cut by an interruption is ignored
+    cells = {}
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    feature, repeat, cer = line.rstrip('\n').split(',')
+                    cells[(int(feature), int(repeat))] = float(cer)
+                except ValueError:
+                    continue
+    return cells
+
+
+def truncate_cut_line(path):
+    # Drop the last line of the result file if an interruption cut it, before appending to it
+    if os.path.isfile(path):
+        with open(path, 'rb+') as f:
+            content = f.read()
+            if content and not content.endswith(b'\n'):
+                f.truncate(content.rfind(b'\n') + 1)
+
+
+def append_cells(path, cells):
+    # A single write per call, so that lines of concurrent writers never interleave
+    with open(path, 'a') as f:
+        f.write(''.join('{},{},{!r}\n'.format(feature, repeat, float(cer)) for (feature, repeat), cer in cells))
+
+
+def legacy_result(cells, features, n_repeats):
+    return [[cells[BASELINE]]] + [[cells[(feature, repeat)] for repeat in range(n_repeats)] for feature in features]
+
+
+def pfi_cells(features, n_repeats):
+    return [BASELINE] + [(feature, repeat) for feature in features for repeat in range(n_repeats)]
+
+
+# Engine of the pool workers, inherited through fork
+worker_engine = None
+
+
+def init_worker(n_threads):
+    torch.set_num_threads(n_threads)
+
+
+def evaluate_group(group):
+    return group, worker_engine.evaluate(group)
+
+
+# Resident test set and stacked evaluation of (feature, repeat) cells
+class PermutationImportance(object):
+    def __init__(self, model, X, Y, conf, data='timit', stack=8, seed=1):
+        param = conf['model_parameter']
+        self.model = model
+        self.data = data
+        self.stack = stack
+        self.seed = seed
+        self.max_label_len = param['max_label_len']
+        self.beam_size = param.get('beam_size', 1)
+        self.device = torch.device('cuda' if param['use_gpu'] else 'cpu')
+
+        loader = create_dataloader(X, Y, **param, **conf['training_parameter'], shuffle=False)
+        dataset = loader.dataset
+        lengths = dataset.X_len
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        # Real frames of the whole set in utterance order, the rows a permutation shuffles
+        self.frames = torch.from_numpy(np.concatenate([np.asarray(X[idx], dtype=np.float32)
+                                                       for idx in range(len(X))])).to(self.device)
+        self.n_utterances = len(dataset)
+        self.batches = []
+        for indices in loader.batch_sampler:
+            batch_data, batch_label, batch_length = loader.collate_fn([dataset[idx] for idx in indices])
+            # (row, timestep) of every real frame of the batch and its index in self.frames
+            rows = np.repeat(np.arange(len(indices)), lengths[indices])
+            steps = np.concatenate([np.arange(lengths[idx]) for idx in indices])
+            source = np.concatenate([np.arange(offsets[idx], offsets[idx+1]) for idx in indices])
+            self.batches.append((batch_data.float().to(self.device), batch_label.long().to(self.device),
+                                 batch_length, *(torch.from_numpy(a).to(self.device) for a in (rows, steps, source))))
+
+    def permutation(self, feature, repeat):
+        rng = np.random.RandomState([self.seed, feature, repeat])
+        return torch.from_numpy(rng.permutation(len(self.frames))).to(self.device)
+
+    def predict(self, batch_data, batch_label, batch_length):
+        # Label prediction of test() : LAS.beam_search (best hypothesis) if beam_size > 1, Speller.forward otherwise
+        max_label_len = min([batch_label.size()[1], self.max_label_len])
+        true_y = batch_label[:, :max_label_len].contiguous()
+        if self.beam_size > 1:
+            best_label, _ = self.model.beam_search(batch_data, self.beam_size, batch_length=batch_length)
+            return best_label[:, 0, :], true_y
+        raw_pred_seq = self.model(batch_data, batch_label, 0, None, batch_length)
+        return torch.max(stack_raw_pred_seq(raw_pred_seq, max_label_len), dim=2)[1], true_y
+
+    def evaluate(self, cells):
+        # LER of the test set for each cell, all cells in one forward pass per batch
+        permuted = [k for k, (feature, _) in enumerate(cells) if feature >= 0]
+        columns = torch.tensor([cells[k][0] for k in permuted], dtype=torch.long, device=self.device)
+        permutations = [self.permutation(*cells[k]) for k in permuted]
+        stacked = torch.tensor(permuted, dtype=torch.long, device=self.device)
+        ler_sum = np.zeros(len(cells))
+        self.model.eval()
+        with torch.no_grad():
+            for batch_data, batch_label, batch_length, rows, steps, source in self.batches:
+                data = batch_data.unsqueeze(0).repeat(len(cells), 1, 1, 1)
+                if permuted:
+                    frames = torch.stack([permutation[source] for permutation in permutations])
+                    data[stacked[:, None], rows, steps, columns[:, None]] = self.frames[frames, columns[:, None]]
+                pred_y, true_y = self.predict(data.view(-1, *batch_data.shape[1:]), batch_label.repeat(len(cells), 1),
+                                              batch_length.repeat(len(cells)))
+                ler_sum += letter_error_rate(pred_y, true_y, self.data).reshape(len(cells), -1).sum(axis=1)
+        return ler_sum / self.n_utterances
+
+    def share_memory(self):
+        # Move the model and the resident test set to shared memory, so that forked workers do not copy them
+        self.model.share_memory()
+        self.frames.share_memory_()
+        for batch in self.batches:
+            for tensor in batch:
+                tensor.share_memory_()
+
+    def evaluate_parallel(self, groups, n_jobs):
+        # (group, cers) of every group in completion order, evaluated by n_jobs forked processes
+        global worker_engine
+        if torch.get_num_threads() > 1:
+            raise RuntimeError('Parallel PFI forks the process, call torch.set_num_threads(1) before the first torch '
+                               'operation of the parent process (workers may deadlock otherwise)')
+        self.share_memory()
+        worker_engine = self
+        n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+        try:
+            with multiprocessing.get_context('fork').Pool(n_jobs, init_worker, (n_threads,)) as pool:
+                yield from pool.imap_unordered(evaluate_group, groups)
+        finally:
+            worker_engine = None
+
+    def run(self, cells, result_path, logger=None, n_jobs=1):
+        # Evaluate the cells missing from the result file in groups of (at most) stack cells, appending each group
+        # once done. A worker process runs one group at a time, groups are made small enough to keep every worker busy
+        truncate_cut_line(result_path)
+        done = read_cells(result_path)
+        todo = [cell for cell in cells if cell not in done]
+        n_jobs = min(n_jobs, len(todo)) if self.device.type == 'cpu' else 1
+        stack = max(1, min(self.stack, -(-len(todo) // max(n_jobs, 1))))
+        groups = [todo[left:left+stack] for left in range(0, len(todo), stack)]
+        if n_jobs > 1:
+            results = self.evaluate_parallel(groups, n_jobs)
+        else:
+            results = ((group, self.evaluate(group)) for group in groups)
+        finished = len(cells) - len(todo)
+        for group, cers in results:
+            append_cells(result_path, zip(group, cers))
+            done.update(zip(group, cers))
+            finished += len(group)
+            if logger is not None:
+                logger.info("pfi: {}/{} cells, {}".format(finished, len(cells),
+                                                          " ".join("f{}r{}: {:.6f}".format(feature, repeat, cer)
+                                                                   for (feature, repeat), cer in zip(group, cers))))
+        return done
+
+
+def run_pfi(engine, features, n_repeats, pkl_path, logger=None, n_jobs=1):
+    # PFI of features (column indices) with n_repeats permutations each, resumed from the cells of a previous run
+    cells = engine.run(pfi_cells(features, n_repeats), cells_path(pkl_path), logger, n_jobs)
+    result = legacy_result(cells, features, n_repeats)
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(result, f)
+    return result
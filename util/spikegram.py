@@ -0,0 +1,51 @@
+import numpy as np
+
+# Spikegram decoding for the TIMIT_spikegram corpus
+# Every utterance is stored as two raw files, coded block by block (spike_frame samples per block):
+#   <name>_num.raw    int32, number of spikes in each block
+#   <name>_spike.raw  float64, one row of n_structure values per spike: (band, amplitude, position in block, ...)
+
+
+def read_spikes(filename, n_structure=4):
+    x = np.fromfile(filename + "_spike.raw", dtype=np.float64)
+    x = np.reshape(x, (-1, n_structure))
+    num = np.fromfile(filename + "_num.raw", dtype=np.int32)
+    return x, num
+
+
+# Accumulate |amplitude| of every spike at (band, absolute position) into a [n_band, spike_frame*n_data] array
+# Spikes of block k are shifted by k*spike_frame (block offsets of the flat spike array come from np.repeat of num),
+# bincount sums duplicates in spike order, i.e. exactly like spike-by-spike accumulation
+#
+# With delay, the gammatone filter delay of every band is compensated in the same pass : band b is shifted right by
+# delay[b] samples (spikes shifted past the end are dropped) and its first delay[b] samples keep their unshifted
+# value, which is what spikegram[b, delay[b]:] = spikegram[b, :-delay[b]] computes after accumulation
+def decode_spikegram(x, num, spike_frame, n_band, delay=None):
+    n_data = np.shape(num)[0]
+    width = spike_frame * n_data
+    band = x[:, 0].astype(np.int64)
+    position = (x[:, 2] + np.repeat(np.arange(n_data) * spike_frame, num)).astype(np.int64)
+    weight = np.abs(x[:, 1])
+    if delay is not None:
+        delay = np.asarray(delay)[band]
+        shifted = position + delay < width
+        head = position < delay
+        band = np.concatenate([band[shifted], band[head]])
+        position = np.concatenate([position[shifted] + delay[shifted], position[head]])
+        weight = np.concatenate([weight[shifted], weight[head]])
+    spikegram = np.bincount(band * width + position, weights=weight, minlength=n_band * width)
+    return spikegram.reshape(n_band, width)
+
+
+# Peak position of each band of the gammatone filterbank, used as delay in decode_spikegram
+def get_gammatone_delay(filter_path, n_band):
+    gammatone_filter = np.fromfile(filter_path, dtype=np.float64)
+    gammatone_filter = np.reshape(gammatone_filter, (n_band, -1))
+    gammatone_filter = gammatone_filter[:, 1:-1]
+    return np.argmax(np.abs(gammatone_filter), axis=1)
+
+
+def load_spikegram(filename, wav_length, spike_frame, n_band, delay, n_structure=4):
+    x, num = read_spikes(filename, n_structure)
+    spikegram = decode_spikegram(x, num, spike_frame, n_band, delay)
+    return spikegram[:, :wav_length]
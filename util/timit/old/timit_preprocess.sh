@@ -1,7 +0,0 @@
-if [ "$#" -ne 1 ]; then
-    echo "Usage : ./timit_preprocess.sh <timit folder>"
-fi
-echo 'Transfering raw TIMIT wave file format from NIST to RIFF.'
-echo ' '
-# MFCC
-python3 timit_preprocess.py $1 timit_mfcc_39
\ No newline at end of file
@@ -1,7 +0,0 @@
-if [ "$#" -ne 1 ]; then
-    echo "Usage : ./timit_preprocess.sh <timit folder>"
-fi
-echo 'Transfering raw TIMIT wave file format from NIST to RIFF.'
-echo ' '
-# MFCC
-python3 timit_preprocess_librosa_mfcc.py $1 timit_mfcc_120
\ No newline at end of file
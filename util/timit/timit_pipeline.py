@@ -0,0 +1,335 @@
+# reference : https://github.com/Faur/TIMIT
+# 			  https://github.com/jameslyons/python_speech_features/issues/53
+#
+# Single pass TIMIT feature pipeline
+# The TIMIT feature variants (MFCC 39, mel, MFCC, spectrogram, spikegram and their combinations) are described by
+# specs (see timit_features.yaml), all requested variants are computed in one pass over the corpus : each WAV / spike
+# file is read once and shared intermediates (power spectrogram, mel spectrograms, decoded spikegram, frame energies,
+# ...) are computed once per utterance. Every variant is written to its own feature store (see util/feature_store.py)
+# in <timit directory>.
+import os
+# One BLAS / OpenMP thread per process, utterances are parallelized over processes instead
+for thread_env in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+    os.environ.setdefault(thread_env, '1')
+import sys
+import json
+import hashlib
+import argparse
+import multiprocessing
+import timeit; program_start_time = timeit.default_timer()
+import yaml
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from util.features import get_delta, pool_bands, spikegram_spectral, spikegram_temporal, RunningStats
+from util.spikegram import load_spikegram, get_gammatone_delay
+from util.frontend import sub_frame_mel, get_log_mel
+from util.feature_store import write_shard, merge_shards, remove_split, write_norm_param
+import librosa
+
+##### SCRIPT META VARIABLES #####
+phn_file_postfix = '.PHN'
+wav_file_postfix = '.WAV'
+data_type = 'float32'
+
+rate = 16000
+n_fft = 400
+hop_length = 160
+spike_frame = 2048 * 6
+n_structure = 4
+shard_size = 1000
+
+# Train 3696 valid 400 test 192
+dataset_list = [('train', "timit_dataset_list/TRAIN_list.csv"),
+                ('valid', "timit_dataset_list/TEST_developmentset_list.csv"),
+                ('test', "timit_dataset_list/TEST_coreset_list.csv")]
+
+# 61 different phonemes
+phonemes = ["b", "bcl", "d", "dcl", "g", "gcl", "p", "pcl", "t", "tcl", "k", "kcl", "dx", "q", "jh", "ch", "s", "sh", "z", "zh",
+    "f", "th", "v", "dh", "m", "n", "ng", "em", "en", "eng", "nx", "l", "r", "w", "y",
+    "hh", "hv", "el", "iy", "ih", "eh", "ey", "ae", "aa", "aw", "ay", "ah", "ao", "oy",
+    "ow", "uh", "uw", "ux", "er", "ax", "ix", "axr", "ax-h", "pau", "epi", "h#"]
+
+phonemes2index = {k:v for v,k in enumerate(phonemes)}
+
+
+def get_total_duration(file):
+    """Get the length of the phoneme file, i.e. the 'time stamp' of the last phoneme"""
+    for line in reversed(list(open(file))):
+        [_, val, _] = line.split()
+        return int(val)
+
+
+def get_label(phn_fname, total_frames):
+    """Frame-wise phoneme index, phoneme boundaries are scaled from samples to frames"""
+    total_duration = get_total_duration(phn_fname)
+    y_val = np.zeros(total_frames) - 1
+    start_ind = 0
+    with open(phn_fname) as fr:
+        for line in fr:
+            [start_time, end_time, phoneme] = line.rstrip('\n').split()
+            phoneme_num = phonemes2index[phoneme] if phoneme in phonemes2index else -1
+            end_ind = int(np.round(int(end_time) / total_duration * total_frames))
+            y_val[start_ind:end_ind] = phoneme_num
+            start_ind = end_ind
+
+    if -1 in y_val:
+        print('WARNING: -1 detected in TARGET')
+        print(y_val)
+
+    return y_val.astype('int32')
+
+
+gammatone_delay = {}
+
+
+def get_delay(n_band):
+    if n_band not in gammatone_delay:
+        gammatone_delay[n_band] = get_gammatone_delay("timit_dataset_list/Gammatone_Filter_Order4.raw", n_band)
+    return gammatone_delay[n_band]
+
+
+class Utterance(object):
+    """One TIMIT utterance, intermediates are computed on first use and shared by every feature variant"""
+    def __init__(self, wav_fname):
+        self.wav_fname = wav_fname
+        self.cache = {}
+
+    def get(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def raw_sample(self):
+        return self.get('raw_sample', lambda: np.fromfile(self.wav_fname, dtype=np.int16)[512:])
+
+    def sample(self):
+        return self.get('sample', lambda: self.raw_sample() / 32767.5)
+
+    def power_spectrogram(self):
+        # (frequency, frame), copied out of the front-end buffer since several components share it
+        return self.get('power_spectrogram', lambda: get_log_mel(rate, n_fft, hop_length, 40)
+                        .power_spectrogram(self.sample()).T.copy())
+
+    def log_mel(self, n_mels):
+        front_end = get_log_mel(rate, n_fft, hop_length, n_mels)
+        return self.get(('mel', n_mels), lambda: front_end.power_to_db(front_end.mel(self.power_spectrogram().T)))
+
+    def spikegram(self, spikegram_dir, n_band):
+        def compute():
+            filename_spikegram = self.wav_fname.replace('TIMIT', spikegram_dir)
+            return load_spikegram(filename_spikegram[:-4], self.sample().shape[0], spike_frame, n_band,
+                                  get_delay(n_band), n_structure)
+        return self.get(('spikegram', spikegram_dir, n_band), compute)
+
+
+##### FEATURE COMPONENTS #####
+# Every component returns a np array with shape (feature, frame), components of a spec are concatenated along
+# the feature axis
+
+def mel_component(utt, n_mels=40):
+    """log mel spectrogram (librosa.feature.melspectrogram, n_fft=400, hop_length=160)"""
+    return utt.log_mel(n_mels)
+
+
+def mfcc_component(utt, n_mfcc=16):
+    """MFCC (librosa.feature.mfcc, from the default 128 band log mel spectrogram)"""
+    return librosa.feature.mfcc(S=utt.log_mel(128), n_mfcc=n_mfcc)
+
+
+def spectrogram_component(utt, n_bands=40, n_bins=200):
+    """log power spectrogram, the first n_bins frequency bins summed into n_bands bands"""
+    spectrogram = utt.power_spectrogram()[:n_bins, :].T
+    spectrogram = np.sum(spectrogram.reshape(-1, n_bands, n_bins // n_bands), axis=2).T
+    return librosa.core.power_to_db(spectrogram)
+
+
+def spikegram_component(utt, n_band_sum=8, n_time=8, spikegram_dir='TIMIT_spikegram', n_band=32):
+    """Spikegram band energies pooled into n_band_sum bands and n_time sub-frame energies (see spikegram_feature)"""
+    feature = []
+    if n_band_sum:
+        spectral = utt.get(('spikegram_spectral', spikegram_dir, n_band),
+                           lambda: spikegram_spectral(utt.spikegram(spikegram_dir, n_band), n_fft, hop_length))
+        feature.append(pool_bands(spectral, n_band_sum))
+    if n_time:
+        feature.append(utt.get(('spikegram_temporal', spikegram_dir, n_band, n_time),
+                               lambda: spikegram_temporal(utt.spikegram(spikegram_dir, n_band), n_fft, hop_length,
+                                                          n_time)))
+    return np.concatenate(feature, axis=0)
+
+
+def mel_sub_component(utt, n_mels=8, n_sub_fft=50):
+    """log mel spectrogram of n_fft/n_sub_fft sub-frames of every frame, summed over time (n_mels spectral values)
+    and over bands (n_fft/n_sub_fft temporal values)"""
+    num_of_frame = utt.power_spectrogram().shape[1]
+    mel_sub = sub_frame_mel(utt.sample(), num_of_frame, sr=rate, frame=n_fft, hop_length=hop_length,
+                            n_sub_fft=n_sub_fft, n_mels=n_mels)
+    return np.concatenate((np.sum(mel_sub, axis=2).T, np.sum(mel_sub, axis=1).T), axis=0)
+
+
+def psf_mfcc_component(utt, numcep=13, nfilt=26, preemph=0.97, append_energy=True):
+    """MFCC of python_speech_features (25 ms rectangular window every 10 ms on the int16 samples), the log frame energy
+    replaces the first coefficient with append_energy. The last frame is zero padded, so there is one more frame than
+    with the other components for most utterances"""
+    # Only needed by this component
+    import python_speech_features
+    return python_speech_features.mfcc(utt.raw_sample(), rate, winlen=0.025, winstep=0.01, numcep=numcep,
+                                       nfilt=nfilt, preemph=preemph, appendEnergy=append_energy).T
+
+
+components = {'psf_mfcc': psf_mfcc_component,
+              'mel': mel_component,
+              'mfcc': mfcc_component,
+              'spectrogram': spectrogram_component,
+              'spikegram': spikegram_component,
+              'mel_sub': mel_sub_component}
+
+
+def create_feature(utt, spec):
+    """Concatenate the components of spec, then append delta_order orders of delta (window delta_window)"""
+    feature = [components[c['type']](utt, **{k: v for k, v in c.items() if k != 'type'}) for c in spec['components']]
+    feature = np.concatenate(feature, axis=0)
+    out = [feature]
+    for _ in range(spec.get('delta_order', 2)):
+        out.append(get_delta(out[-1], spec.get('delta_window', 2)))
+
+    out = np.concatenate([f.T for f in out], axis=1)
+    return out
+
+
+##### FEATURE CACHE #####
+# Content-addressed cache of per-utterance results : <cache_dir>/<key[:2]>/<key>.npz holding the (unnormalized)
+# feature, keyed by the sha1 of the spec, the wav path and the mtimes of the wav (and spike) files
+# A re-run, or a restart after a crash, only computes the utterances / variants missing from the cache
+
+def cache_key(wav_fname, spec):
+    sources = [wav_fname]
+    for component in spec['components']:
+        if component['type'] == 'spikegram':
+            spike_fname = wav_fname.replace('TIMIT', component.get('spikegram_dir', 'TIMIT_spikegram'))[:-4]
+            sources += [spike_fname + '_spike.raw', spike_fname + '_num.raw']
+    content = [json.dumps(spec, sort_keys=True)]
+    content += ['{}:{}'.format(os.path.abspath(path), os.stat(path).st_mtime_ns) for path in sources]
+    return hashlib.sha1('\n'.join(content).encode('utf-8')).hexdigest()
+
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + '.npz')
+
+
+def load_cache(cache_dir, key):
+    try:
+        with np.load(cache_path(cache_dir, key)) as cached:
+            return cached['feature']
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def save_cache(cache_dir, key, feature):
+    path = cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, feature=feature)
+    os.replace(tmp_path, path)
+
+
+##### PREPROCESSING #####
+
+def process_utterance(task):
+    """Features (float32), their RunningStats and frame-wise label of one utterance for every spec
+    Specs with the same number of frames share the label"""
+    paths, fname, specs, cache_dir = task
+    wav_fname = "{}/{}{}".format(paths, fname, wav_file_postfix)
+    utt = Utterance(wav_fname)
+    result = {}
+    labels = {}
+    for name, spec in specs.items():
+        key = cache_key(wav_fname, spec) if cache_dir else None
+        feature = load_cache(cache_dir, key) if cache_dir else None
+        if feature is None:
+            feature = create_feature(utt, spec).astype(data_type)
+            if cache_dir:
+                save_cache(cache_dir, key, feature)
+        total_frames = feature.shape[0]
+        if total_frames not in labels:
+            labels[total_frames] = get_label("{}/{}{}".format(paths, fname, phn_file_postfix), total_frames)
+        result[name] = feature, RunningStats().update(feature), labels[total_frames]
+    return result
+
+
+def run_pipeline(paths, specs, n_jobs=1, cache_dir=None, chunksize=None):
+    """Compute every spec of specs (dict name -> spec) in a single pass over TIMIT
+    Utterances are spread over n_jobs processes in chunks, results are collected in file list order
+    Features are stored unnormalized, the mean / std of the training frames are saved next to them"""
+    norm_param = {name: RunningStats() for name in specs}
+    pool = None
+    if n_jobs > 1:
+        # librosa loads its submodules lazily, load them once before forking instead of once per worker
+        librosa.feature.mfcc(y=np.zeros(2 * n_fft), sr=rate, n_fft=n_fft, hop_length=hop_length, center=False)
+        pool = multiprocessing.Pool(n_jobs)
+    for split, list_path in dataset_list:
+        file_list = np.loadtxt(list_path, dtype=str)
+        print('Preprocessing {} data...'.format(split))
+        for name in specs:
+            remove_split(os.path.join(paths, name), split)
+        tasks = [(paths, fname, specs, cache_dir) for fname in file_list]
+        if pool is None:
+            results = map(process_utterance, tasks)
+        else:
+            results = pool.imap(process_utterance, tasks,
+                                chunksize=chunksize or max(1, len(tasks) // (n_jobs * 8)))
+
+        X = {name: [] for name in specs}
+        Y = {name: [] for name in specs}
+        keys = []
+        shard = 0
+        for i, (fname, result) in enumerate(zip(file_list, results)):
+            for name, (feature, obs_stats, label) in result.items():
+                if split == 'train':
+                    norm_param[name].merge(obs_stats)
+                X[name].append(feature)
+                Y[name].append(label)
+            keys.append(fname)
+            print('file No.', i + 1, end='\r', flush=True)
+
+            if len(keys) == shard_size or i == len(file_list) - 1:
+                for name in specs:
+                    write_shard(os.path.join(paths, name), split, shard, X[name], Y[name], keys)
+                X = {name: [] for name in specs}
+                Y = {name: [] for name in specs}
+                keys = []
+                shard += 1
+        print('Done')
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print('Saving normalization parameters (mean=0, sd=1 for each channel, applied at load time).')
+    for name in specs:
+        store_dir = os.path.join(paths, name)
+        write_norm_param(store_dir, norm_param[name])
+        for split, _ in dataset_list:
+            merge_shards(store_dir, split)
+        print('Saved', store_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Single pass TIMIT feature pipeline.')
+    parser.add_argument('timit_path', type=str, help='TIMIT directory, feature stores are written in it')
+    parser.add_argument('spec_path', type=str, help='Feature spec yaml (e.g. timit_features.yaml)')
+    parser.add_argument('names', type=str, nargs='*', help='Feature variants to compute (default: all)')
+    parser.add_argument('--n_jobs', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=None, help='Utterances per task sent to a worker')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Per-utterance feature cache (default: <timit directory>/feature_cache, "" to disable)')
+    paras = parser.parse_args()
+
+    specs = yaml.safe_load(open(paras.spec_path, 'r'))
+    if paras.names:
+        specs = {name: specs[name] for name in paras.names}
+    cache_dir = os.path.join(paras.timit_path, 'feature_cache') if paras.cache_dir is None else paras.cache_dir
+
+    run_pipeline(paras.timit_path, specs, paras.n_jobs, cache_dir, paras.chunksize)
+
+    print()
+    print('Preprocessing completed in {:.3f} secs.'.format(timeit.default_timer() - program_start_time))
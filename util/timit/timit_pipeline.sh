@@ -0,0 +1,5 @@
+if [ "$#" -lt 1 ]; then
+    echo "Usage : ./timit_pipeline.sh <timit folder> [feature name ...]"
+fi
+# Every feature variant of timit_features.yaml (or the given ones) in a single pass over TIMIT
+python3 timit_pipeline.py $1 timit_features.yaml ${@:2}
@@ -1,12 +1,20 @@
 from six.moves import cPickle
 import numpy as np
+import torch
 from torch.utils.data import DataLoader
 from torch.utils.data.dataset import Dataset
+from util.feature_store import is_feature_store, load_feature_store
+from util.bucket_sampler import BucketBatchSampler
 
 
+# data_path is either a feature store directory (see util/feature_store.py), opened memory-mapped,
+# or a preprocessing pickle which is loaded into memory
 def load_dataset(data_path, **kwargs):
-    with open(data_path, 'rb') as cPickle_file:
-        [X_train, y_train, X_val, y_val, X_test, y_test] = cPickle.load(cPickle_file)
+    if is_feature_store(data_path):
+        [X_train, y_train, X_val, y_val, X_test, y_test] = load_feature_store(data_path)
+    else:
+        with open(data_path, 'rb') as cPickle_file:
+            [X_train, y_train, X_val, y_val, X_test, y_test] = cPickle.load(cPickle_file)
     for data in [X_train, y_train, X_val, y_val, X_test, y_test]:
         assert len(data) > 0
     return X_train, y_train, X_val, y_val, X_test, y_test
@@ -22,58 +30,69 @@ def zero_padding(x, pad_len):
     return new_x
 
 
-def one_hot_encode(Y, max_len, max_idx=61):
+def encode_label(Y, max_len):
     # A transfer function for LAS label
-    # We need to collapse repeated label and make them onehot encoded
+    # We need to collapse repeated label and shift them by 2 (preserve 0 for <sos>/padding and 1 for <eos>)
     # each sequence should end with an <eos> (index = 1)
-    # Input y: list of np array with shape ()
-    # Output tuple: (indices, values, shape)
-    new_y = np.zeros((len(Y), max_len, max_idx+2))
+    # Input y: list of np array of frame-wise phoneme index with shape (timestep,)
+    # Output : np array of label index with shape (len(Y), max_len), zero padded
+    #          (one-hot targets are only built inside the loss, see util.functions.label_smoothing_loss)
+    new_y = np.zeros((len(Y), max_len), dtype=np.int16)
     for idx, label_seq in enumerate(Y):
-        last_value = -1
-        cnt = 0
-        for label in label_seq:
-            if last_value != label:
-                new_y[idx, cnt, label+2] = 1.0
-                cnt += 1
-                last_value = label
-        new_y[idx, cnt, 1] = 1.0  # <eos>
+        label_seq = np.asarray(label_seq)
+        label_seq = label_seq[np.append(True, label_seq[1:] != label_seq[:-1])]
+        new_y[idx, :len(label_seq)] = label_seq + 2
+        new_y[idx, len(label_seq)] = 1  # <eos>
     return new_y
 
 
+# Items are (feature, label index, number of unpadded frames)
+# Without bucketing, features are padded to max_timestep per item so that memory-mapped features are only read when
+# used. With bucketing, features are returned unpadded and batched by BucketBatchSampler + PadCollate
 class TimitDataset(Dataset):
     def __init__(self, X, Y, max_timestep, max_label_len, bucketing):
-        if not bucketing:
-            self.X = zero_padding(X, max_timestep)
-            self.Y = one_hot_encode(Y, max_label_len)
-        else:
-            batch_size = max_timestep
-            bucket_x = []
-            bucket_y = []
-            sorted_len = [len(t) for t in X]
-            sorted_x = [X[idx] for idx in reversed(np.argsort(sorted_len))]
-            sorted_y = [Y[idx] for idx in reversed(np.argsort(sorted_len))]
-            for b in range(int(np.ceil(len(sorted_x)/batch_size))):
-                left = b*batch_size
-                right = (b+1)*batch_size if (b+1)*batch_size < len(sorted_x) else len(sorted_x)
-                pad_len = len(sorted_x[left]) if (len(sorted_x[left]) % 8) == 0 \
-                    else len(sorted_x[left])+(8-len(sorted_x[left]) % 8)
-                bucket_x.append(zero_padding(sorted_x[left:right], pad_len))
-                bucket_y.append(one_hot_encode(sorted_y[left:right], max_label_len))
-            self.X = bucket_x
-            self.Y = bucket_y
+        self.bucketing = bucketing
+        self.X = X
+        self.Y = encode_label(Y, max_label_len)
+        # Feature stores know the lengths without reading (and normalizing) every utterance
+        self.X_len = np.array(X.lengths if hasattr(X, 'lengths') else [len(x) for x in X])
+        self.max_timestep = max_timestep
 
     def __getitem__(self, index):
-        return self.X[index],self.Y[index]
+        # A feature store reads (and normalizes) the utterance on every access, so it is read once
+        x_i = self.X[index]
+        if not self.bucketing:
+            x = np.zeros((self.max_timestep, x_i.shape[-1]), dtype=np.float32)
+            x[:self.X_len[index]] = x_i
+            return x, self.Y[index], self.X_len[index]
+        return x_i, self.Y[index], self.X_len[index]
 
     def __len__(self):
         return len(self.X)
 
 
-def create_dataloader(X, Y, max_timestep, max_label_len, batch_size, shuffle, bucketing, **kwargs):
+# Collate function padding each batch to its longest utterance, rounded up to a multiple of pad_multiple
+# (2**listener_layer so that every pBLSTM layer halves the time axis exactly)
+class PadCollate(object):
+    def __init__(self, pad_multiple):
+        self.pad_multiple = pad_multiple
+
+    def __call__(self, batch):
+        x_len = np.array([x_len for _, _, x_len in batch])
+        pad_len = int(np.ceil(x_len.max()/self.pad_multiple)*self.pad_multiple)
+        batch_x = np.zeros((len(batch), pad_len, batch[0][0].shape[-1]), dtype=np.float32)
+        for idx, (x, _, _) in enumerate(batch):
+            batch_x[idx, :len(x)] = x
+        batch_y = np.stack([y for _, y, _ in batch])
+        return torch.from_numpy(batch_x), torch.from_numpy(batch_y), torch.from_numpy(x_len)
+
+
+def create_dataloader(X, Y, max_timestep, max_label_len, batch_size, shuffle, bucketing, listener_layer=3,
+                      max_frames=None, **kwargs):
+    dataset = TimitDataset(X, Y, max_timestep, max_label_len, bucketing)
     if not bucketing:
-        return DataLoader(TimitDataset(X, Y, max_timestep, max_label_len, bucketing),
-                          batch_size=batch_size, shuffle=shuffle)
+        return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle)
     else:
-        return DataLoader(TimitDataset(X, Y, batch_size, max_label_len, bucketing),
-                          batch_size=1, shuffle=shuffle)
+        pad_multiple = 2**listener_layer
+        batch_sampler = BucketBatchSampler(dataset.X_len, batch_size, shuffle, max_frames, pad_multiple)
+        return DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=PadCollate(pad_multiple))